@@ -8,58 +8,50 @@ from portfolio_db import (
     init_portfolio_tables, get_portfolios_by_user,
     create_portfolio, add_holding,
     delete_portfolio, get_portfolio_by_id,
-    get_stocks_data, get_all_stocks
+    get_stocks_data, get_all_stocks, get_portfolio_metrics,
+    add_transaction, get_transactions, delete_transaction
 )
 from nav import (
     get_portfolio_holdings, fetch_historical_prices,
     compute_nav_over_time, get_holdings_summary,
     compute_weighted_performance, compute_benchmark_nav,
-    compute_weighted_nav
+    compute_weighted_nav, build_dashboard
 )
+from holdings_import import import_holdings
+from risk import risk_report
+from simulation import simulate_portfolio
+from ledger import load_ledger, check_transactions, TRANSACTION_TYPES
+from instrumentation import request, stage, ENABLED as METRICS_ENABLED
 
 
 
 
 def render_holdings_table(summary: pd.DataFrame, portfolio_currency: str):
-    # Format columns
-    # summary["P&L"] = summary["P&L"].apply(lambda x: f"{x:,.2f} " + portfolio_currency)
-    # summary["P&L"] = pd.to_numeric(summary["P&L"]).apply(lambda x: f"{x:,.2f} {portfolio_currency}")
-    # summary["Stock performance"] = pd.to_numeric(summary["Stock performance"], errors="coerce").apply(lambda x: f"{x:.2f}%")
-    # summary["Weight"] = pd.to_numeric(summary["Weight"], errors="coerce").apply(lambda x: f"{x:.2f}%")
-
-    # summary["Stock performance"] = summary["Stock performance"].apply(lambda x: f"{x:.2f}%")
-    # summary["Weight"] = summary["Weight"].apply(lambda x: f"{x:.2f}%")
-    
-    # Optional: round price columns
-    # summary["Entry Price"] = summary["Entry Price"].round(2)
-    # summary["Current Price"] = summary["Current Price"].round(2)
-    # summary.reset_index(inplace=True)
-    summary.set_index("Ticker", inplace=True)
-    # print(summary.columns)
+    # summary is numeric (see nav.get_holdings_summary); formatting happens here only
+    summary = summary.set_index("Ticker")
 
     # Style function for P&L and Stock performance
     def highlight_perf(val):
-        try:
-            val_float = float(val.replace('%', '').replace(f' {portfolio_currency}', '').replace(',', ''))
-            if val_float > 0:
-                return 'color: green;'
-            elif val_float < 0:
-                return 'color: red;'
-        except:
-            pass
+        if val > 0:
+            return 'color: green;'
+        elif val < 0:
+            return 'color: red;'
         return ''
 
-    # Align numbers and apply styles
+    # Format numbers and apply styles
     styled_df = summary.style\
-        .applymap(highlight_perf, subset=["P&L", "Stock performance"])
-        # .set_properties(**{
-        #     "text-align": "right",
-        #     "font-size": "14px"
-        # }, subset=["Entry Price", "Current Price", "Quantity", "P&L", "Stock performance", "Weight"])\
-        # .set_properties(**{
-        #     "font-weight": "bold"
-        # }, subset=["Ticker"])
-    
+        .format({
+            "Entry Price": "{:,.2f}",
+            "Current Price": "{:,.2f}",
+            "Quantity": "{:,.2f}",
+            "Stock NAV": "{:,.2f}",
+            "Entry Date": lambda d: d.strftime("%Y-%m-%d"),
+            "P&L": lambda x: f"{x:,.2f} {portfolio_currency}",
+            "Stock performance": "{:.2%}",
+            "Weight": "{:.2%}",
+        }, na_rep="-")\
+        .map(highlight_perf, subset=["P&L", "Stock performance"])
+
     # Display in Streamlit
     st.markdown("### 📋 Holdings Overview")
     st.dataframe(styled_df, use_container_width=True)
@@ -150,6 +142,13 @@ else:
             st.session_state.active_portfolio_id = selected_id
             st.rerun()
         st.sidebar.success(f"Opened: {selected_name}")
+        # figures from the last nightly batch_nav.py run
+        nightly = get_portfolio_metrics(selected_id)
+        if nightly:
+            st.sidebar.caption(
+                f"As of {nightly['as_of']}: {nightly['performance']:+.2%} since inception, "
+                f"{nightly['day_change']:+.2%} on the day, P&L {nightly['pnl']:+,.2f}"
+            )
         # if st.sidebar.button("➖ Delete Portfolio"):
         #     delete_portfolio(st.session_state.active_portfolio_id)
         #     st.rerun()
@@ -161,9 +160,9 @@ else:
     st.sidebar.markdown("### 📝 Add Holdings")
     st.sidebar.markdown(
     """
-    **Disclaimer:**  
-    _This version assumes all stocks entered are still held in the portfolio (buy-and-hold).  
-    Sell dates and partial exits will be added in a future update._
+    _The dashboard assumes all stocks entered here are still held (buy-and-hold).
+    Sells, dividends and cash movements recorded under **🧾 Record Transaction**
+    only show in the 🧾 Ledger section._
     """
 )
 
@@ -185,32 +184,70 @@ else:
                 else:
                     st.warning("Please fill all fields.")
 
-        # with st.sidebar.expander("📄 Upload CSV"):
-        #     st.markdown("CSV must have columns: `Ticker`, `Entry Date`, `Entry Price`, `Quantity`")
-        #     uploaded_file = st.file_uploader("Upload CSV", type="csv")
-        #     if "csv_uploaded" not in st.session_state:
-        #         st.session_state.csv_uploaded = False
-        #     # print("########", st.session_state.csv_uploaded)
-        #     if uploaded_file and not st.session_state.csv_uploaded:
-        #         try:
-        #             df = pd.read_csv(uploaded_file)
-        #             required_cols = {"Ticker", "Entry Date", "Entry Price", "Quantity"}
-        #             if not required_cols.issubset(df.columns):
-        #                 st.error("CSV missing required columns.")
-        #             else:
-        #                 for _, row in df.iterrows():
-        #                     add_holding(
-        #                         st.session_state.active_portfolio_id,
-        #                         row["Ticker"],
-        #                         row["Entry Date"],
-        #                         float(row["Entry Price"]),
-        #                         float(row["Quantity"])
-        #                     )
-        #                 st.success("Tickers added from CSV!")
-        #                 st.session_state.csv_uploaded = True
-        #                 st.rerun()
-        #         except Exception as e:
-        #             st.error(f"Error processing CSV: {e}")
+        with st.sidebar.expander("🧾 Record Transaction"):
+            tx_type = st.selectbox("Type", TRANSACTION_TYPES, key="tx_type")
+            tx_date = st.date_input("Date", value=datetime.today(), key="tx_date")
+            tx_ticker = tx_quantity = tx_price = tx_amount = None
+            if tx_type in ("buy", "sell", "dividend"):
+                tx_ticker = stocks_mapping[st.selectbox("Stock", company_names, key="tx_stock")]
+            if tx_type in ("buy", "sell"):
+                tx_quantity = st.number_input("Quantity", min_value=0.0, step=0.01, key="tx_qty")
+                tx_price = st.number_input("Price", min_value=0.0, step=0.01, key="tx_price")
+            else:
+                tx_amount = st.number_input("Amount", min_value=0.0, step=0.01, key="tx_amount")
+            tx_fee = st.number_input("Fee", min_value=0.0, step=0.01, key="tx_fee")
+            if st.button("Record"):
+                if (tx_quantity or 0) > 0 or (tx_amount or 0) > 0:
+                    row = (str(tx_date), tx_type, tx_ticker, tx_quantity, tx_price, tx_amount, tx_fee)
+                    try:
+                        check_transactions(st.session_state.active_portfolio_id, new_rows=[row])
+                    except ValueError as e:
+                        st.error(f"Not recorded: {e}")
+                    else:
+                        add_transaction(st.session_state.active_portfolio_id, tx_type, str(tx_date),
+                                        tx_ticker, tx_quantity, tx_price, tx_amount, tx_fee)
+                        st.success(f"{tx_type.capitalize()} recorded.")
+                        st.rerun()
+                else:
+                    st.warning("Please fill all fields.")
+
+            recorded = get_transactions(st.session_state.active_portfolio_id, with_ids=True)
+            if recorded:
+                st.markdown("**Delete a transaction**")
+                labels = {
+                    row[0]: f"{row[1]} {row[2]} {row[3] or ''} " + (f"{row[4]:g} @ {row[5]:g}" if row[2] in ("buy", "sell") else f"{row[6]:,.2f}")
+                    for row in recorded
+                }
+                tx_id = st.selectbox("Transaction", list(reversed(labels)), format_func=labels.get, key="tx_delete")
+                if st.button("Delete"):
+                    try:
+                        check_transactions(st.session_state.active_portfolio_id, removed_ids={tx_id})
+                    except ValueError as e:
+                        st.error(f"Not deleted: {e}")
+                    else:
+                        delete_transaction(st.session_state.active_portfolio_id, tx_id)
+                        st.success("Transaction deleted.")
+                        st.rerun()
+
+        with st.sidebar.expander("📄 Upload CSV"):
+            st.markdown("CSV must have columns: `Ticker`, `Entry Date`, `Entry Price`, `Quantity`")
+            uploaded_file = st.file_uploader("Upload CSV", type="csv")
+            if "csv_uploaded" not in st.session_state:
+                st.session_state.csv_uploaded = None
+            if uploaded_file and st.session_state.csv_uploaded != uploaded_file.file_id:
+                try:
+                    imported, rejects = import_holdings(
+                        st.session_state.active_portfolio_id,
+                        uploaded_file,
+                        known_tickers=stocks_mapping.values()
+                    )
+                    st.session_state.csv_uploaded = uploaded_file.file_id
+                    st.success(f"{imported} holdings added from CSV!")
+                    if not rejects.empty:
+                        st.warning(f"{len(rejects)} rows were skipped:")
+                        st.dataframe(rejects, use_container_width=True)
+                except Exception as e:
+                    st.error(f"Error processing CSV: {e}")
 
     # Benchmarks
     st.sidebar.markdown("### 📊 Compare to Benchmarks")
@@ -226,6 +263,11 @@ else:
     )
     benchmark_tickers = [benchmark_map[c] for c in user_choices]
 
+    with st.sidebar.expander("🛠 Diagnostics"):
+        record_metrics = st.checkbox("Record stage timings", value=METRICS_ENABLED, key="record_metrics")
+        track_memory = st.checkbox("Track memory (slower)", key="track_memory")
+        profile_run = st.checkbox("Profile next run (cProfile)", key="profile_run")
+
     st.sidebar.markdown("---")
     if st.sidebar.button("🔓 Log Out"):
         st.session_state.logged_in = False
@@ -235,71 +277,136 @@ else:
         st.rerun()
 
     if st.button("START"):
-        # MAIN PAGE
-        # st.subheader("📈 Portfolio Dashboard")
-        if st.session_state.active_portfolio_id:
-            holdings = get_portfolio_holdings(st.session_state.active_portfolio_id)
-            if holdings:
-                tickers = list({h["ticker"] for h in holdings})
-                start_date = min(h["entry_date"] for h in holdings)
-                prices_df = fetch_historical_prices(tuple(tickers), start_date)
-                # Portfolio performance
-                # portfolio_perf = compute_weighted_performance(holdings, prices_df)
-                # nav_df = compute_nav_over_time(holdings, prices_df)
-                # nav_series = nav_df['NAV']
-                # cash_flow_dates = [h["entry_date"].date() for h in holdings]
-                nav_df = compute_weighted_nav(prices_df, holdings)
-                performance = (nav_df.iat[-1] / nav_df.iat[0]) - 1
-                # Benchmark performance
-                benchmark_nav = compute_benchmark_nav(benchmark_tickers, start_date)
-                # combined_df = twrr_df.join(benchmark_nav, how="outer").fillna(method="ffill")
-
-
+        with request("dashboard", enabled=record_metrics or profile_run, memory=track_memory, profile=profile_run) as metrics:
+            # MAIN PAGE
+            # st.subheader("📈 Portfolio Dashboard")
+            if st.session_state.active_portfolio_id:
                 portfolio_name, portfolio_currency = get_portfolio_by_id(st.session_state.active_portfolio_id)
-
-                
-
-                st.markdown(f"# 📈 {portfolio_name}")
-                summary = get_holdings_summary(holdings, prices_df, portfolio_currency)
-                # summary.set_index("Ticker", inplace=True)
-                nav = (summary["Current Price"] * summary["Quantity"]).sum()
-                ptf_pnl = ((summary["Current Price"] - summary["Entry Price"]) * summary.Quantity).sum()
-                ptf_perf = ptf_pnl / ((summary["Entry Price"] * summary["Quantity"]).sum())
-                st.markdown(
-                f"""
-                <div style='font-size: 1.2em; margin-bottom: 0.5em;'>
-                    <strong>Balance:</strong> {nav:,.2f} {portfolio_currency} &nbsp;&nbsp;|&nbsp;&nbsp;
-                    <strong>P&L:</strong> <span style='color:{"green" if ptf_pnl >= 0 else "red"};'>{ptf_pnl:+,.2f} {portfolio_currency}</span> &nbsp;&nbsp;|&nbsp;&nbsp;
-                    <strong>Performance:</strong> <span style='color:{"green" if performance >= 0 else "red"};'>{performance * 100:+.2f}%</span>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
-
-
-                render_holdings_table(summary, portfolio_currency)
-                # st.dataframe(summary)
-                # Plot performance comparison
-                st.markdown("### 📉 Performance Comparison")
-                fig = go.Figure()
-                fig.add_trace(go.Scatter(x=nav_df.index, y=nav_df, mode='lines', name="Portfolio Net Asset Value (Rebased)"))
-                fig.add_trace(go.Scatter(x=benchmark_nav.index, y=benchmark_nav['MASI'], mode='lines', name="MASI (Rebased)"))
-
-                # Optionally plot benchmarks rebased to 100 here
-
-                fig.update_layout(title="Time Weighted Net Asset Value", xaxis_title="Date", yaxis_title="Net Asset Value")
-                st.plotly_chart(fig, use_container_width=True)
-                # fig = go.Figure()
-                # for col in combined_df.columns:
-                #     fig.add_trace(go.Scatter(
-                #         x=combined_df.index,
-                #         y=combined_df[col] * 100,
-                #         mode='lines',
-                #         name=col
-                #     ))
-                # fig.update_layout(title="Portfolio vs Benchmarks", xaxis_title="Date", yaxis_title="Performance (%)")
-                # st.plotly_chart(fig, use_container_width=True)
+                # Cached until the holdings or the prices of their tickers/benchmarks change
+                dashboard = build_dashboard(st.session_state.active_portfolio_id, benchmark_tickers)
+                if dashboard:
+                    holdings = dashboard["Holdings"]
+                    prices_df = dashboard["Prices"]
+                    # Portfolio performance
+                    # portfolio_perf = compute_weighted_performance(holdings, prices_df)
+                    # nav_df = compute_nav_over_time(holdings, prices_df)
+                    # nav_series = nav_df['NAV']
+                    # cash_flow_dates = [h["entry_date"].date() for h in holdings]
+                    nav_df = dashboard["NAV"]
+                    performance = dashboard["Performance"]
+                    # Benchmark performance
+                    benchmark_nav = dashboard["Benchmarks"]
+                    # combined_df = twrr_df.join(benchmark_nav, how="outer").fillna(method="ffill")
+
+                    st.markdown(f"# 📈 {portfolio_name}")
+                    summary = dashboard["Summary"]
+                    nav = summary["Stock NAV"].sum()
+                    ptf_pnl = summary["P&L"].sum()
+                    ptf_perf = ptf_pnl / ((summary["Entry Price"] * summary["Quantity"]).sum())
+                    st.markdown(
+                    f"""
+                    <div style='font-size: 1.2em; margin-bottom: 0.5em;'>
+                        <strong>Balance:</strong> {nav:,.2f} {portfolio_currency} &nbsp;&nbsp;|&nbsp;&nbsp;
+                        <strong>P&L:</strong> <span style='color:{"green" if ptf_pnl >= 0 else "red"};'>{ptf_pnl:+,.2f} {portfolio_currency}</span> &nbsp;&nbsp;|&nbsp;&nbsp;
+                        <strong>Performance:</strong> <span style='color:{"green" if performance >= 0 else "red"};'>{performance * 100:+.2f}%</span>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+                    st.caption("Buy-and-hold view of the holdings: recorded sells, dividends and cash are "
+                               "not applied here, see the 🧾 Ledger section below.")
+
+                    with stage("render.holdings_table", rows=len(summary)):
+                        render_holdings_table(summary, portfolio_currency)
+                    # st.dataframe(summary)
+                    # Plot performance comparison
+                    st.markdown("### 📉 Performance Comparison")
+                    with stage("chart") as record:
+                        fig = go.Figure()
+                        fig.add_trace(go.Scatter(x=nav_df.index, y=nav_df, mode='lines', name="Portfolio Net Asset Value (Rebased)"))
+                        fig.add_trace(go.Scatter(x=benchmark_nav.index, y=benchmark_nav['MASI'], mode='lines', name="MASI (Rebased)"))
+
+                        # Optionally plot benchmarks rebased to 100 here
+
+                        fig.update_layout(title="Time Weighted Net Asset Value (buy-and-hold)", xaxis_title="Date", yaxis_title="Net Asset Value")
+                        st.plotly_chart(fig, use_container_width=True)
+                        record["rows"] = len(nav_df)
+
+                    # Risk
+                    if len(nav_df) > 2:
+                        with stage("risk"):
+                            risk = risk_report(nav_df, benchmark_nav)
+                        st.markdown("### ⚠️ Risk")
+                        risk_metrics = risk["Metrics"]
+                        cols = st.columns(len(risk_metrics))
+                        for col, (label, value) in zip(cols, risk_metrics.items()):
+                            col.metric(label, f"{value:.2f}" if label.startswith(("Beta", "Correlation")) else f"{value:.2%}")
+                        fig_risk = go.Figure()
+                        for column in risk["Series"].columns:
+                            fig_risk.add_trace(go.Scatter(x=risk["Series"].index, y=risk["Series"][column], mode='lines', name=column))
+                        fig_risk.update_layout(title="Drawdown and Rolling Risk (63 days)", xaxis_title="Date")
+                        st.plotly_chart(fig_risk, use_container_width=True)
+
+                    # Projection: current weights held constant, historical days resampled
+                    weights = summary.groupby("Ticker")["Weight"].sum()
+                    daily_returns = prices_df[weights.index].where(prices_df[weights.index] > 0).pct_change().dropna()
+                    if len(daily_returns) > 20:
+                        with stage("simulation"):
+                            projection = simulate_portfolio(daily_returns, weights.to_dict(), years=1, n_paths=5000,
+                                                            method="bootstrap", initial_value=nav, seed=0)
+                        st.markdown("### 🔮 One-Year Projection")
+                        bands = projection["Bands"]
+                        bands.index = pd.bdate_range(nav_df.index[-1], periods=bands.index.max() + 1)[bands.index]
+                        fig_projection = go.Figure()
+                        fig_projection.add_trace(go.Scatter(x=bands.index, y=bands["P95"], mode='lines', line=dict(width=0), showlegend=False))
+                        fig_projection.add_trace(go.Scatter(x=bands.index, y=bands["P5"], mode='lines', line=dict(width=0), fill='tonexty', name="5–95%"))
+                        fig_projection.add_trace(go.Scatter(x=bands.index, y=bands["P75"], mode='lines', line=dict(width=0), showlegend=False))
+                        fig_projection.add_trace(go.Scatter(x=bands.index, y=bands["P25"], mode='lines', line=dict(width=0), fill='tonexty', name="25–75%"))
+                        fig_projection.add_trace(go.Scatter(x=bands.index, y=bands["P50"], mode='lines', name="Median"))
+                        fig_projection.update_layout(title=f"Simulated Balance ({portfolio_currency})", xaxis_title="Date",
+                                                     yaxis_title="Balance")
+                        st.plotly_chart(fig_projection, use_container_width=True)
+                        st.caption(f"Probability of a loss after one year: {projection['Probability of Loss']:.1%}")
+
+                    # Ledger: sells, dividends and cash on top of the holdings (recorded transactions only)
+                    if get_transactions(st.session_state.active_portfolio_id):
+                        with stage("ledger"):
+                            try:
+                                ledger = load_ledger(st.session_state.active_portfolio_id)
+                            except ValueError as e:
+                                ledger = None
+                                st.error(f"Ledger error: {e}")
+                        if ledger:
+                            st.markdown("### 🧾 Ledger")
+                            latest = ledger["Daily"].iloc[-1]
+                            cols = st.columns(5)
+                            for col, label in zip(cols, ["Value", "Cash", "Realized P&L", "Unrealized P&L", "Dividends"]):
+                                col.metric(label, f"{latest[label]:,.2f} {portfolio_currency}")
+                            fig_ledger = go.Figure()
+                            fig_ledger.add_trace(go.Scatter(x=ledger["Daily"].index, y=ledger["Daily"]["NAV"], mode='lines', name="Time Weighted NAV"))
+                            fig_ledger.update_layout(title="Time Weighted NAV (with sells, dividends and cash)", xaxis_title="Date", yaxis_title="Net Asset Value")
+                            st.plotly_chart(fig_ledger, use_container_width=True)
+                            positions = ledger["Positions"].iloc[-1]
+                            st.dataframe(positions[positions != 0].rename("Quantity"), use_container_width=True)
+                            with st.expander(f"Realized trades ({len(ledger['Realized'])})"):
+                                st.dataframe(ledger["Realized"], use_container_width=True)
+                    # fig = go.Figure()
+                    # for col in combined_df.columns:
+                    #     fig.add_trace(go.Scatter(
+                    #         x=combined_df.index,
+                    #         y=combined_df[col] * 100,
+                    #         mode='lines',
+                    #         name=col
+                    #     ))
+                    # fig.update_layout(title="Portfolio vs Benchmarks", xaxis_title="Date", yaxis_title="Performance (%)")
+                    # st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("No tickers added to this portfolio yet.")
             else:
-                st.info("No tickers added to this portfolio yet.")
-        else:
-            st.info("Please create or select a portfolio.")
+                st.info("Please create or select a portfolio.")
+
+        if metrics:
+            with st.expander(f"🛠 Stage timings ({metrics['seconds'] * 1000:,.0f} ms total)"):
+                st.dataframe(pd.DataFrame(metrics["stages"]), use_container_width=True)
+                if metrics["profile"]:
+                    st.code(metrics["profile"])
@@ -3,8 +3,12 @@ import pandas as pd
 import numpy as np
 
 from data_handler import load_prices, calculate_daily_returns, calculate_cumulative_returns, calculate_portfolio_return
-from optimizer import optimize_portfolio
-from visualizations import plot_pie_chart, plot_cumulative_returns
+from optimizer import optimize_portfolio, efficient_frontier
+from visualizations import plot_pie_chart, plot_cumulative_returns, plot_efficient_frontier
+from instrumentation import request
+from simulation import simulate_portfolio
+from backtest import walk_forward
+from rebalancing import simulate_policies, policy_grid
 
 # -----------------------------
 # Define preloaded portfolios
@@ -56,6 +60,12 @@ elif input_mode == "Preloaded Portfolio":
     selected = st.sidebar.selectbox("Choose a portfolio:", list(PRELOADED_PORTFOLIOS.keys()))
     portfolio = PRELOADED_PORTFOLIOS[selected]
 
+# Rebalancing costs
+st.sidebar.header("Rebalancing Costs")
+cost_bps = st.sidebar.number_input("Proportional cost (bps of value traded)", min_value=0.0, value=10.0, step=1.0)
+fixed_cost = st.sidebar.number_input("Fixed cost per rebalance", min_value=0.0, value=0.0, step=1.0)
+initial_value = st.sidebar.number_input("Portfolio value", min_value=1.0, value=100000.0, step=1000.0)
+
 # Button to trigger optimization
 if st.sidebar.button("Optimize Portfolio"):
 
@@ -67,10 +77,22 @@ if st.sidebar.button("Optimize Portfolio"):
 
         with st.spinner("Fetching price data..."):
             prices = load_prices(tickers)
+            if prices.attrs.get("download_errors"):
+                failed = prices.attrs["download_errors"]
+                st.warning("No price data for: " + ", ".join(f"{t} ({reason})" for t, reason in failed.items()))
+                tickers = list(prices.columns)
+                # the remaining tickers keep their relative weights and stay fully invested
+                total = sum(portfolio[t] for t in tickers)
+                weights = [portfolio[t] / total for t in tickers] if total > 0 else []
+                portfolio = dict(zip(tickers, weights))
+            if len(prices) < 2 or not weights:
+                st.error("Not enough price data to analyse this portfolio.")
+                st.stop()
             daily_returns = calculate_daily_returns(prices)
             cumulative_value, cumulative_return = calculate_cumulative_returns(daily_returns)
 
-        with st.spinner("Optimizing portfolio..."):
+        # Stage timings are recorded when PORTFOLIO_METRICS=1 (see instrumentation.py)
+        with st.spinner("Optimizing portfolio..."), request("optimize_portfolio"):
             results = {}
             methods = {"Original": weights, "Max Sharpe": None, "Min Volatility": None}
 
@@ -118,10 +140,64 @@ if st.sidebar.button("Optimize Portfolio"):
             }) for label in methods
         }
 
+        # Share of simulated one-year paths (bootstrapped from the same daily returns) ending below today's value
+        with request("simulation"):
+            for label, w in methods.items():
+                projection = simulate_portfolio(daily_returns, w, years=1, n_paths=5000, method="bootstrap", seed=0)
+                metrics_table[label]["Prob. of Loss (1Y)"] = f"{projection['Probability of Loss'] * 100:.1f}%"
+
         metrics_df = pd.DataFrame(metrics_table).T.reset_index().rename(columns={"index": "Portfolio"})
         metrics_df.set_index("Portfolio", inplace=True)
         st.write(metrics_df)
 
+        # ⚖️ Rebalancing: the table above assumes free daily rebalancing; compare realistic policies
+        st.subheader("⚖️ Rebalancing Policies (Original weights)")
+        policies = policy_grid(("D", "M", "Q", "Y"), (0.0, 0.02, 0.05, 0.1)) + [(None, 0.0)]
+        with request("rebalancing"):
+            rebalancing = simulate_policies(daily_returns, weights, policies, proportional_cost=cost_bps / 10000,
+                                            fixed_cost=fixed_cost, initial_value=initial_value)
+        policy_summary = rebalancing["Summary"].sort_values("Final Value", ascending=False)
+        st.dataframe(policy_summary.style.format({
+            "Annual Return": "{:.2%}", "Volatility": "{:.2%}", "Rebalances": "{:d}",
+            "Turnover": "{:.1%}", "Cost Drag": "{:.3%}", "Final Value": "{:,.0f}",
+        }))
+        shown = list(dict.fromkeys([policy_summary.index[0], "Daily", "Monthly", "Never"]))
+        st.plotly_chart(plot_cumulative_returns(rebalancing["NAV"][shown] / initial_value - 1,
+                                                title="Cumulative Returns After Costs"))
+
+        # 🧭 Efficient Frontier
+        st.subheader("🧭 Efficient Frontier")
+        with request("efficient_frontier"):
+            frontier = efficient_frontier(daily_returns)
+        original_returns = (daily_returns * weights).sum(axis=1)
+        frontier_points = {
+            "Original": (np.std(original_returns) * np.sqrt(252), np.mean(original_returns) * 252)
+        }
+        for label in ["Max Sharpe", "Min Volatility"]:
+            frontier_points[label] = (results[label]["metrics"]["Volatility"], results[label]["metrics"]["Annual Return"])
+        st.plotly_chart(plot_efficient_frontier(frontier, frontier_points))
+
+        # 🔁 Walk-Forward Backtest: re-optimized monthly on the trailing year, out-of-sample only
+        lookback = 252
+        if len(daily_returns) > lookback + 21:
+            st.subheader("🔁 Walk-Forward Backtest (monthly, 1-year lookback)")
+            with st.spinner("Backtesting..."), request("walk_forward"):
+                backtests = {label: walk_forward(daily_returns, m, lookback=lookback)
+                             for label, m in [("Max Sharpe", "sharpe"), ("Min Volatility", "min_vol")]}
+            backtest_df = pd.DataFrame({label: bt["NAV"] - 1 for label, bt in backtests.items()})
+            start = backtest_df.index[0]
+            backtest_df["Original"] = (1 + original_returns[original_returns.index > start]).cumprod().reindex(backtest_df.index, fill_value=1) - 1
+            st.plotly_chart(plot_cumulative_returns(backtest_df, title="Out-of-Sample Cumulative Returns"))
+            st.write(pd.DataFrame({
+                label: {
+                    "Annual Return": f"{bt['Annual Return'] * 100:.2f}%",
+                    "Volatility": f"{bt['Volatility'] * 100:.2f}%",
+                    "Sharpe Ratio": f"{bt['Sharpe Ratio']:.2f}",
+                    "Max Drawdown": f"{bt['Max Drawdown'] * 100:.2f}%",
+                    "Avg. Turnover": f"{bt['Turnover'].iloc[1:].mean() * 100:.1f}%",
+                } for label, bt in backtests.items()
+            }).T)
+
         # 📊 Portfolio Allocation Tabs
         st.subheader("📊 Portfolio Allocations")
         tab1, tab2, tab3 = st.tabs(["Original", "Max Sharpe", "Min Volatility"])
@@ -0,0 +1,152 @@
+# Walk-forward (out-of-sample) backtests of optimize_portfolio methods
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from optimizer import CVAR_METHODS, optimize_cvar, optimize_from_moments
+from risk import drawdowns
+
+
+def rebalance_positions(index: pd.DatetimeIndex, lookback: int, rebalance="M"):
+    """
+    Row positions at which the portfolio is re-optimized: the first row with a
+    full lookback window, then the first trading day of every pandas period
+    ('W', 'M', 'Q', 'Y'), or every `rebalance` rows when it is an int.
+    """
+    start = lookback - 1
+    if start >= len(index):
+        return np.array([], dtype=int)
+    if isinstance(rebalance, (int, np.integer)):
+        return np.arange(start, len(index), rebalance)
+    periods = index.to_period(rebalance)
+    first_of_period = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    return np.union1d([start], first_of_period[first_of_period > start])
+
+
+class WindowMoments:
+    """
+    Annualized mean and covariance of a sliding window of return rows, kept as
+    running sums: moving the window costs O(rows moved x assets^2) instead of
+    O(window x assets^2). ddof=0, like optimizer.compute_moments.
+    """
+
+    def __init__(self, values, freq=252):
+        self.values = values
+        self.freq = freq
+        self.start = self.stop = 0
+        self._sum = np.zeros(values.shape[1])
+        self._outer = np.zeros((values.shape[1], values.shape[1]))
+
+    def _add(self, rows, sign):
+        self._sum += sign * rows.sum(axis=0)
+        self._outer += sign * (rows.T @ rows)
+
+    def move(self, start, stop):
+        """
+        Slides the window to rows [start, stop). Both ends only move forward.
+        """
+        if start >= self.stop:
+            # no overlap: starting over is cheaper than removing every row
+            self._sum[:] = 0
+            self._outer[:] = 0
+            self._add(self.values[start:stop], 1)
+        else:
+            self._add(self.values[self.stop:stop], 1)
+            self._add(self.values[self.start:start], -1)
+        self.start, self.stop = start, stop
+
+    def moments(self):
+        n = self.stop - self.start
+        mean = self._sum / n
+        cov = self._outer / n - np.outer(mean, mean)
+        return mean * self.freq, cov * self.freq
+
+
+def walk_forward(returns: pd.DataFrame, method="sharpe", lookback=252, rebalance="M",
+                 bounds=None, cost=0.0, freq=252, **cvar_options):
+    """
+    Re-optimizes on the trailing `lookback` rows of returns (calculate_daily_returns
+    output) at every rebalance date (see rebalance_positions) and chains the
+    out-of-sample returns into a NAV. Weights fitted at the close of a rebalance
+    date are held, drifting with prices, until the next one; cost is charged on
+    turnover (e.g. 0.001 = 10 bps per unit traded).
+
+    Moments are updated incrementally as the window slides and every solve is
+    warm-started from the previous weights. When a solve does not converge the
+    drifted holdings are kept (no trade) and the date is listed in "Skipped";
+    a failure on the first rebalance date raises ValueError. CVaR methods ('min_cvar',
+    'max_return_at_cvar') use the window rows as scenarios; cvar_options
+    (level, max_cvar) are passed on to optimizer.optimize_cvar.
+
+    Returns {
+        "NAV": Series starting at 1 on the first rebalance date,
+        "Returns": daily out-of-sample returns,
+        "Weights": DataFrame (rebalance date x ticker) of target weights,
+        "Turnover": Series (rebalance date) of the traded weight fraction,
+        "Skipped": DatetimeIndex of rebalance dates whose solve failed,
+        "Annual Return", "Volatility", "Sharpe Ratio", "Max Drawdown": floats,
+    }
+    """
+    values = returns.to_numpy(dtype=float)
+    num_days, num_assets = values.shape
+    positions = rebalance_positions(returns.index, lookback, rebalance)
+    if len(positions) == 0:
+        raise ValueError(f"Need at least {lookback} rows of returns for a {lookback}-row lookback.")
+
+    window = WindowMoments(values, freq)
+    weights = np.empty((len(positions), num_assets))
+    turnover = np.empty(len(positions))
+    daily = np.zeros(num_days - positions[0])
+    previous = np.full(num_assets, 1.0 / num_assets)
+    drifted = None
+    skipped = []
+
+    with stage("backtest.walk_forward", method=method, assets=num_assets, rebalances=len(positions)):
+        for i, position in enumerate(positions):
+            start = position + 1 - lookback
+            if method in CVAR_METHODS:
+                target = optimize_cvar(values[start:position + 1], method, bounds=bounds, **cvar_options).x
+            else:
+                window.move(start, position + 1)
+                mean, cov = window.moments()
+                result = optimize_from_moments(mean, cov, method, initial_weights=previous, bounds=bounds)
+                if result.success:
+                    target = result.x
+                elif drifted is not None:
+                    # keep the current holdings rather than trade to an unconverged solution
+                    target = drifted
+                    skipped.append(position)
+                else:
+                    raise ValueError(f"Optimization failed on {returns.index[position]:%Y-%m-%d}: {result.message}")
+            weights[i] = previous = target
+            turnover[i] = np.abs(target - drifted).sum() if drifted is not None else np.abs(target).sum()
+
+            # hold until the next rebalance: value of each position grows with its cumulative return
+            end = positions[i + 1] if i + 1 < len(positions) else num_days - 1
+            growth = np.cumprod(1 + values[position + 1:end + 1], axis=0)
+            value = np.r_[1.0, growth @ target]
+            period = value[1:] / value[:-1] - 1
+            offset = position - positions[0]
+            daily[offset + 1:offset + 1 + len(period)] = period
+            # trading costs are paid at the rebalance close (the first one is the initial purchase)
+            daily[offset] = (1 + daily[offset]) * (1 - cost * turnover[i]) - 1
+            if len(growth):
+                drifted = growth[-1] * target / value[-1]
+
+    daily_returns = pd.Series(daily, index=returns.index[positions[0]:], name=method)
+    nav = (1 + daily_returns).cumprod()
+    out_of_sample = daily_returns.iloc[1:]
+    annual_return = out_of_sample.mean() * freq
+    volatility = out_of_sample.std(ddof=0) * np.sqrt(freq)
+    rebalance_dates = returns.index[positions]
+    return {
+        "NAV": nav,
+        "Returns": daily_returns,
+        "Weights": pd.DataFrame(weights, index=rebalance_dates, columns=returns.columns),
+        "Turnover": pd.Series(turnover, index=rebalance_dates, name="Turnover"),
+        "Skipped": returns.index[skipped],
+        "Annual Return": float(annual_return),
+        "Volatility": float(volatility),
+        "Sharpe Ratio": float(annual_return / volatility) if volatility else 0.0,
+        "Max Drawdown": float(drawdowns(nav)["Max Drawdown"].iat[-1]),
+    }
@@ -0,0 +1,274 @@
+# Nightly NAV and P&L for every portfolio, computed in vectorized chunks
+#
+#   python batch_nav.py        (after the day's prices are ingested)
+#
+# Prices come from the shared matrix (price_ingestion.py --export-matrix) when it is current.
+import argparse
+import numpy as np
+import pandas as pd
+from portfolio_db import get_all_holdings, save_portfolio_metrics
+from nav import load_price_series, load_shared_prices
+
+# Cells (portfolios x days x tickers) per chunk; each 3-D work array is 8 bytes per cell
+MAX_CELLS = 1_000_000
+
+
+def load_universe(tickers, start_date):
+    """
+    Loads the union of tickers once, from the last close before start_date.
+    Returns (prices, observed): forward-filled closes (0 before listing) and
+    the mask of days each ticker actually has a close, both dates x tickers.
+    Uses the shared price matrix when it is current for these tickers.
+    """
+    start = pd.Timestamp(start_date).strftime("%Y-%m-%d")
+    shared = load_shared_prices(list(tickers), start)
+    if shared is not None:
+        return shared
+    series = load_price_series(list(tickers), start)
+    if not series:
+        return pd.DataFrame(), pd.DataFrame()
+    raw = pd.concat([series[t] for t in tickers if t in series], axis=1, sort=False).sort_index()
+    return raw.ffill().fillna(0), raw.notna()
+
+
+def _lots(rows):
+    """
+    Holdings rows as one frame, in portfolio / insertion order.
+    """
+    lots = pd.DataFrame(rows, columns=["portfolio_id", "ticker", "entry_date", "entry_price", "quantity"])
+    lots["ticker"] = lots["ticker"].str.upper()
+    lots["entry_date"] = pd.to_datetime(lots["entry_date"])
+    lots["entry_price"] = lots["entry_price"].astype(float)
+    lots["quantity"] = lots["quantity"].astype(float)
+    return lots
+
+
+def _chunks(lots, max_cells):
+    """
+    Groups portfolios (oldest start first) so each chunk's
+    portfolios x days x (most tickers in one portfolio) stays under max_cells.
+    """
+    per_portfolio = lots.groupby("portfolio_id", sort=False).agg(
+        start_row=("start_row", "first"), tickers=("ticker", "nunique")
+    ).sort_values("start_row", kind="stable")
+    n_days = lots.attrs["n_days"]
+    chunk, widest, first_day = [], 0, 0
+    for pid, start_row, tickers in per_portfolio.itertuples(name=None):
+        if chunk and (len(chunk) + 1) * (n_days - first_day) * max(widest, tickers) > max_cells:
+            yield chunk
+            chunk, widest = [], 0
+        if not chunk:
+            first_day = start_row
+        chunk.append(pid)
+        widest = max(widest, tickers)
+    if chunk:
+        yield chunk
+
+
+def _chunk_nav(lots, prices, returns, observed):
+    """
+    compute_weighted_nav for several portfolios at once.
+    lots: the chunk's holdings with integer columns p (portfolio), row (day, -1
+    if no ticker of the universe trades), slot (the ticker's position within its portfolio,
+    -1 if unpriced) and start_row.
+    prices / returns / observed: portfolios x days x slots.
+    Returns (nav, daily_returns, calendar), each portfolios x days; calendar marks
+    the days of each portfolio's own series (its tickers trade, on or after its start).
+    """
+    n_portfolios, n_days, n_slots = prices.shape
+    p, rows, cols = lots["p"].to_numpy(), lots["row"].to_numpy(), lots["slot"].to_numpy()
+    quantity = lots["quantity"].to_numpy()
+    entry_price = lots["entry_price"].to_numpy()
+    day = np.arange(n_days)
+
+    # Each portfolio's own calendar: days its priced tickers trade, from its first day on
+    start_row = lots.groupby("p")["start_row"].first().to_numpy()
+    calendar = observed.any(axis=2) & (day[None, :] >= start_row[:, None])
+    first_row = np.where(calendar.any(axis=1), calendar.argmax(axis=1), n_days)
+    # like compute_weighted_nav, purchases dated off the portfolio's own calendar
+    # (days only other portfolios' tickers trade) are left out
+    rows = np.where((rows >= 0) & calendar[p, np.maximum(rows, 0)], rows, -1)
+    valid = (rows >= 0) & (cols >= 0)
+
+    # Positions: purchases scattered on their dates, then cumulated
+    positions = np.zeros((n_portfolios, n_days, n_slots))
+    np.add.at(positions, (p[valid], rows[valid], cols[valid]), quantity[valid])
+    bought = np.zeros((n_portfolios, n_days, n_slots), dtype=bool)
+    bought[p[valid], rows[valid], cols[valid]] = True
+    np.cumsum(positions, axis=1, out=positions)
+    active = np.logical_or.accumulate(bought, axis=1)
+    event = np.zeros((n_portfolios, n_days), dtype=bool)
+    event[p[valid], rows[valid]] = True
+
+    # Latest user-entered price per (portfolio, ticker) as of each day (last purchase wins)
+    entered = np.full((n_portfolios, n_days, n_slots), np.nan)
+    order = np.flatnonzero(valid)[::-1]
+    keys = (p[order] * n_days + rows[order]) * n_slots + cols[order]
+    _, last = np.unique(keys, return_index=True)
+    entered[p[order[last]], rows[order[last]], cols[order[last]]] = entry_price[order[last]]
+    filled = np.where(np.isnan(entered), 0, day[None, :, None])
+    np.maximum.accumulate(filled, axis=1, out=filled)
+    entered = np.take_along_axis(entered, filled, axis=1)
+    del filled
+
+    # Entry prices replace market prices on the portfolio's first holding date (all tickers)
+    # and on the date of each ticker's first listed holding
+    first_holding = pd.Series(rows).groupby(p).first().to_numpy()
+    first_listed = np.full((n_portfolios, n_slots), -1)
+    listed = pd.Series(rows[cols >= 0]).groupby([p[cols >= 0], cols[cols >= 0]]).first()
+    first_listed[listed.index.get_level_values(0), listed.index.get_level_values(1)] = listed.to_numpy()
+    use_entry = (day[None, :, None] == first_holding[:, None, None]) | (day[None, :, None] == first_listed[:, None, :])
+    use_entry &= event[:, :, None]
+    values = np.where(active, positions * np.where(use_entry, entered, prices), 0.0)
+    del use_entry, entered, positions
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values /= values.sum(axis=2, keepdims=True)
+
+    # Each day uses the weights of the portfolio's latest purchase date on or before it
+    latest_event = np.maximum.accumulate(np.where(event, day[None, :], -1), axis=1)
+    weights = np.take_along_axis(values, np.maximum(latest_event, 0)[:, :, None], axis=1)
+    del values
+    held = active & (latest_event >= 0)[:, :, None]
+    with np.errstate(invalid="ignore"):
+        daily_returns = np.where(held, weights * returns, 0.0).sum(axis=2)
+
+    # the first day of each series only sets the base
+    daily_returns[day[None, :] <= first_row[:, None]] = 0
+    return 100 * np.cumprod(1 + daily_returns, axis=1), daily_returns, calendar
+
+
+def _batches(rows=None, max_cells=MAX_CELLS):
+    """
+    Runs _chunk_nav over all holdings rows (default: every portfolio in the database).
+    Yields (portfolio ids, dates, nav, daily_returns, calendar, lots) per chunk;
+    lots carry p (row in the chunk arrays) and current_price (last close).
+    """
+    lots = _lots(get_all_holdings() if rows is None else rows)
+    if lots.empty:
+        return
+    tickers = list(dict.fromkeys(lots["ticker"]))
+    prices, observed = load_universe(tickers, lots["entry_date"].min())
+    if prices.empty:
+        return
+    dates = prices.index
+    # an extra all-zero, never-observed column pads portfolios with fewer tickers
+    price_values = np.column_stack([prices.to_numpy(dtype=float), np.zeros(len(dates))])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return_values = np.column_stack([prices.pct_change().fillna(0).to_numpy(dtype=float), np.zeros(len(dates))])
+    observed_values = np.column_stack([observed.to_numpy(), np.zeros(len(dates), dtype=bool)])
+    padding = prices.shape[1]
+
+    lots["current_price"] = lots["ticker"].map(prices.iloc[-1])
+    lots["col"] = prices.columns.get_indexer(lots["ticker"])
+    lots["row"] = dates.get_indexer(lots["entry_date"])
+    lots["start_row"] = dates.searchsorted(lots.groupby("portfolio_id")["entry_date"].transform("min"))
+    lots.attrs["n_days"] = len(dates)
+
+    for pids in _chunks(lots, max_cells):
+        chunk = lots[lots["portfolio_id"].isin(pids)].copy()
+        chunk["p"] = chunk["portfolio_id"].map({pid: i for i, pid in enumerate(pids)})
+        chunk = chunk.sort_values("p", kind="stable")
+        first_day = int(chunk["start_row"].min())
+        if first_day >= len(dates):
+            # every portfolio of the chunk starts after the last stored close
+            continue
+        chunk["row"] = np.where(chunk["row"] >= first_day, chunk["row"] - first_day, -1)
+        chunk["start_row"] -= first_day
+
+        # Each portfolio's tickers get slots 0..k-1 in order of first appearance
+        priced = chunk.loc[chunk["col"] >= 0, ["p", "ticker", "col"]].drop_duplicates(["p", "ticker"])
+        priced["slot"] = priced.groupby("p").cumcount()
+        chunk = chunk.merge(priced[["p", "ticker", "slot"]], on=["p", "ticker"], how="left", sort=False)
+        chunk["slot"] = chunk["slot"].fillna(-1).astype(int)
+        slot_cols = np.full((len(pids), max(int(chunk["slot"].max()) + 1, 1)), padding)
+        slot_cols[priced["p"].to_numpy(), priced["slot"].to_numpy()] = priced["col"].to_numpy()
+
+        window = slice(first_day, None)
+        nav, daily_returns, calendar = _chunk_nav(
+            chunk,
+            price_values[window][:, slot_cols].transpose(1, 0, 2),
+            return_values[window][:, slot_cols].transpose(1, 0, 2),
+            observed_values[window][:, slot_cols].transpose(1, 0, 2),
+        )
+        yield pids, dates[window], nav, daily_returns, calendar, chunk
+
+
+def batch_navs(rows=None, max_cells=MAX_CELLS):
+    """
+    Weighted NAV series of every portfolio from all holdings rows (default:
+    every portfolio in the database), loading prices once for the union of tickers.
+    Yields (portfolio_id, nav series) chunk by chunk. Each series matches
+    compute_weighted_nav over fetch_historical_prices.
+    """
+    for pids, dates, nav, _, calendar, _ in _batches(rows, max_cells):
+        for i, pid in enumerate(pids):
+            if calendar[i].any():
+                yield pid, pd.Series(nav[i, calendar[i]], index=dates[calendar[i]], dtype=float)
+
+
+def chunk_metrics(pids, dates, nav, daily_returns, calendar, lots):
+    """
+    Summary figures for every portfolio of a chunk, as {portfolio_id: metrics}:
+    as_of, nav, performance (since inception), day_change, volatility
+    (annualized, population std of daily NAV returns), max_drawdown,
+    market_value, cost_basis, pnl and holdings (number of lots).
+    Portfolios without any priced day are left out.
+    """
+    n_portfolios, n_days = nav.shape
+    has_days = calendar.any(axis=1)
+    first = calendar.argmax(axis=1)
+    last = n_days - 1 - calendar[:, ::-1].argmax(axis=1)
+    # returns of each series after its first day (off-calendar days are 0)
+    counted = calendar & (np.arange(n_days)[None, :] > first[:, None])
+    n_returns = counted.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(counted, daily_returns, 0).sum(axis=1) / n_returns
+        variance = np.where(counted, daily_returns ** 2, 0).sum(axis=1) / n_returns - mean ** 2
+        drawdown = np.where(calendar, nav / np.maximum.accumulate(nav, axis=1) - 1, 0).min(axis=1)
+    portfolio = np.arange(n_portfolios)
+    nav_last = nav[portfolio, last]
+
+    p = lots["p"].to_numpy()
+    quantity = lots["quantity"].to_numpy()
+    current = lots["current_price"].to_numpy(dtype=float)
+    entry_price = lots["entry_price"].to_numpy()
+    market_value = np.bincount(p, np.nan_to_num(current * quantity), n_portfolios)
+    cost_basis = np.bincount(p, entry_price * quantity, n_portfolios)
+    pnl = np.bincount(p, np.nan_to_num((current - entry_price) * quantity), n_portfolios)
+    holdings = np.bincount(p, minlength=n_portfolios)
+
+    return {
+        pid: {
+            "as_of": dates[last[i]].strftime("%Y-%m-%d"),
+            "nav": float(nav_last[i]),
+            "performance": float(nav_last[i] / nav[i, first[i]] - 1),
+            "day_change": float(daily_returns[i, last[i]]) if n_returns[i] else 0.0,
+            "volatility": float(np.sqrt(max(variance[i], 0)) * np.sqrt(252)) if n_returns[i] else 0.0,
+            "max_drawdown": float(drawdown[i]),
+            "market_value": float(market_value[i]),
+            "cost_basis": float(cost_basis[i]),
+            "pnl": float(pnl[i]),
+            "holdings": int(holdings[i]),
+        }
+        for i, pid in enumerate(pids) if has_days[i]
+    }
+
+
+def run_batch(max_cells=MAX_CELLS):
+    """
+    Computes and stores the metrics of every portfolio (portfolio_metrics table).
+    Returns the number of portfolios written.
+    """
+    metrics = {}
+    for chunk in _batches(max_cells=max_cells):
+        metrics.update(chunk_metrics(*chunk))
+    save_portfolio_metrics(metrics)
+    return len(metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nightly NAV, P&L and performance for every portfolio.")
+    parser.add_argument("--max-cells", type=int, default=MAX_CELLS,
+                        help="portfolios x days x tickers per chunk (default %(default)s)")
+    args = parser.parse_args()
+    print(f"Metrics written for {run_batch(args.max_cells)} portfolios")
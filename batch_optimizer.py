@@ -0,0 +1,90 @@
+# Parallel execution of many optimize_portfolio jobs (nightly client runs, multi-method solves)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory, util
+
+import numpy as np
+import pandas as pd
+
+from optimizer import optimize_portfolio
+
+# Shared-memory blocks attached by this worker process, by name
+_ATTACHED = {}
+
+
+def _share_returns(returns: pd.DataFrame):
+    """
+    Copies a returns frame into a shared memory block once.
+    Returns the block and the spec workers need to rebuild the frame.
+    """
+    values = np.ascontiguousarray(returns.to_numpy(dtype=float))
+    block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=float, buffer=block.buf)[:] = values
+    return block, (block.name, values.shape, list(returns.columns))
+
+
+def _close_attached():
+    """
+    Closes this worker's handles on the shared blocks (the parent unlinks them).
+    """
+    while _ATTACHED:
+        _, block = _ATTACHED.popitem()
+        try:
+            block.close()
+        except BufferError:
+            # a returns view is still referenced; the mapping goes with the process
+            pass
+
+
+def _init_worker():
+    # runs when the worker process exits, including at pool shutdown
+    util.Finalize(None, _close_attached, exitpriority=10)
+
+
+def _attach_returns(spec):
+    """
+    Rebuilds a returns frame in a worker as a view on the shared block (no copy).
+    """
+    name, shape, columns = spec
+    if name not in _ATTACHED:
+        _ATTACHED[name] = shared_memory.SharedMemory(name=name)
+    values = np.ndarray(shape, dtype=float, buffer=_ATTACHED[name].buf)
+    return pd.DataFrame(values, columns=columns, copy=False)
+
+
+def _run_job(spec, method, constraints, timeout):
+    returns = _attach_returns(spec)
+    return optimize_portfolio(returns, method=method, time_limit=timeout, **constraints)
+
+
+def run_optimizations(jobs, max_workers=None, timeout=None):
+    """
+    Runs optimize_portfolio for many jobs over a process pool.
+
+    jobs: iterable of (job_id, returns, method, constraints) where constraints is
+          None or a dict of extra optimize_portfolio arguments (e.g. {"bounds": (0, 0.3)}).
+          Jobs passing the same returns object share one copy of it in shared memory.
+    max_workers: pool size, defaults to the number of CPUs.
+    timeout: seconds a single solve may run; it then fails with TimeoutError
+             and its worker moves on to the next job.
+
+    Yields (job_id, result, error) in completion order; result is the
+    optimize_portfolio dict, or None with the exception in error.
+    """
+    shared = {}   # id(returns) -> (returns, block, spec); keeps returns alive so ids stay unique
+    pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+    try:
+        futures = {}
+        for job_id, returns, method, constraints in jobs:
+            if id(returns) not in shared:
+                shared[id(returns)] = (returns, *_share_returns(returns))
+            spec = shared[id(returns)][2]
+            futures[pool.submit(_run_job, spec, method, constraints or {}, timeout)] = job_id
+
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], (None if error else future.result()), error
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for _, block, _ in shared.values():
+            block.close()
+            block.unlink()
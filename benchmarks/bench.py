@@ -0,0 +1,201 @@
+# Benchmark suite for the NAV, optimizer and database hot paths.
+#
+#   python -m benchmarks.bench --sizes small medium --output before.json
+#   python -m benchmarks.bench --sizes small medium --output after.json --compare before.json
+#
+# Every size runs against its own scratch SQLite database filled with a seeded
+# synthetic universe, so results are comparable between runs and machines.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import scipy
+
+import backtest
+import db
+import nav
+import optimizer
+import portfolio_db
+from benchmarks.synthetic import make_universe, make_holdings, load_universe
+
+SIZES = {
+    "small": {"tickers": 50, "years": 1, "holdings": 200, "optimizer_assets": 20},
+    "medium": {"tickers": 500, "years": 10, "holdings": 2000, "optimizer_assets": 50},
+    "large": {"tickers": 2000, "years": 25, "holdings": 5000, "optimizer_assets": 100},
+}
+
+
+def measure(func, repeat, setup=None):
+    """
+    Runs func() repeat times and returns the wall-clock seconds of each run.
+    setup() runs before every call and is not timed. Output printed by func is discarded.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def cases(size, params, seed):
+    """
+    Builds the synthetic data for one size in the configured database and
+    returns [(name, func, setup)] for every benchmarked call.
+    """
+    prices = make_universe(params["tickers"], params["years"], seed)
+    holdings = make_holdings(prices, params["holdings"], seed)
+    rows = [
+        (h["ticker"], h["entry_date"].strftime("%Y-%m-%d"), h["entry_price"], h["quantity"])
+        for h in holdings
+    ]
+    tickers = tuple(dict.fromkeys(h["ticker"] for h in holdings))
+    start_date = min(h["entry_date"] for h in holdings)
+    held_prices = prices.loc[prices.index >= start_date, list(tickers)]
+
+    # every ticker is listed after the first tenth of the period
+    listed = prices.iloc[len(prices) // 10:, :params["optimizer_assets"]]
+    returns = listed.pct_change().dropna()
+
+    portfolio_db.init_portfolio_tables()
+    load_universe(prices)
+    user_id = 1
+    portfolio_id = portfolio_db.create_portfolio(user_id, f"bench-{size}", "MAD")
+    portfolio_db.add_holdings(portfolio_id, rows)
+    single_rows = rows[:min(len(rows), 200)]
+    scratch = {}
+
+    def new_portfolio():
+        scratch["id"] = portfolio_db.create_portfolio(user_id, "scratch", "MAD")
+        portfolio_db.add_holdings(scratch["id"], rows)
+
+    def add_one_by_one():
+        for row in single_rows:
+            portfolio_db.add_holding(scratch["id"], *row)
+
+    def empty_portfolio():
+        scratch["id"] = portfolio_db.create_portfolio(user_id, "scratch", "MAD")
+
+    return [
+        ("compute_weighted_nav", lambda: nav.compute_weighted_nav(held_prices, holdings), None),
+        ("compute_nav_over_time", lambda: nav.compute_nav_over_time(holdings, held_prices), None),
+        ("get_holdings_summary", lambda: nav.get_holdings_summary(holdings, held_prices), None),
+        ("optimize_portfolio[sharpe]", lambda: optimizer.optimize_portfolio(returns, "sharpe"), None),
+        ("optimize_portfolio[min_vol]", lambda: optimizer.optimize_portfolio(returns, "min_vol"), None),
+        ("optimize_portfolio[min_cvar]", lambda: optimizer.optimize_portfolio(returns, "min_cvar"), None),
+        ("walk_forward[sharpe]", lambda: backtest.walk_forward(returns, "sharpe", lookback=min(252, len(returns) // 2)), None),
+        ("walk_forward[min_vol]", lambda: backtest.walk_forward(returns, "min_vol", lookback=min(252, len(returns) // 2)), None),
+        ("fetch_historical_prices[cold]", lambda: nav.fetch_historical_prices(tickers, start_date), nav.invalidate_prices),
+        ("fetch_historical_prices[warm]", lambda: nav.fetch_historical_prices(tickers, start_date), None),
+        ("portfolio_db.create_portfolio", lambda: portfolio_db.create_portfolio(user_id, "scratch", "MAD"), None),
+        (f"portfolio_db.add_holding[x{len(single_rows)}]", add_one_by_one, empty_portfolio),
+        (f"portfolio_db.add_holdings[x{len(rows)}]", lambda: portfolio_db.add_holdings(scratch["id"], rows), empty_portfolio),
+        ("portfolio_db.get_holdings", lambda: portfolio_db.get_holdings(portfolio_id), None),
+        ("portfolio_db.get_portfolios_by_user", lambda: portfolio_db.get_portfolios_by_user(user_id), None),
+        ("portfolio_db.get_portfolio_by_id", lambda: portfolio_db.get_portfolio_by_id(portfolio_id), None),
+        ("portfolio_db.delete_portfolio", lambda: portfolio_db.delete_portfolio(scratch["id"]), new_portfolio),
+        ("portfolio_db.get_price_history", lambda: portfolio_db.get_price_history(tickers, start_date.strftime("%Y-%m-%d")), None),
+    ]
+
+
+def run_size(size, params, seed, repeat, only=None):
+    """
+    Times every case of one size in a fresh scratch database.
+    """
+    workdir = tempfile.mkdtemp(prefix=f"bench-{size}-")
+    previous_db = db.DB_PATH
+    db.configure(os.path.join(workdir, "bench.db"))
+    nav.invalidate_prices()
+    try:
+        results = []
+        for name, func, setup in cases(size, params, seed):
+            if only and not any(pattern in name for pattern in only):
+                continue
+            timings = measure(func, repeat, setup)
+            results.append({
+                "size": size,
+                "name": name,
+                "params": params,
+                "repeat": repeat,
+                "min": min(timings),
+                "median": statistics.median(timings),
+                "mean": statistics.fmean(timings),
+                "timings": timings,
+            })
+            print(f"{size:<7} {name:<40} median {results[-1]['median'] * 1000:10.2f} ms")
+        return results
+    finally:
+        db.configure(previous_db)
+        nav.invalidate_prices()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def environment(seed):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "seed": seed,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+    }
+
+
+def compare(results, baseline_path):
+    """
+    Prints the median of every case against the same case in a previous results file.
+    """
+    with open(baseline_path) as f:
+        baseline = {(r["size"], r["name"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (ratio < 1 is faster):")
+    for result in results:
+        before = baseline.get((result["size"], result["name"]))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else float("inf")
+        print(f"{result['size']:<7} {result['name']:<40} {ratio:8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the NAV, optimizer and database hot paths on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["small"])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case (default %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", help="run only cases whose name contains one of these")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file (default %(default)s)")
+    parser.add_argument("--compare", metavar="JSON", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, SIZES[size], args.seed, args.repeat, args.only))
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(args.seed), "results": results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,64 @@
+# Seeded synthetic universes for the benchmark suite
+import numpy as np
+import pandas as pd
+from db import connection
+
+
+def make_universe(n_tickers, n_years, seed=0, start="2000-01-03"):
+    """
+    Daily closes for n_tickers over n_years of business days.
+    Each ticker follows a geometric random walk with its own drift and volatility,
+    and lists on a random day in the first tenth of the period (0 before).
+    The same arguments always give the same frame.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=252 * n_years, name="date")
+    drift = rng.normal(0.0003, 0.0002, n_tickers)
+    vol = rng.uniform(0.008, 0.03, n_tickers)
+    returns = rng.normal(drift, vol, (len(dates), n_tickers))
+    closes = rng.uniform(20, 500, n_tickers) * np.exp(np.cumsum(np.log1p(returns), axis=0))
+    listed = rng.integers(0, max(len(dates) // 10, 1), n_tickers)
+    closes[np.arange(len(dates))[:, None] < listed[None, :]] = 0
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+    return pd.DataFrame(closes.round(2), index=dates, columns=tickers)
+
+
+def make_holdings(prices, n_holdings, seed=0):
+    """
+    n_holdings purchases of listed tickers on trading days of prices,
+    bought around the close of that day. Returns holdings dicts as used by nav.py.
+    """
+    rng = np.random.default_rng(seed)
+    values = prices.to_numpy()
+    holdings = []
+    while len(holdings) < n_holdings:
+        day = rng.integers(0, len(prices.index))
+        col = rng.integers(0, prices.shape[1])
+        if values[day, col] <= 0:
+            continue
+        holdings.append({
+            "ticker": prices.columns[col],
+            "entry_date": prices.index[day],
+            "entry_price": float(round(values[day, col] * rng.uniform(0.98, 1.02), 2)),
+            "quantity": float(rng.integers(1, 500)),
+        })
+    return holdings
+
+
+def load_universe(prices):
+    """
+    Writes prices into the stocks and stock_prices tables of the configured database
+    (listed days only). Call db.configure first to point at a scratch database.
+    """
+    stacked = prices.where(prices > 0).stack().dropna()
+    rows = [
+        (ticker, date.strftime("%Y-%m-%d"), float(close))
+        for (date, ticker), close in stacked.items()
+    ]
+    with connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO stocks (ticker, company) VALUES (?, ?)",
+            [(ticker, f"Company {ticker}") for ticker in prices.columns]
+        )
+        conn.executemany("INSERT OR REPLACE INTO stock_prices (ticker, date, close) VALUES (?, ?, ?)", rows)
+    return len(rows)
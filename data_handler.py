@@ -1,17 +1,294 @@
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
 import yfinance as yf
 import pandas as pd
 import numpy as np
 
-def load_prices(tickers, start_date="2019-01-01"):
+CACHE_DIR = os.getenv("PRICE_CACHE_DIR", ".price_cache")
+NO_DATA = "no data returned"
+
+# yf.download keeps its results in module-level state reset by every call, so
+# concurrent calls would overwrite each other; it already downloads in threads
+_YAHOO_LOCK = threading.Lock()
+
+def yahoo_provider(tickers, start, end):
+    """
+    Fetches daily close prices from Yahoo Finance for [start, end).
+    Returns a DataFrame with dates as index and one column per ticker.
+    Calls are serialized (see _YAHOO_LOCK); other providers still run chunks concurrently.
+    """
+    with _YAHOO_LOCK:
+        data = yf.download(tickers, start=start, end=end, progress=False, threads=True)
+    if data.empty:
+        return pd.DataFrame()
+    close = data["Close"]
+    if isinstance(close, pd.Series):
+        close = close.to_frame(tickers[0])
+    return close
+
+def csv_provider(directory):
+    """
+    Local stand-in for Yahoo: reads <directory>/<TICKER>.csv files with
+    'date' and '<TICKER>' columns, the layout of historical_prices/.
+    """
+    def provider(tickers, start, end):
+        columns = []
+        for ticker in tickers:
+            path = os.path.join(directory, f"{ticker}.csv")
+            if os.path.exists(path):
+                prices = pd.read_csv(path, index_col="date", parse_dates=True)[ticker]
+                columns.append(prices[(prices.index >= start) & (prices.index < end)])
+        return pd.concat(columns, axis=1, sort=True) if columns else pd.DataFrame()
+    return provider
+
+def http_csv_provider(base_url):
+    """
+    Reads <base_url>/<TICKER>.csv over HTTP (same layout as csv_provider),
+    e.g. historical_prices/ served by `python -m http.server`.
+    Raises for tickers the server doesn't have.
+    """
+    def provider(tickers, start, end):
+        columns = []
+        for ticker in tickers:
+            prices = pd.read_csv(f"{base_url.rstrip('/')}/{ticker}.csv", index_col="date", parse_dates=True)[ticker]
+            columns.append(prices[(prices.index >= start) & (prices.index < end)])
+        return pd.concat(columns, axis=1, sort=True) if columns else pd.DataFrame()
+    return provider
+
+def _connection_failed(error):
+    """
+    True for failures of the connection itself (network down, DNS, timeouts)
+    rather than of a ticker, where retrying ticker by ticker cannot help.
+    requests / curl_cffi exceptions are matched by name so neither needs importing.
+    """
+    while error is not None:
+        if isinstance(error, (ConnectionError, TimeoutError, socket.gaierror)):
+            return True
+        if isinstance(error, URLError) and not isinstance(error, HTTPError):
+            return True
+        if type(error).__name__ in ("ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeout"):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def _fetch_with_retries(provider, tickers, start, end, retries, backoff, deadline=None):
+    """
+    provider(tickers, start, end), retried with exponential backoff; gives up
+    early rather than sleep past deadline (a time.monotonic() value).
+    """
+    for attempt in range(retries + 1):
+        try:
+            return provider(tickers, start, end)
+        except Exception:
+            delay = backoff * 2 ** attempt
+            if attempt == retries or deadline is not None and time.monotonic() + delay > deadline:
+                raise
+            time.sleep(delay)
+
+def _chunk_columns(data, tickers):
+    columns, errors = [], {}
+    for ticker in tickers:
+        series = data[ticker].dropna() if ticker in data.columns else pd.Series(dtype=float)
+        if series.empty:
+            errors[ticker] = NO_DATA
+        else:
+            columns.append(series.rename(ticker))
+    return columns, errors
+
+def _fetch_chunk(provider, tickers, start, end, retries, backoff, fallback_time):
+    """
+    Fetches one chunk. If it keeps failing, tickers are retried one by one
+    so a single bad ticker doesn't lose the rest of the chunk, unless the
+    connection itself failed. The one-by-one pass stops after fallback_time
+    seconds; tickers it didn't reach are reported as errors.
+    Returns (list of close series, {ticker: error message}).
+    """
+    try:
+        data = _fetch_with_retries(provider, tickers, start, end, retries, backoff)
+    except Exception as e:
+        if len(tickers) == 1 or _connection_failed(e):
+            return [], {ticker: str(e) for ticker in tickers}
+        deadline = time.monotonic() + fallback_time
+        columns, errors = [], {}
+        for i, ticker in enumerate(tickers):
+            if time.monotonic() > deadline:
+                errors.update({t: f"not fetched, gave up after {fallback_time:g}s" for t in tickers[i:]})
+                break
+            try:
+                data = _fetch_with_retries(provider, [ticker], start, end, retries, backoff, deadline)
+            except Exception as ticker_error:
+                errors[ticker] = str(ticker_error)
+                if _connection_failed(ticker_error):
+                    errors.update({t: str(ticker_error) for t in tickers[i + 1:]})
+                    break
+                continue
+            ticker_columns, ticker_errors = _chunk_columns(data, [ticker])
+            columns += ticker_columns
+            errors.update(ticker_errors)
+        return columns, errors
+    return _chunk_columns(data, tickers)
+
+def download_prices(tickers, start, end, provider=None, chunk_size=50, max_workers=4, retries=3, backoff=1.0,
+                    fallback_time=30.0):
+    """
+    Downloads closes for [start, end) in chunks of chunk_size tickers,
+    fetched concurrently by at most max_workers threads. Failed requests are
+    retried with exponential backoff (backoff, 2*backoff, ... seconds); a chunk
+    that still fails is retried ticker by ticker for at most fallback_time seconds.
+    Returns (prices DataFrame of the tickers that loaded, {ticker: error message}).
+    """
+    provider = provider or yahoo_provider
+    chunks = [list(tickers[i:i + chunk_size]) for i in range(0, len(tickers), chunk_size)]
+    columns, errors = [], {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for chunk_columns, chunk_errors in pool.map(
+            lambda chunk: _fetch_chunk(provider, chunk, start, end, retries, backoff, fallback_time), chunks
+        ):
+            columns += chunk_columns
+            errors.update(chunk_errors)
+    prices = pd.concat(columns, axis=1, sort=False).sort_index() if columns else pd.DataFrame()
+    return prices, errors
+
+def _cache_path(cache_dir, ticker):
+    return os.path.join(cache_dir, ticker.replace("/", "_") + ".npz")
+
+def _read_cached(cache_dir, ticker):
+    """
+    Returns (close series, covered (start, end) dates) or (None, None) if not cached.
+    """
+    path = _cache_path(cache_dir, ticker)
+    if not os.path.exists(path):
+        return None, None
+    with np.load(path) as cached:
+        series = pd.Series(cached["close"], index=pd.DatetimeIndex(cached["dates"]), name=ticker)
+        covered = tuple(pd.Timestamp(d) for d in cached["covered"])
+    return series, covered
+
+def _write_cached(cache_dir, ticker, series, covered):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, ticker)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            dates=series.index.values.astype("datetime64[D]"),
+            close=series.to_numpy(dtype=float),
+            covered=np.array(covered, dtype="datetime64[D]")
+        )
+    os.replace(path + ".tmp", path)
+
+def _restated(series, parts, rtol=1e-6):
+    """
+    True if re-fetched closes (list of series) disagree with cached ones on a common
+    date. The last cached close is left out: it may be a partial intraday close.
+    """
+    if series is None or len(series) < 2:
+        return False
+    settled = series.iloc[:-1]
+    new = pd.concat(parts)
+    new = new[~new.index.duplicated(keep="last")]
+    common = settled.index.intersection(new.index)
+    return not np.allclose(new[common].to_numpy(dtype=float), settled[common].to_numpy(dtype=float), rtol=rtol)
+
+def load_prices(tickers, start_date="2019-01-01", provider=None, cache_dir=CACHE_DIR, **download_options):
     """
     Fetches historical adjusted close prices for a list of tickers from Yahoo Finance.
+    Series are cached on disk per ticker; later calls only ask the provider for
+    dates outside the cached range (the last cached day is re-fetched so a partial
+    intraday close gets corrected). Each request overlaps a settled cached close;
+    if that close changed (adjusted history restated after a split or dividend),
+    the ticker's whole history is fetched again. provider(tickers, start, end) can replace Yahoo,
+    download_options are passed to download_prices.
+    A window that comes back empty is only recorded as covered when it extends
+    existing cached data (a holiday); otherwise it is asked for again next time.
+    Tickers without any data are left out; data.attrs["download_errors"] says why.
     """
-    data = yf.download(tickers, start=start_date)
-    if isinstance(data, pd.Series):
-        data = data.to_frame()
-    data = data[[('Close', ticker) for ticker in tickers]]
-    data.columns = data.columns.droplevel()
-    return data.dropna()
+    provider = provider or yahoo_provider
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+
+    cached = {ticker: _read_cached(cache_dir, ticker) for ticker in tickers}
+
+    # Missing ranges per ticker, grouped so tickers with the same gap share one request
+    requests = {}
+    deltas = set()   # (window, ticker) requests for the days after existing cached closes
+    for ticker, (series, covered) in cached.items():
+        if covered is None:
+            requests.setdefault((start, end), []).append(ticker)
+            continue
+        # every request overlaps a cached close, to detect restated (re-adjusted) history
+        if start < covered[0]:
+            overlap_to = series.index.min() + pd.Timedelta(days=1) if len(series) else covered[0]
+            requests.setdefault((start, max(overlap_to, covered[0])), []).append(ticker)
+        if covered[1] < end:
+            refresh_from = series.index[-2] if len(series) > 1 else series.index.max() if len(series) else covered[1]
+            window = (min(refresh_from, covered[1]), end)
+            requests.setdefault(window, []).append(ticker)
+            if len(series):
+                deltas.add((window, ticker))
+
+    fetched = {}
+    errors = {}
+    # An empty answer can be a failure in disguise (yfinance returns rate-limited
+    # tickers as NaN columns), so it only counts as covered for a delta window
+    uncovered = set()
+    for window, group in requests.items():
+        fetch_start, fetch_end = window
+        data, group_errors = download_prices(
+            group, fetch_start.strftime("%Y-%m-%d"), fetch_end.strftime("%Y-%m-%d"), provider, **download_options
+        )
+        for ticker, message in group_errors.items():
+            if errors.get(ticker, NO_DATA) == NO_DATA:
+                errors[ticker] = message
+            if message == NO_DATA and (window, ticker) not in deltas:
+                uncovered.add(ticker)
+        for ticker in data.columns:
+            fetched.setdefault(ticker, []).append(data[ticker].dropna())
+
+    # Adjusted closes change all the way back after a split or dividend: when a
+    # re-fetched close differs from the cached one, the whole history is fetched again
+    restated = [ticker for ticker in tickers if ticker in fetched and _restated(cached[ticker][0], fetched[ticker])]
+    if restated:
+        data, group_errors = download_prices(
+            restated, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), provider, **download_options
+        )
+        for ticker in restated:
+            if ticker in data.columns:
+                cached[ticker] = (None, None)
+                fetched[ticker] = [data[ticker].dropna()]
+                uncovered.discard(ticker)
+            else:
+                # returned as is, but the mix of old and new adjustments is not cached
+                errors[ticker] = f"history restated, full re-fetch failed: {group_errors.get(ticker, NO_DATA)}"
+
+    stale = {ticker for group in requests.values() for ticker in group}
+    columns = []
+    for ticker in tickers:
+        series, covered = cached[ticker]
+        if ticker in stale:
+            parts = ([series] if series is not None else []) + fetched.get(ticker, [])
+            series = pd.concat(parts) if parts else pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+            series = series[~series.index.duplicated(keep="last")].sort_index()
+            # a failed or suspiciously empty request must be retried next time;
+            # an empty delta window (holiday) need not
+            if errors.get(ticker, NO_DATA) == NO_DATA and ticker not in uncovered:
+                covered = (min(start, covered[0]), end) if covered else (start, end)
+                _write_cached(cache_dir, ticker, series.rename(ticker), covered)
+        series = series[series.index >= start]
+        if series.empty:
+            errors.setdefault(ticker, NO_DATA)
+        else:
+            if errors.get(ticker) == NO_DATA:
+                del errors[ticker]
+            columns.append(series.rename(ticker))
+
+    data = pd.concat(columns, axis=1, sort=True).dropna() if columns else pd.DataFrame()
+    data.attrs["download_errors"] = {ticker: errors[ticker] for ticker in tickers if ticker in errors}
+    return data
+
 def calculate_daily_returns(prices):
     """
     Computes daily returns from price data.
@@ -0,0 +1,110 @@
+# Shared SQLite access layer: one configured database file, pooled WAL connections
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_PATH = os.getenv("DB_PATH", "users.db")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+
+# WAL lets readers run while the price ingestion writes; NORMAL sync is durable
+# across application crashes in WAL mode and avoids an fsync per commit.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-65536",     # 64 MB page cache per connection
+    "PRAGMA mmap_size=268435456",   # map up to 256 MB of the file
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of at most `size` connections to one database file.
+    Callers block when every connection is checked out.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_pool = ConnectionPool(DB_PATH)
+
+
+def configure(path=None, pool_size=None):
+    """
+    Points the shared pool at another database file (e.g. for benchmarks or scripts).
+    Connections of the previous pool still checked out are closed by their users.
+    """
+    global _pool, DB_PATH
+    _pool.close()
+    DB_PATH = path or DB_PATH
+    _pool = ConnectionPool(DB_PATH, pool_size or POOL_SIZE)
+
+
+@contextmanager
+def connection():
+    """
+    Borrows a pooled connection. Commits when the block succeeds,
+    rolls back when it raises, and always returns the connection to the pool.
+    """
+    pool = _pool
+    conn = pool.acquire()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if pool is _pool:
+            pool.release(conn)
+        else:
+            conn.close()
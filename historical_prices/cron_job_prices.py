@@ -3,34 +3,185 @@
 Created on Sun May 11 17:39:54 2025
 
 @author: LENOVO
+
+Daily CSE price scraper. Run as a daemon:
+
+    python cron_job_prices.py --at 21:30 --ingest
+
+It sleeps until the next run, catches up on missed trading days at startup,
+retries failed scrapes with exponential backoff, and can read from a local
+directory of price files (--source-dir) instead of the live market page.
 """
 
+import argparse
+import logging
+import os
+import sys
+import time
 import schedule
 import pandas as pd
-from datetime import datetime as dt
-import os
+from datetime import datetime as dt, timedelta
+
+CSE_URL = "https://www.casablanca-bourse.com/fr/live-market/marche-actions-groupement"
+OUTPUT_DIR = os.getenv("CSE_PRICES_DIR", os.path.dirname(os.path.abspath(__file__)))
+RUN_AT = os.getenv("CSE_PRICES_AT", "21:30")
+
+logger = logging.getLogger("cse_prices")
 
 
-# schedule.clear()
+def price_file_name(day):
+    return f"cse_prices_{day.strftime('%Y_%m_%d')}.csv"
 
-def scrape_cse_prices():
-    if dt.today().weekday() not in [5,6]: 
-        url = "https://www.casablanca-bourse.com/fr/live-market/marche-actions-groupement"
+
+def html_source(url=CSE_URL):
+    """
+    Live market page. It only shows the latest session, so past days return None.
+    """
+    def fetch(day):
+        if day != dt.today().date():
+            return None
         df = pd.read_html(url, thousands=";")
         df = pd.concat(df)
         df = df[["Instrument", "Cours de référence"]]
         df.columns = ["stock", "price"]
         df.price = df.price.map(lambda x: x.replace(",",".").replace(" ","")).astype(float)
-        today = dt.today()
-        outputPath = r"C:\Users\LENOVO\Documents\portfolio_optimizer\historical_prices"
-        fileName = f"cse_prices_{dt.today().strftime('%Y_%m_%d')}.csv" 
-        filePath = os.path.join(outputPath, fileName)
-        df.to_csv(filePath, index=False)
-    
+        return df
+    return fetch
+
+
+def file_source(directory):
+    """
+    Offline stand-in for the market page: reads cse_prices_YYYY_MM_DD.csv files from directory.
+    """
+    def fetch(day):
+        path = os.path.join(directory, price_file_name(day))
+        return pd.read_csv(path) if os.path.exists(path) else None
+    return fetch
+
+
+def scrape_cse_prices(day=None, output_dir=OUTPUT_DIR, source=None):
+    """
+    Writes the prices of `day` (default today) to output_dir/cse_prices_YYYY_MM_DD.csv.
+    Returns the file path, or None on weekends and when the source has no data for that day.
+    """
+    day = day or dt.today().date()
+    if day.weekday() in [5,6]:
+        return None
+    df = (source or html_source())(day)
+    if df is None:
+        return None
+    filePath = os.path.join(output_dir, price_file_name(day))
+    df.to_csv(filePath, index=False)
+    return filePath
+
+
+def due_trading_days(now, run_at, lookback_days):
+    """
+    Weekdays in the last lookback_days, oldest first. Today counts once its run time has passed.
+    """
+    due = dt.strptime(run_at, "%H:%M").time()
+    last = now.date() if now.time() >= due else now.date() - timedelta(days=1)
+    days = [last - timedelta(days=n) for n in range(lookback_days, -1, -1)]
+    return [day for day in days if day.weekday() not in [5,6]]
+
+
+def missed_trading_days(output_dir, now, run_at, lookback_days):
+    """
+    Days of due_trading_days without a price file, oldest first.
+    """
+    return [
+        day for day in due_trading_days(now, run_at, lookback_days)
+        if not os.path.exists(os.path.join(output_dir, price_file_name(day)))
+    ]
+
+
+def with_retries(func, retries, backoff):
+    """
+    Calls func(), retrying up to `retries` times with exponential backoff (backoff, 2*backoff, ...).
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            logger.exception("Scrape failed, retrying in %.0fs", delay)
+            time.sleep(delay)
+
+
+def ingest(path):
+    """
+    Appends a scraped file to the stock_prices table of the app database.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    from price_ingestion import ingest_price_file
+    result = ingest_price_file(path)
+    if result["rows"]:
+        logger.info("Ingested %s: %d rows for %d tickers", path, result["rows"], len(result["tickers"]))
+
+
+def run_pending_days(output_dir, source, run_at, lookback_days, retries, backoff, ingest_files):
+    now = dt.now()
+    for day in missed_trading_days(output_dir, now, run_at, lookback_days):
+        try:
+            path = with_retries(lambda: scrape_cse_prices(day, output_dir, source), retries, backoff)
+        except Exception:
+            logger.exception("Giving up on %s", day)
+            continue
+        if path is None:
+            logger.warning("No prices available for %s from this source", day)
+            continue
+        logger.info("Saved %s", path)
+
+    # Ingestion skips stored rows, so every file of the window is (re)ingested:
+    # a file saved on an earlier run whose ingestion failed is picked up again
+    if ingest_files:
+        for day in due_trading_days(now, run_at, lookback_days):
+            path = os.path.join(output_dir, price_file_name(day))
+            if not os.path.exists(path):
+                continue
+            try:
+                ingest(path)
+            except Exception:
+                logger.exception("Could not ingest %s, will retry on the next run", path)
+
+
+def run_daemon(output_dir=OUTPUT_DIR, source=None, run_at=RUN_AT, lookback_days=7,
+               retries=3, backoff=60, ingest_files=False):
+    """
+    Catches up on missed days, then runs once a day at run_at.
+    Between runs the process sleeps until the next due time.
+    """
+    def job():
+        run_pending_days(output_dir, source, run_at, lookback_days, retries, backoff, ingest_files)
+
+    job()
+    schedule.every().day.at(run_at).do(job)
+    while True:
+        idle = schedule.idle_seconds()
+        if idle is not None and idle > 0:
+            time.sleep(idle)
+        schedule.run_pending()
 
-# scrape_cse_prices()
 
-schedule.every().day.at('21:30').do(scrape_cse_prices)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daily Casablanca Stock Exchange price scraper.")
+    parser.add_argument("--at", default=RUN_AT, help="daily run time, HH:MM (default %(default)s)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="where cse_prices_*.csv files are written")
+    parser.add_argument("--source-dir", help="read price files from this directory instead of the live page")
+    parser.add_argument("--catch-up-days", type=int, default=7, help="how far back to look for missed trading days")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=60, help="initial retry delay in seconds")
+    parser.add_argument("--ingest", action="store_true", help="append the catch-up window's files to the stock_prices table (stored rows are skipped)")
+    parser.add_argument("--once", action="store_true", help="catch up once and exit instead of running as a daemon")
+    args = parser.parse_args()
 
-while True:
-    schedule.run_pending()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    source = file_source(args.source_dir) if args.source_dir else html_source()
+    if args.once:
+        run_pending_days(args.output_dir, source, args.at, args.catch_up_days, args.retries, args.backoff, args.ingest)
+    else:
+        run_daemon(args.output_dir, source, args.at, args.catch_up_days, args.retries, args.backoff, args.ingest)
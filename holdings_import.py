@@ -0,0 +1,60 @@
+# Bulk import of holdings from broker exports / uploaded CSVs
+import pandas as pd
+from datetime import datetime as dt
+from portfolio_db import add_holdings
+
+REQUIRED_COLUMNS = ["Ticker", "Entry Date", "Entry Price", "Quantity"]
+
+
+def validate_holdings(df: pd.DataFrame, known_tickers=None):
+    """
+    Validates a holdings frame with the REQUIRED_COLUMNS in one pass.
+    Returns (valid, rejects):
+        - valid: DataFrame with ticker, entry_date ('YYYY-MM-DD'), entry_price, quantity
+        - rejects: the offending input rows with a 'Reason' column
+    Raises ValueError when required columns are missing.
+    """
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"CSV missing required columns: {', '.join(missing)}")
+
+    ticker = df["Ticker"].fillna("").astype(str).str.strip().str.upper()
+    entry_date = pd.to_datetime(df["Entry Date"], errors="coerce")
+    entry_price = pd.to_numeric(df["Entry Price"], errors="coerce")
+    quantity = pd.to_numeric(df["Quantity"], errors="coerce")
+
+    checks = [
+        (ticker == "", "missing ticker"),
+        (entry_date.isna(), "invalid entry date"),
+        (entry_date > pd.Timestamp(dt.today()), "entry date in the future"),
+        (~(entry_price > 0), "entry price must be positive"),
+        (~(quantity > 0), "quantity must be positive"),
+    ]
+    if known_tickers is not None:
+        checks.append(((ticker != "") & ~ticker.isin(set(known_tickers)), "unknown ticker"))
+
+    reason = pd.Series("", index=df.index)
+    for failed, message in checks:
+        reason = reason.where(~failed, reason + message + "; ")
+    rejected = reason != ""
+
+    valid = pd.DataFrame({
+        "ticker": ticker[~rejected],
+        "entry_date": entry_date[~rejected].dt.strftime("%Y-%m-%d"),
+        "entry_price": entry_price[~rejected].astype(float),
+        "quantity": quantity[~rejected].astype(float),
+    })
+    rejects = df[rejected].assign(Reason=reason[rejected].str.rstrip("; "))
+    return valid, rejects
+
+
+def import_holdings(portfolio_id, source, known_tickers=None):
+    """
+    Imports holdings from a CSV path/buffer or a DataFrame into a portfolio.
+    Valid rows are written in a single transaction; invalid rows are returned, not written.
+    Returns (number of rows imported, rejects DataFrame).
+    """
+    df = source if isinstance(source, pd.DataFrame) else pd.read_csv(source)
+    valid, rejects = validate_holdings(df, known_tickers)
+    add_holdings(portfolio_id, valid.itertuples(index=False, name=None))
+    return len(valid), rejects
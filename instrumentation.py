@@ -0,0 +1,128 @@
+# Opt-in stage timing / profiling for the dashboard and optimizer flows
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger("portfolio.metrics")
+
+# PORTFOLIO_METRICS=1 records every request; otherwise only requests opened with enabled=True
+ENABLED = os.getenv("PORTFOLIO_METRICS", "0") not in ("", "0")
+# JSON lines file the finished requests are appended to (unset: keep them in memory only)
+METRICS_FILE = os.getenv("PORTFOLIO_METRICS_FILE")
+
+_local = threading.local()
+
+
+def _current():
+    return getattr(_local, "request", None)
+
+
+@contextmanager
+def request(name, enabled=None, memory=False, profile=False, metrics_file=METRICS_FILE):
+    """
+    Records the stages run inside the block (on this thread) as one request.
+    memory=True adds tracemalloc deltas per stage, profile=True captures cProfile
+    stats of the whole block. Yields the request dict, complete once the block exits:
+        {"request", "started_at", "seconds", "stages": [...], "profile": text or None}
+    Does nothing but yield None when not enabled.
+    """
+    if not (ENABLED if enabled is None else enabled) or _current() is not None:
+        yield None
+        return
+
+    record = {
+        "request": name,
+        "started_at": datetime.now().isoformat(timespec="milliseconds"),
+        "seconds": None,
+        "stages": [],
+        "profile": None,
+    }
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    record["memory"] = tracemalloc.is_tracing()
+    profiler = cProfile.Profile() if profile else None
+    _local.request = record
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+        record["seconds"] = time.perf_counter() - start
+        _local.request = None
+        if record["memory"]:
+            record["memory_peak"] = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+        if profiler:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+            record["profile"] = out.getvalue()
+        _local.last = record
+        if metrics_file:
+            export(record, metrics_file)
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Times one stage of the current request. Yields a dict the caller can add
+    details to, e.g. record["rows"] = len(df). A no-op outside a recorded request.
+    """
+    current = _current()
+    if current is None:
+        yield {}
+        return
+
+    record = {"stage": name, **info}
+    memory_before = tracemalloc.get_traced_memory()[0] if current["memory"] else None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if memory_before is not None:
+            record["memory_delta"] = tracemalloc.get_traced_memory()[0] - memory_before
+        current["stages"].append(record)
+
+
+def last_request():
+    """
+    The last request recorded on this thread, or None.
+    """
+    return getattr(_local, "last", None)
+
+
+def export(record, path=METRICS_FILE):
+    """
+    Appends a finished request to a JSON lines file.
+    """
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    except OSError:
+        logger.exception("Could not write metrics to %s", path)
+
+
+def load_metrics(path=METRICS_FILE):
+    """
+    Reads a metrics file back into one row per stage (request name, start time and stage fields).
+    """
+    rows = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            for stage_record in record["stages"]:
+                rows.append({"request": record["request"], "started_at": record["started_at"], **stage_record})
+    return rows
@@ -0,0 +1,232 @@
+# Transaction ledger: positions, cash, P&L and time-weighted NAV from an event stream
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from nav import fetch_historical_prices
+from portfolio_db import get_holdings, get_transactions
+
+TRANSACTION_TYPES = ("buy", "sell", "dividend", "deposit", "withdrawal")
+COLUMNS = ["date", "type", "ticker", "quantity", "price", "amount", "fee"]
+# quantities closer to zero than this count as a closed position
+EPSILON = 1e-9
+
+
+def transactions_frame(rows):
+    """
+    DataFrame of (date, type, ticker, quantity, price, amount, fee) rows, as
+    returned by get_transactions, in date order (same-day rows keep their order).
+    Raises ValueError for unknown types and for trades or cash movements with missing fields.
+    """
+    tx = pd.DataFrame(list(rows), columns=COLUMNS)
+    tx["date"] = pd.to_datetime(tx["date"])
+    tx["type"] = tx["type"].str.lower()
+    for column in ("quantity", "price", "amount", "fee"):
+        tx[column] = pd.to_numeric(tx[column]).astype(float)
+    tx["fee"] = tx["fee"].fillna(0.0)
+
+    unknown = ~tx["type"].isin(TRANSACTION_TYPES)
+    if unknown.any():
+        raise ValueError(f"Unknown transaction types: {', '.join(sorted(set(tx.loc[unknown, 'type'])))}")
+    trades = tx["type"].isin(("buy", "sell"))
+    if (trades & ~((tx["quantity"] > 0) & (tx["price"] >= 0) & tx["ticker"].notna())).any():
+        raise ValueError("buy and sell transactions need a ticker, a positive quantity and a price.")
+    if (~trades & tx["amount"].isna()).any():
+        raise ValueError("dividend, deposit and withdrawal transactions need an amount.")
+    return tx.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def _average_cost(trades):
+    """
+    Average-cost basis of trade events sorted by ticker column, then date.
+    Per position cycle (from flat to flat) the basis B follows
+        buy:  B_k = B_k-1 + cost_k
+        sell: B_k = B_k-1 * qty_k / qty_k-1
+    a linear recurrence solved with cumulative sums: B_k = S_k * sum_j<=k(cost_j / S_j),
+    S being the running product of the sell ratios.
+    A position within EPSILON of zero is closed, and the quantity restarts from
+    exactly zero, so float residue of fractional trades never leaks into the next cycle.
+    Returns (quantity before, quantity after, basis before, basis after) arrays, one entry per event.
+    """
+    signed = np.where(trades["type"] == "sell", -trades["quantity"], trades["quantity"]).astype(float)
+    col = trades["col"].to_numpy()
+    running = pd.Series(signed).groupby(col).cumsum().to_numpy()
+    if (running < -EPSILON).any():
+        first = trades.iloc[int(np.argmax(running < -EPSILON))]
+        raise ValueError(f"Sell of {first['ticker']} on {first['date']:%Y-%m-%d} exceeds the position held.")
+
+    # a cycle starts at a ticker's first trade and after every close
+    closed = np.abs(running) < EPSILON
+    starts = np.r_[True, (col[1:] != col[:-1]) | closed[:-1]]
+    cycle = np.cumsum(starts)
+    quantity_after = pd.Series(signed).groupby(cycle).cumsum().to_numpy(copy=True)
+    quantity_after[closed] = 0.0
+    quantity_before = np.where(starts, 0.0, np.r_[0.0, quantity_after[:-1]])
+
+    sell = signed < 0
+    closing = sell & closed
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(sell & ~closing, quantity_after / quantity_before, 1.0)
+    cost = np.where(sell, 0.0, trades["quantity"] * trades["price"] + trades["fee"])
+    log_scale = pd.Series(np.log(ratio)).groupby(cycle).cumsum().to_numpy()
+    scaled_cost = pd.Series(cost * np.exp(-log_scale)).groupby(cycle).cumsum().to_numpy()
+    basis_after = np.where(closing, 0.0, np.exp(log_scale) * scaled_cost)
+    basis_before = pd.Series(basis_after).groupby(cycle).shift(1).fillna(0.0).to_numpy()
+    return quantity_before, quantity_after, basis_before, basis_after
+
+
+def build_ledger(transactions: pd.DataFrame, prices: pd.DataFrame):
+    """
+    Daily positions, cash, P&L and time-weighted NAV from a transactions_frame.
+
+    Every event is scattered onto its (day, ticker) cell and the daily series
+    are cumulative sums over days, so the cost is O(days x tickers + events),
+    independent of how the trades are spread. Events on days without prices
+    get a row of their own.
+
+    prices: daily closes (dates x tickers), e.g. fetch_historical_prices; days
+    without a positive close value the position at its last trade price.
+    Cash starts at 0. Purchases the cash cannot cover are treated as funded by
+    a deposit on that day (implicit funding), so plain buy lists work too.
+    Withdrawals are never funded: one larger than the cash at hand raises ValueError.
+    The NAV is time-weighted: deposits, withdrawals and implicit funding are
+    flows at the day's close, r_t = (value_t - flows_t) / value_t-1 - 1.
+
+    Returns {
+        "Positions": DataFrame (date x ticker) of quantities held,
+        "Daily": DataFrame (date) with 'Market Value', 'Cash', 'Value', 'Flows',
+                 'Cost Basis', 'Realized P&L', 'Unrealized P&L', 'Dividends',
+                 'Fees' (the last three cumulative) and 'NAV' (starts at 100),
+        "Realized": DataFrame of sells with their 'Average Cost' and 'Realized P&L',
+    }
+    """
+    tx = transactions
+    tickers = list(dict.fromkeys(tx["ticker"].dropna()))
+    start = tx["date"].iloc[0]
+    dates = prices.index[prices.index >= start].union(pd.DatetimeIndex(tx["date"].unique()))
+    num_days, num_tickers = len(dates), len(tickers)
+
+    with stage("ledger.build", events=len(tx), days=num_days, tickers=num_tickers):
+        day = dates.searchsorted(tx["date"])
+        col = tx["ticker"].map({t: i for i, t in enumerate(tickers)}).fillna(-1).astype(int).to_numpy()
+        kind = tx["type"].to_numpy()
+        quantity = tx["quantity"].fillna(0.0).to_numpy()
+        trade_value = quantity * tx["price"].fillna(0.0).to_numpy()
+        amount = tx["amount"].fillna(0.0).to_numpy()
+        fee = tx["fee"].to_numpy()
+
+        # cash: trades and dividends move it internally, deposits/withdrawals are external flows
+        cash_flow = np.select(
+            [kind == "buy", kind == "sell", kind == "dividend", kind == "deposit", kind == "withdrawal"],
+            [-trade_value, trade_value, amount, amount, -amount]
+        ) - fee
+        # implicit funding tops up the lowest balance so far; a withdrawal may not set a new low
+        shortfall = -np.cumsum(cash_flow)
+        covered = np.maximum(np.r_[0.0, np.maximum.accumulate(shortfall)[:-1]], 0.0)
+        overdrawn = (kind == "withdrawal") & (shortfall > covered + EPSILON)
+        if overdrawn.any():
+            raise ValueError(f"Withdrawal on {tx['date'].iloc[int(np.argmax(overdrawn))]:%Y-%m-%d} exceeds the cash available.")
+        external = np.select([kind == "deposit", kind == "withdrawal"], [amount, -amount], 0.0)
+        daily_cash = np.bincount(day, cash_flow, minlength=num_days)
+        flows = np.bincount(day, external, minlength=num_days)
+        cash = np.cumsum(daily_cash)
+        funding = -np.minimum(np.minimum.accumulate(cash), 0.0)
+        flows += np.diff(funding, prepend=0.0)
+        cash += funding
+
+        # positions and average-cost basis, per trade event sorted by ticker
+        is_trade = (kind == "buy") | (kind == "sell")
+        trades = tx[is_trade].assign(col=col[is_trade], day=day[is_trade])
+        trades = trades.sort_values(["col", "date"], kind="stable")
+        quantity_before, quantity_after, basis_before, basis_after = _average_cost(trades)
+        # a position is its quantity after the day's last trade, carried forward
+        last_quantity = pd.Series(quantity_after).groupby([trades["day"].to_numpy(), trades["col"].to_numpy()]).last()
+        positions = np.full((num_days, num_tickers), np.nan)
+        positions[last_quantity.index.get_level_values(0), last_quantity.index.get_level_values(1)] = last_quantity.to_numpy()
+        positions = pd.DataFrame(positions).ffill().fillna(0.0).to_numpy()
+        basis = np.zeros((num_days, num_tickers))
+        np.add.at(basis, (trades["day"], trades["col"]), basis_after - basis_before)
+        cost_basis = np.cumsum(basis.sum(axis=1))
+
+        sells = (trades["type"] == "sell").to_numpy()
+        average_cost = np.divide(basis_before, quantity_before, out=np.zeros(len(trades)), where=quantity_before > 0)
+        realized = np.where(sells, trades["quantity"] * (trades["price"] - average_cost) - trades["fee"], 0.0)
+
+        # closes where positive, otherwise the last trade price
+        last_price = trades.groupby(["day", "col"])["price"].last()
+        last_trade = np.full((num_days, num_tickers), np.nan)
+        last_trade[last_price.index.get_level_values(0), last_price.index.get_level_values(1)] = last_price.to_numpy()
+        closes = prices.reindex(columns=tickers).reindex(dates, method="ffill").to_numpy(dtype=float)
+        last_trade = pd.DataFrame(last_trade).ffill().to_numpy()
+        valuation = np.where(closes > 0, closes, last_trade)
+        market_value = np.nansum(positions * valuation, axis=1)
+
+        value = market_value + cash
+        previous = np.r_[0.0, value[:-1]]
+        daily_return = np.divide(value - flows, previous, out=np.ones(num_days), where=previous > 0) - 1
+        daily_return[0] = 0.0
+
+        daily = pd.DataFrame({
+            "Market Value": market_value,
+            "Cash": cash,
+            "Value": value,
+            "Flows": flows,
+            "Cost Basis": cost_basis,
+            "Realized P&L": np.cumsum(np.bincount(trades["day"], realized, minlength=num_days)),
+            "Unrealized P&L": market_value - cost_basis,
+            "Dividends": np.cumsum(np.bincount(day, np.where(kind == "dividend", amount, 0.0), minlength=num_days)),
+            "Fees": np.cumsum(np.bincount(day, fee, minlength=num_days)),
+            "NAV": 100 * np.cumprod(1 + daily_return),
+        }, index=dates)
+
+    realized_sells = trades[sells][["date", "ticker", "quantity", "price", "fee"]].assign(**{
+        "Average Cost": average_cost[sells],
+        "Realized P&L": realized[sells],
+    }).sort_values("date", kind="stable").reset_index(drop=True)
+    return {
+        "Positions": pd.DataFrame(positions, index=dates, columns=tickers),
+        "Daily": daily,
+        "Realized": realized_sells,
+    }
+
+
+def _portfolio_rows(portfolio_id, new_rows=(), removed_ids=()):
+    buys = [(entry_date, "buy", ticker, quantity, entry_price, None, 0.0)
+            for ticker, entry_date, entry_price, quantity in get_holdings(portfolio_id)]
+    recorded = [row[1:] for row in get_transactions(portfolio_id, with_ids=True) if row[0] not in removed_ids]
+    return buys + recorded + list(new_rows)
+
+
+def portfolio_transactions(portfolio_id):
+    """
+    A portfolio's events: its holdings rows as buys, followed by its recorded transactions.
+    """
+    return transactions_frame(_portfolio_rows(portfolio_id))
+
+
+def check_transactions(portfolio_id, new_rows=(), removed_ids=()):
+    """
+    Raises ValueError if the portfolio's events would no longer make a valid
+    ledger with new_rows (transactions_frame rows) recorded and the transactions
+    with removed_ids deleted, e.g. a sell of more than is held at that date
+    or a withdrawal of more than the cash.
+    Call it before add_transaction / delete_transaction.
+    """
+    tx = transactions_frame(_portfolio_rows(portfolio_id, new_rows, removed_ids))
+    if not tx.empty:
+        tickers = list(dict.fromkeys(tx["ticker"].dropna()))
+        build_ledger(tx, pd.DataFrame(index=pd.DatetimeIndex([]), columns=tickers, dtype=float))
+
+
+def load_ledger(portfolio_id):
+    """
+    build_ledger for a stored portfolio, priced from stock_prices. None when it has no events.
+    """
+    tx = portfolio_transactions(portfolio_id)
+    if tx.empty:
+        return None
+    tickers = tuple(dict.fromkeys(tx["ticker"].dropna()))
+    prices = fetch_historical_prices(tickers, tx["date"].iloc[0]) if tickers else pd.DataFrame()
+    if prices.empty:
+        prices = pd.DataFrame(index=pd.DatetimeIndex([]), columns=list(tickers), dtype=float)
+    return build_ledger(tx, prices)
@@ -1,11 +1,46 @@
 import pandas as pd
 import numpy as np
+import os
+import hashlib
+import logging
 from datetime import datetime as dt
 # import yfinance as yf
-from portfolio_db import get_stocks_data, get_holdings, get_prices
+from portfolio_db import (
+    get_stocks_data, get_holdings, get_prices,
+    get_price_history, get_price_versions, get_price_changes_since,
+    get_nav_meta, get_portfolio_nav, get_nav_restart_point, save_portfolio_nav
+)
+from utils import LRUCache
+from instrumentation import stage
+import db
+import shared_prices
+
+logger = logging.getLogger(__name__)
+
+# Process-wide cache of per-ticker close series, shared by all Streamlit sessions.
+# Entries are (version, loaded_from, series); see fetch_historical_prices.
+PRICE_CACHE = LRUCache(max_entries=int(os.getenv("PRICE_CACHE_SIZE", "512")))
+
+def _result_nbytes(result):
+    return sum(
+        value.memory_usage(index=True, deep=True).sum() if isinstance(value, pd.DataFrame)
+        else value.memory_usage(index=True, deep=True) if isinstance(value, pd.Series)
+        else 0
+        for value in result.values()
+    )
+
+# Dashboard results keyed by (portfolio, holdings hash, benchmarks, price versions); see build_dashboard.
+DASHBOARD_CACHE = LRUCache(
+    max_entries=int(os.getenv("DASHBOARD_CACHE_SIZE", "64")),
+    ttl=float(os.getenv("DASHBOARD_CACHE_TTL", "900")),
+    max_bytes=int(os.getenv("DASHBOARD_CACHE_MB", "256")) * 2**20,
+    sizeof=_result_nbytes
+)
 
 def get_portfolio_holdings(portfolio_id):
-    rows = get_holdings(portfolio_id)
+    return holdings_from_rows(get_holdings(portfolio_id))
+
+def holdings_from_rows(rows):
     holdings = []
     for ticker, entry_date, entry_price, quantity in rows:
         holdings.append({
@@ -16,21 +51,157 @@ def get_portfolio_holdings(portfolio_id):
         })
     return holdings
 
-def fetch_historical_prices(tickers: tuple, start_date: dt):
-    try:
-        db_extract = get_prices(tickers)
-        prices = pd.concat([pd.read_json(item[0], orient="table") for item in db_extract], axis=1)
-        prices = prices.ffill().fillna(0)
-        prices.index = pd.to_datetime(prices.index)
+def load_price_series(tickers, start: str):
+    """
+    Returns {ticker: close series} covering start (plus the seed close before it)
+    up to the latest stored date. Served from PRICE_CACHE unless the ticker's
+    price version changed or the cached window starts after start.
+    """
+    versions = get_price_versions(tickers)
+    series = {}
+    stale = []
+    for ticker in tickers:
+        entry = PRICE_CACHE.get(ticker)
+        if entry and entry[0] == versions[ticker] and entry[1] <= start:
+            series[ticker] = entry[2]
+        else:
+            stale.append(ticker)
+
+    if stale:
+        with stage("db.price_history", tickers=len(stale)) as record:
+            rows = get_price_history(stale, start)
+            record["rows"] = len(rows)
+        with stage("decode.price_series", tickers=len(stale)) as record:
+            history = pd.DataFrame(rows, columns=["ticker", "date", "close"])
+            history["date"] = pd.to_datetime(history["date"])
+            for ticker, ticker_rows in history.groupby("ticker", sort=False):
+                close = pd.Series(ticker_rows["close"].to_numpy(), index=pd.DatetimeIndex(ticker_rows["date"], name="date"), name=ticker)
+                PRICE_CACHE.put(ticker, (versions[ticker], start, close))
+                series[ticker] = close
+            record["rows"] = len(history)
+    return series
+
+def invalidate_prices(tickers=None):
+    """
+    Drops tickers (or everything) from the in-process price cache.
+    """
+    if tickers is None:
+        PRICE_CACHE.clear()
+        return
+    for ticker in tickers:
+        PRICE_CACHE.pop(ticker)
+
+def holdings_hash(rows):
+    """
+    Digest of the holdings rows, in stored order (the first row anchors the NAV).
+    """
+    return hashlib.sha256(repr([tuple(row) for row in rows]).encode()).hexdigest()
+
+def build_dashboard(portfolio_id, benchmark_tickers):
+    """
+    Runs the dashboard pipeline (prices, weighted NAV, benchmarks, holdings summary)
+    for a portfolio, or returns the cached result when neither its holdings nor
+    the prices of its tickers and benchmarks changed since.
+    Returns None for a portfolio without holdings, otherwise a dict with
+    "Holdings", "Prices", "NAV", "Performance", "Benchmarks" and "Summary".
+    Cached frames are shared: copy before modifying them.
+    """
+    rows = get_holdings(portfolio_id)
+    if not rows:
+        return None
+    holdings = holdings_from_rows(rows)
+    tickers = sorted({h["ticker"] for h in holdings} | set(benchmark_tickers))
+    versions = get_price_versions(tickers)
+    key = (
+        portfolio_id, holdings_hash(rows), tuple(benchmark_tickers),
+        tuple(versions[t] for t in tickers)
+    )
+    with stage("cache.dashboard") as record:
+        result = DASHBOARD_CACHE.get(key)
+        record["hit"] = result is not None
+    if result is not None:
+        return result
+
+    start_date = min(h["entry_date"] for h in holdings)
+    prices_df = fetch_historical_prices(tuple(dict.fromkeys(h["ticker"] for h in holdings)), start_date)
+    with stage("nav.refresh") as record:
+        nav_df = refresh_portfolio_nav(portfolio_id)
+        record["rows"] = len(nav_df)
+    with stage("nav.benchmarks", tickers=len(benchmark_tickers)):
+        benchmark_nav = compute_benchmark_nav(benchmark_tickers, start_date)
+    with stage("summary", holdings=len(holdings)):
+        summary = get_holdings_summary(holdings, prices_df)
+    result = {
+        "Holdings": holdings,
+        "Prices": prices_df,
+        "NAV": nav_df,
+        "Performance": (nav_df.iat[-1] / nav_df.iat[0]) - 1,
+        "Benchmarks": benchmark_nav,
+        "Summary": summary,
+    }
+    # Results from older holdings, or for these benchmarks from older prices, can
+    # never be hit again; other benchmark selections of the same holdings stay cached
+    DASHBOARD_CACHE.discard_where(lambda k: k[0] == portfolio_id and (k[1] != key[1] or k[2] == key[2]))
+    DASHBOARD_CACHE.put(key, result)
+    return result
+
+def invalidate_dashboard(portfolio_id=None):
+    """
+    Drops cached dashboard results of a portfolio (or of every portfolio).
+    """
+    if portfolio_id is None:
+        DASHBOARD_CACHE.clear()
+    else:
+        DASHBOARD_CACHE.discard_where(lambda k: k[0] == portfolio_id)
+
+def fetch_historical_prices(tickers: tuple, start_date: dt, end_date: dt = None):
+    """
+    Loads aligned daily closes for tickers between start_date and end_date
+    (inclusive). Gaps are forward-filled from the last close before the
+    window, unlisted days are 0.
+    """
+    start = pd.Timestamp(start_date).strftime("%Y-%m-%d")
+    series = load_price_series(list(dict.fromkeys(tickers)), start)
+    if not series:
+        logger.warning("No stored prices for %s", ", ".join(tickers))
+        return pd.DataFrame()
+    with stage("align.prices", tickers=len(series)) as record:
+        prices = pd.concat([series[t] for t in dict.fromkeys(tickers) if t in series], axis=1, sort=False)
         prices = prices.sort_index()
+        prices = prices.ffill().fillna(0)
         prices = prices[(prices.index >= start_date)]
-        print(prices)
-        return prices
-    except Exception as e:
-        print(str(e))
-        return pd.DataFrame()
+        if end_date is not None:
+            prices = prices[(prices.index <= end_date)]
+        record["rows"] = len(prices)
+    return prices
 
 
+def load_shared_prices(tickers, start: str, directory=None):
+    """
+    Like load_price_series aligned on one calendar, but served from the matrix
+    written by shared_prices.export_price_matrix: returns (prices, observed),
+    forward-filled closes (0 before listing) and the mask of days each ticker
+    has a close, from the last universe day before start. The columns are
+    read-only views on the mapping, so every process shares one physical copy,
+    and the index is the whole universe's trading calendar.
+    Returns None when there is no export for this database or any of tickers
+    has new prices since it was written; tickers absent from it are left out.
+    """
+    try:
+        index, dates, positions, matrix, observed = shared_prices.open_price_matrix(directory or shared_prices.MATRIX_DIR)
+    except FileNotFoundError:
+        return None
+    if index["database"] != os.path.abspath(db.DB_PATH):
+        return None
+    versions = get_price_versions(tickers)
+    if any(index["versions"].get(t, 0) != versions[t] for t in tickers):
+        return None
+    first = max(dates.searchsorted(pd.Timestamp(start), side="left") - 1, 0)
+    rows = {t: positions[t] for t in tickers if t in positions}
+    return (
+        pd.DataFrame({t: matrix[row, first:] for t, row in rows.items()}, index=dates[first:], copy=False),
+        pd.DataFrame({t: observed[row, first:] for t, row in rows.items()}, index=dates[first:], copy=False),
+    )
 
 def compute_nav_over_time(holdings, prices_df):
     portfolio_df = pd.DataFrame(index=prices_df.index)
@@ -40,49 +211,38 @@ def compute_nav_over_time(holdings, prices_df):
         entry_date = h["entry_date"]
         valid_prices = prices_df[ticker][prices_df.index >= entry_date]
         position_value = valid_prices * quantity
-        full_series = pd.Series(0, index=prices_df.index)
+        full_series = pd.Series(0.0, index=prices_df.index)
         full_series.loc[position_value.index] = position_value
         portfolio_df[ticker] = full_series
     portfolio_df["NAV"] = portfolio_df.sum(axis=1)
     return portfolio_df[["NAV"]]
 
-def get_holdings_summary(holdings, prices_df, portfolio_currency):
-    summary = []
-    latest_prices = prices_df.iloc[-1]
-    total_value = 0
-    # print(holdings)
-    # First compute total portfolio value
-    for h in holdings:
-        ticker = h["ticker"]
-        qty = h["quantity"]
-        current_price = latest_prices[ticker]
-        total_value += qty * current_price
-
-    # Compute details per holding
-    for h in holdings:
-        ticker = h["ticker"]
-        entry_price = h["entry_price"]
-        qty = h["quantity"]
-        entry_date = h["entry_date"].strftime("%Y-%m-%d")
-        current_price = latest_prices[ticker]
-        value = qty * current_price
-        pnl = (current_price - entry_price) * qty
-        stock_performance = (current_price - entry_price) / entry_price
-        weight = value / total_value if total_value else 0
-
-        summary.append({
-            "Ticker": ticker,
-            "Entry Price": round(entry_price, 2),
-            "Current Price": round(current_price, 2),
-            "Quantity": qty,
-            "Stock NAV": round(current_price * qty, 2),
-            "Entry Date": entry_date,
-            "P&L": f"{round(pnl, 2)} {portfolio_currency}",
-            "Stock performance": f"{stock_performance * 100:.2f}%",
-            "Weight": f"{weight * 100:.2f}%"
-        })
+def get_holdings_summary(holdings, prices_df):
+    """
+    One row per holding (lot), priced at the last row of prices_df.
+    All columns are numeric except Ticker and Entry Date (datetime):
+    Entry Price, Current Price, Quantity, Stock NAV, P&L in the portfolio
+    currency; Stock performance and Weight as fractions (0.05 = 5%).
+    Formatting is left to the caller.
+    """
+    lots = pd.DataFrame(holdings, columns=["ticker", "entry_date", "entry_price", "quantity"])
+    entry_price = lots["entry_price"].to_numpy(dtype=float)
+    quantity = lots["quantity"].to_numpy(dtype=float)
+    current_price = prices_df.iloc[-1].reindex(lots["ticker"]).to_numpy(dtype=float)
+    value = current_price * quantity
+    total_value = np.nansum(value)
 
-    return pd.DataFrame(summary)
+    return pd.DataFrame({
+        "Ticker": lots["ticker"],
+        "Entry Price": entry_price,
+        "Current Price": current_price,
+        "Quantity": quantity,
+        "Stock NAV": value,
+        "Entry Date": pd.to_datetime(lots["entry_date"]),
+        "P&L": (current_price - entry_price) * quantity,
+        "Stock performance": current_price / entry_price - 1,
+        "Weight": value / total_value if total_value else np.zeros(len(lots)),
+    })
 
 def compute_weighted_performance(holdings, prices_df):
     """
@@ -99,7 +259,7 @@ def compute_weighted_performance(holdings, prices_df):
             entry_date = h["entry_date"]
             position_value = prices_df[ticker] * qty
             mask = prices_df.index >= entry_date
-            full_series = pd.Series(0, index=prices_df.index)
+            full_series = pd.Series(0.0, index=prices_df.index)
             full_series[mask] = position_value[mask]
             position_values[ticker] = full_series
 
@@ -126,67 +286,175 @@ def compute_weighted_nav(stock_prices, holdings):
     Build a TWR-like NAV series starting at 100,
     using user-entered entry prices at purchase date,
     and historical prices afterward.
-    
+
+    Weights are reset on every purchase date (value of each active position,
+    priced at the entry price on its entry day) and held constant until the
+    next purchase. Purchases dated outside stock_prices.index are ignored.
+
     stock_prices: pd.DataFrame, daily close prices with tickers as columns, Date as index
     holdings: list of dicts, each with keys: 'ticker', 'entry_date' (datetime.date), 'entry_price', 'quantity'
     """
+    return weighted_nav_path(stock_prices, holdings)[0]
 
-    stock_returns = stock_prices.pct_change().fillna(0)
+def weighted_nav_path(stock_prices, holdings, state=None):
+    """
+    compute_weighted_nav that can resume from a saved state.
 
-    # Initialize
-    nav_series = pd.Series(index=stock_prices.index, dtype=float)
-    portfolio_weights = {}  # ticker -> weight
-    active_stocks = {}      # ticker -> quantity
-    entry_prices = {}       # ticker -> entry price
-    starting_nav = 100
-    nav_series.iloc[0] = starting_nav
+    Without state the series starts at 100 on the first row. With state, the
+    first row of stock_prices is the day the state was taken on: the series
+    starts there at state["nav"], positions, entry prices and weights carry
+    over, and only purchases dated after that day are applied.
+
+    Returns (nav series, {purchase date 'YYYY-MM-DD': state after that day}).
+    A state is {"positions", "entered", "weights"} as {ticker: value} for the
+    active tickers; add "nav" to resume from it.
+    """
+    dates = stock_prices.index
+    tickers = list(stock_prices.columns)
+    prices = stock_prices.to_numpy(dtype=float)
+    stock_returns = stock_prices.pct_change().fillna(0).to_numpy(dtype=float)
+    n_days, n_assets = prices.shape
+    daily_returns = np.zeros(n_days)
+    snapshots = {}
+
+    def carried(key, fill):
+        values = state.get(key, {}) if state else {}
+        return np.array([values.get(t, fill) for t in tickers], dtype=float)
+
+    start_positions = carried("positions", 0.0)
+    start_entered = carried("entered", np.nan)
+    start_weights = carried("weights", 0.0)
+
+    if holdings and n_days:
+        entry_dates = pd.to_datetime([h["entry_date"] for h in holdings])
+        rows = dates.get_indexer(entry_dates)
+        cols = stock_prices.columns.get_indexer([h["ticker"] for h in holdings])
+        quantity = np.array([h["quantity"] for h in holdings], dtype=float)
+        entry_price = np.array([h["entry_price"] for h in holdings], dtype=float)
+        # with a state, the first row's purchases are already part of it
+        valid = (rows >= (1 if state else 0)) & (cols >= 0)
+
+        # Positions: purchase quantities scattered on their dates, then cumulated
+        trades = np.zeros((n_days, n_assets))
+        np.add.at(trades, (rows[valid], cols[valid]), quantity[valid])
+        positions = start_positions + trades.cumsum(axis=0)
+        bought = np.zeros((n_days, n_assets), dtype=bool)
+        bought[rows[valid], cols[valid]] = True
+        bought[0] |= start_positions > 0
+        active = np.logical_or.accumulate(bought, axis=0)
+
+        # Latest user-entered price per ticker as of each day (last purchase wins)
+        entered = np.full((n_days, n_assets), np.nan)
+        entered[0] = start_entered
+        order = np.flatnonzero(valid)[::-1]
+        _, last = np.unique(rows[order] * n_assets + cols[order], return_index=True)
+        entered[rows[order[last]], cols[order[last]]] = entry_price[order[last]]
+        entered = pd.DataFrame(entered).ffill().to_numpy()
+
+        # On purchase dates, value positions at market except:
+        # - on the first holding's date every active ticker uses its entry price
+        # - a ticker uses its entry price on the date of its first listed holding
+        event_days = np.unique(rows[valid])
+        event_dates = dates[event_days]
+        use_entry = np.zeros((len(event_days), n_assets), dtype=bool)
+        use_entry[event_dates == entry_dates[0]] = True
+        first_date = np.full(n_assets, np.datetime64("NaT"), dtype="datetime64[ns]")
+        tickers_seen, first = np.unique(cols, return_index=True)
+        first_date[tickers_seen[tickers_seen >= 0]] = entry_dates[first[tickers_seen >= 0]]
+        use_entry |= event_dates.to_numpy()[:, None] == first_date[None, :]
+        valuation = np.where(use_entry, entered[event_days], prices[event_days])
+        values = np.where(active[event_days], positions[event_days] * valuation, 0.0)
+        event_weights = values / values.sum(axis=1, keepdims=True)
+
+        # Each day uses the weights of the latest purchase date on or before it
+        # (or the carried weights before the first one)
+        latest_event = np.searchsorted(event_days, np.arange(n_days), side="right") - 1
+        if state:
+            event_weights = np.vstack([start_weights, event_weights])
+            latest_event += 1
+        held = latest_event >= 0
+        weights = event_weights[latest_event[held]]
+        # tickers not bought yet can have inf returns (listing day); they are masked out
+        with np.errstate(invalid="ignore"):
+            contributions = np.where(active[held], weights * stock_returns[held], 0.0)
+        daily_returns[held] = contributions.sum(axis=1)
+
+        for k, day in enumerate(event_days):
+            on = np.flatnonzero(active[day])
+            snapshots[dates[day].strftime("%Y-%m-%d")] = {
+                "positions": {tickers[j]: positions[day, j] for j in on},
+                "entered": {tickers[j]: entered[day, j] for j in on if not np.isnan(entered[day, j])},
+                "weights": {tickers[j]: event_weights[k + bool(state), j] for j in on},
+            }
+
+    # the first day only sets the base
+    daily_returns[:1] = 0
+    base = state["nav"] if state else 100
+    nav = pd.Series(base * np.cumprod(1 + daily_returns), index=dates, dtype=float)
+    return nav, snapshots
+
+def _nav_series(rows):
+    return pd.Series(
+        [nav for _, nav in rows], index=pd.DatetimeIndex(pd.to_datetime([date for date, _ in rows]), name="date"),
+        dtype=float
+    )
+
+def refresh_portfolio_nav(portfolio_id):
+    """
+    Brings the stored NAV of a portfolio (portfolio_nav table) up to date and returns it.
+
+    Only days after the last stored one are computed. When holdings were added,
+    the series is recomputed from the earliest new entry date; when stored prices
+    were restated, from the earliest restated date. Anything else (first run,
+    holdings edited, changes of unknown extent) recomputes the whole series.
+    Same values as compute_weighted_nav over fetch_historical_prices.
+    """
+    rows = [tuple(row) for row in get_holdings(portfolio_id)]
+    if not rows:
+        return pd.Series(dtype=float, index=pd.DatetimeIndex([], name="date"))
+    holdings = holdings_from_rows(rows)
+    tickers = tuple(dict.fromkeys(h["ticker"] for h in holdings))
+    versions = get_price_versions(tickers)
+
+    # First date whose NAV may differ from the stored one ("" = recompute everything)
+    recompute_from = ""
+    stored = get_nav_meta(portfolio_id)
+    if stored is not None:
+        stored_rows, stored_versions = stored
+        if stored_rows == rows and stored_versions == versions:
+            return _nav_series(get_portfolio_nav(portfolio_id))
+        if rows[:len(stored_rows)] == stored_rows:
+            stored_nav = get_portfolio_nav(portfolio_id)
+            candidates = [
+                pd.Timestamp(entry_date).strftime("%Y-%m-%d") for _, entry_date, _, _ in rows[len(stored_rows):]
+            ]
+            if stored_nav:
+                candidates.append((pd.Timestamp(stored_nav[-1][0]) + pd.Timedelta(days=1)).strftime("%Y-%m-%d"))
+            changed = get_price_changes_since({t: v for t, v in stored_versions.items() if t in versions})
+            if changed is not None:
+                candidates.append(changed)
+            recompute_from = min(candidates) if stored_nav else ""
+
+    restart = get_nav_restart_point(portfolio_id, recompute_from) if recompute_from else None
+    if restart is not None:
+        after_date, base_nav, state = restart
+        prices_df = fetch_historical_prices(tickers, pd.Timestamp(after_date))
+        if prices_df.empty or prices_df.index[0] != pd.Timestamp(after_date):
+            # the stored day is gone from stock_prices
+            restart = None
+    if restart is None:
+        start_date = min(h["entry_date"] for h in holdings)
+        prices_df = fetch_historical_prices(tickers, start_date)
+        nav, snapshots = weighted_nav_path(prices_df, holdings)
+        after_date, new_rows = None, nav
+    else:
+        nav, snapshots = weighted_nav_path(prices_df, holdings, dict(state or {}, nav=base_nav))
+        new_rows = nav.iloc[1:]
+
+    save_portfolio_nav(
+        portfolio_id, after_date,
+        [(date.strftime("%Y-%m-%d"), float(value)) for date, value in new_rows.items()],
+        snapshots, rows, versions
+    )
+    return _nav_series(get_portfolio_nav(portfolio_id))
 
-    # Create lookup for entry dates
-    purchase_lookup = {}
-    for h in holdings:
-        purchase_lookup.setdefault(h["entry_date"], []).append(h)
-
-    prev_nav = starting_nav
-
-    for i, today in enumerate(stock_prices.index):
-        # print(i, today)
-        
-        # Step 1: Check if new stock purchased today
-        if today in purchase_lookup.keys():
-            for new_purchase in purchase_lookup[today]:
-                ticker = new_purchase["ticker"]
-                quantity = new_purchase["quantity"]
-                price = new_purchase["entry_price"]
-
-                if ticker not in active_stocks:
-                    active_stocks[ticker] = 0
-                active_stocks[ticker] += quantity
-                entry_prices[ticker] = price  # record user-entered price
-
-            # Recompute weights based on NAVs
-            navs = {}
-            total_value = 0
-            for ticker, qty in active_stocks.items():
-                if today == holdings[0]["entry_date"]:  # on very first purchase
-                    current_price = entry_prices[ticker]
-                elif ticker in entry_prices and today == next((h["entry_date"] for h in holdings if h["ticker"] == ticker), None):
-                    current_price = entry_prices[ticker]
-                else:
-                    current_price = stock_prices.at[today, ticker]
-
-                nav_stock = qty * current_price
-                navs[ticker] = nav_stock
-                total_value += nav_stock
-
-            portfolio_weights = {ticker: navs[ticker] / total_value for ticker in active_stocks}
-
-        # Step 2: Compute today's portfolio return
-        weighted_return = 0
-        for ticker, weight in portfolio_weights.items():
-            weighted_return += weight * stock_returns.at[today, ticker]
-
-        # Step 3: Update NAV
-        if i > 0:  # skip first day
-            prev_nav = prev_nav * (1 + weighted_return)
-            nav_series.iloc[i] = prev_nav
-    return nav_series
\ No newline at end of file
@@ -1,7 +1,10 @@
 # Portfolio optimization logic (e.g., Max Sharpe, Min Vol)
+import time
 import numpy as np
-from scipy.optimize import minimize
+from scipy import linalg, sparse
+from scipy.optimize import minimize, linprog
 import pandas as pd
+from instrumentation import stage
 
 def get_portfolio_performance(weights, returns, freq=252):
     """
@@ -13,36 +16,332 @@ def get_portfolio_performance(weights, returns, freq=252):
     sharpe_ratio = port_return / port_volatility if port_volatility != 0 else 0
     return port_return, port_volatility, sharpe_ratio
 
-def optimize_portfolio(returns: pd.DataFrame, method: str = "sharpe"):
+def compute_moments(returns, freq=252):
     """
-    Optimizes portfolio based on the selected method: 'sharpe' or 'min_vol'.
-    Returns optimal weights and performance metrics.
+    Annualized mean vector and covariance matrix of periodic returns.
+    The covariance uses ddof=0 so it matches get_portfolio_performance exactly.
     """
-    num_assets = returns.shape[1]
-    initial_weights = np.array([1.0 / num_assets] * num_assets)
-    bounds = tuple((0, 1) for _ in range(num_assets))
-    constraints = {'type': 'eq', 'fun': lambda x: np.sum(x) - 1}
+    values = np.asarray(returns, dtype=float)
+    mean = values.mean(axis=0) * freq
+    cov = np.atleast_2d(np.cov(values, rowvar=False, ddof=0)) * freq
+    return mean, cov
+
+def performance_from_moments(weights, mean, cov):
+    """
+    Same metrics as get_portfolio_performance, from precomputed annualized moments.
+    """
+    weights = np.asarray(weights, dtype=float)
+    port_return = weights @ mean
+    port_volatility = np.sqrt(max(weights @ cov @ weights, 0.0))
+    sharpe_ratio = port_return / port_volatility if port_volatility != 0 else 0
+    return port_return, port_volatility, sharpe_ratio
 
+BUDGET_CONSTRAINT = {'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones_like(x)}
+
+def _objective(method, mean, cov):
+    """
+    Returns (objective, gradient) for the given method, both functions of the weights.
+    """
     if method == "sharpe":
         def objective(weights):
-            ret, vol, sharpe = get_portfolio_performance(weights, returns)
+            ret, vol, sharpe = performance_from_moments(weights, mean, cov)
             return -sharpe  # We maximize Sharpe
+
+        def gradient(weights):
+            cov_w = cov @ weights
+            vol = np.sqrt(max(weights @ cov_w, 0.0))
+            if vol == 0:
+                return np.zeros_like(weights)
+            ret = weights @ mean
+            return -(mean / vol - ret * cov_w / vol ** 3)
     elif method == "min_vol":
         def objective(weights):
-            _, vol, _ = get_portfolio_performance(weights, returns)
+            _, vol, _ = performance_from_moments(weights, mean, cov)
             return vol  # Minimize volatility
+
+        def gradient(weights):
+            cov_w = cov @ weights
+            vol = np.sqrt(max(weights @ cov_w, 0.0))
+            return cov_w / vol if vol != 0 else np.zeros_like(weights)
+    else:
+        raise ValueError("Invalid optimization method. Use 'sharpe', 'min_vol', 'min_cvar' or 'max_return_at_cvar'.")
+    return objective, gradient
+
+def _weight_bounds(num_assets, bounds=None):
+    """
+    Per-asset (low, high) bounds. bounds is None (long-only, 0 to 1),
+    one (low, high) pair for every asset, or a sequence of pairs.
+    """
+    if bounds is None:
+        bounds = (0, 1)
+    if np.ndim(bounds) == 1:
+        return tuple(tuple(bounds) for _ in range(num_assets))
+    return tuple(tuple(b) for b in bounds)
+
+def _deadline_callback(time_limit):
+    """
+    SLSQP callback raising TimeoutError once time_limit seconds have passed.
+    """
+    if time_limit is None:
+        return None
+    deadline = time.monotonic() + time_limit
+
+    def callback(weights):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"optimization exceeded {time_limit}s")
+    return callback
+
+def optimize_from_moments(mean, cov, method="sharpe", initial_weights=None, bounds=None, time_limit=None):
+    """
+    Fully invested SLSQP solve on annualized moments, long-only unless bounds
+    says otherwise. Cost does not depend on the length of the return history.
+    time_limit (seconds) aborts the solve with TimeoutError between iterations;
+    it covers the quadratic program and the ratio fallback together.
+    Returns the scipy OptimizeResult.
+    """
+    num_assets = len(mean)
+    if initial_weights is None:
+        initial_weights = np.array([1.0 / num_assets] * num_assets)
+    bounds = _weight_bounds(num_assets, bounds)
+    objective, gradient = _objective(method, mean, cov)
+    callback = _deadline_callback(time_limit)
+    with stage("optimizer.slsqp", method=method, assets=num_assets) as record:
+        result = _max_sharpe_qp(mean, cov, bounds, initial_weights, callback) if method == "sharpe" else None
+        if result is None or not result.success:
+            result = minimize(objective, initial_weights, jac=gradient, method="SLSQP",
+                              bounds=bounds, constraints=BUDGET_CONSTRAINT, callback=callback)
+        record["iterations"] = result.nit
+    return result
+
+def _max_sharpe_qp(mean, cov, bounds, initial_weights, callback=None):
+    """
+    Maximum Sharpe ratio as a convex quadratic program: with y = w / (mean . w),
+    minimize y'Σy subject to mean . y = 1 and low * sum(y) <= y <= high * sum(y);
+    the weights are y / sum(y). It is solved for u = L'y (Σ = LL'), where the
+    objective is |u|^2 / 2 and SLSQP's starting Hessian is already exact, so it
+    takes a few iterations instead of the ratio's many.
+    Returns None when Σ is singular or no asset has a positive expected return,
+    and an unsuccessful result when the program is infeasible; the caller then
+    solves the ratio instead. callback is the caller's _deadline_callback.
+    """
+    num_assets = len(mean)
+    if not (mean > 0).any():
+        return None
+    try:
+        lower = linalg.cholesky(cov, lower=True)
+    except linalg.LinAlgError:
+        return None
+    # y = to_weights @ u
+    to_weights = linalg.solve_triangular(lower, np.eye(num_assets), lower=True, trans="T")
+    low = np.array([-np.inf if b[0] is None else b[0] for b in bounds], dtype=float)
+    high = np.array([np.inf if b[1] is None else b[1] for b in bounds], dtype=float)
+    ones = np.ones((1, num_assets))
+    rows = np.vstack([
+        np.eye(num_assets)[np.isfinite(low)] - low[np.isfinite(low), None] * ones,
+        high[np.isfinite(high), None] * ones - np.eye(num_assets)[np.isfinite(high)],
+        ones,
+    ]) @ to_weights
+    expected = mean @ to_weights
+    constraints = [
+        {"type": "eq", "fun": lambda u: expected @ u - 1, "jac": lambda u: expected},
+        {"type": "ineq", "fun": lambda u: rows @ u, "jac": lambda u: rows},
+    ]
+    start_return = initial_weights @ mean
+    start = lower.T @ initial_weights / (start_return if start_return > 0 else mean.max())
+
+    result = minimize(lambda u: u @ u / 2, start, jac=lambda u: u, method="SLSQP",
+                      constraints=constraints, callback=callback)
+    y = to_weights @ result.x
+    if not result.success or y.sum() <= 0:
+        result.success = False
+        return result
+    result.x = y / y.sum()
+    result.fun = -performance_from_moments(result.x, mean, cov)[2]
+    return result
+
+CVAR_METHODS = ("min_cvar", "max_return_at_cvar")
+
+def scenario_cvar(weights, scenarios, level=0.95):
+    """
+    CVaR (expected loss in the worst 1 - level of scenarios, as a positive
+    fraction) of a portfolio over a scenarios x assets array of returns.
+    Matches the linear program's objective at its optimum.
+    """
+    losses = -np.asarray(scenarios, dtype=float) @ np.asarray(weights, dtype=float)
+    var = np.quantile(losses, level, method="inverted_cdf")
+    return float(var + np.maximum(losses - var, 0).mean() / (1 - level))
+
+def _min_cvar_lp(values, tail, low, high):
+    """
+    Dual of the minimum-CVaR LP: scenario probabilities y (0 <= y_s <= tail,
+    summing to 1) reweighting the losses, plus the budget dual and per-asset
+    slacks a - b for the weight bounds. One row per asset, so the simplex
+    basis stays small however many scenarios there are; the weights are the
+    duals of those rows.
+    """
+    num_scenarios, num_assets = values.shape
+    finite_low, finite_high = np.isfinite(low), np.isfinite(high)
+    identity = sparse.identity(num_assets, format="csr")
+    # maximize budget + low.a - high.b  s.t.  R'y + budget + a - b = 0, sum(y) = 1
+    cost = np.concatenate([np.zeros(num_scenarios), [-1.0],
+                           -np.where(finite_low, low, 0), np.where(finite_high, high, 0)])
+    A_eq = sparse.vstack([
+        sparse.hstack([sparse.csr_matrix(values.T), np.ones((num_assets, 1)), identity, -identity]),
+        sparse.hstack([np.ones((1, num_scenarios)), sparse.csr_matrix((1, 1 + 2 * num_assets))]),
+    ], format="csr")
+    b_eq = np.concatenate([np.zeros(num_assets), [1.0]])
+    bounds = ([(0, tail)] * num_scenarios + [(None, None)]
+              + [(0, None) if f else (0, 0) for f in np.concatenate([finite_low, finite_high])])
+    return dict(c=cost, A_eq=A_eq, b_eq=b_eq, bounds=bounds)
+
+def _max_return_lp(values, tail, low, high, max_cvar):
+    """
+    Maximum-return LP over weights, the VaR threshold and one shortfall per scenario:
+    shortfall_s >= -r_s . w - VaR, VaR + tail * sum(shortfall) <= max_cvar.
+    """
+    num_scenarios, num_assets = values.shape
+    shortfall_rows = sparse.hstack([
+        sparse.csr_matrix(-values), -np.ones((num_scenarios, 1)), -sparse.identity(num_scenarios, format="csr"),
+    ])
+    cvar_row = sparse.csr_matrix(np.concatenate([np.zeros(num_assets), [1.0], np.full(num_scenarios, tail)]))
+    A_eq = sparse.csr_matrix(np.concatenate([np.ones(num_assets), np.zeros(1 + num_scenarios)])[None, :])
+    weight_bounds = [(lo if np.isfinite(lo) else None, hi if np.isfinite(hi) else None) for lo, hi in zip(low, high)]
+    return dict(
+        c=np.concatenate([-values.mean(axis=0), np.zeros(1 + num_scenarios)]),
+        A_ub=sparse.vstack([shortfall_rows, cvar_row], format="csr"),
+        b_ub=np.concatenate([np.zeros(num_scenarios), [max_cvar]]),
+        A_eq=A_eq, b_eq=[1.0],
+        bounds=weight_bounds + [(None, None)] + [(0, None)] * num_scenarios,
+    )
+
+def optimize_cvar(scenarios, method="min_cvar", level=0.95, max_cvar=None, bounds=None, time_limit=None):
+    """
+    Scenario CVaR optimization as a sparse linear program (Rockafellar-Uryasev),
+    solved with HiGHS. scenarios is a scenarios x assets array of periodic
+    returns, historical or simulated; CVaR is in the same period.
+
+        min_cvar:            minimize  CVaR
+        max_return_at_cvar:  maximize  mean scenario return, with CVaR <= max_cvar
+    both fully invested within the weight bounds.
+    time_limit (seconds) raises TimeoutError if the solve takes longer.
+    Returns a scipy OptimizeResult with x the weights.
+    """
+    if method not in CVAR_METHODS:
+        raise ValueError("Invalid CVaR method. Use 'min_cvar' or 'max_return_at_cvar'.")
+    if method == "max_return_at_cvar" and max_cvar is None:
+        raise ValueError("max_return_at_cvar needs a max_cvar limit.")
+    values = np.asarray(scenarios, dtype=float)
+    num_scenarios, num_assets = values.shape
+    tail = 1.0 / ((1 - level) * num_scenarios)
+    low, high = np.array(_weight_bounds(num_assets, bounds), dtype=float).T   # None -> nan
+    low, high = np.nan_to_num(low, nan=-np.inf), np.nan_to_num(high, nan=np.inf)
+
+    # HiGHS presolve costs more than it saves on these dense-block problems
+    options = {"presolve": False}
+    if time_limit is not None:
+        options["time_limit"] = float(time_limit)
+    if method == "min_cvar":
+        problem = _min_cvar_lp(values, tail, low, high)
     else:
-        raise ValueError("Invalid optimization method. Use 'sharpe' or 'min_vol'.")
+        problem = _max_return_lp(values, tail, low, high, max_cvar)
+    with stage("optimizer.linprog", method=method, assets=num_assets, scenarios=num_scenarios) as record:
+        result = linprog(**problem, method="highs-ds", options=options)
+        record["iterations"] = result.nit
+    if result.status == 1 and time_limit is not None:
+        raise TimeoutError(f"optimization exceeded {time_limit}s")
+    if method == "min_cvar" and result.status == 3:
+        # an unbounded dual means no weights satisfy the bounds
+        raise ValueError("CVaR optimization failed: the weight bounds cannot sum to 1.")
+    if result.status != 0:
+        raise ValueError(f"CVaR optimization failed: {result.message}")
+    if method == "min_cvar":
+        result.x, result.fun = -result.eqlin.marginals[:num_assets], -result.fun
+    else:
+        result.x, result.fun = result.x[:num_assets], -result.fun
+    return result
 
-    result = minimize(objective, initial_weights, method="SLSQP",
-                      bounds=bounds, constraints=constraints)
+def optimize_portfolio(returns: pd.DataFrame, method: str = "sharpe", bounds=None, time_limit=None,
+                       level=0.95, max_cvar=None, scenarios=None):
+    """
+    Optimizes portfolio based on the selected method: 'sharpe', 'min_vol',
+    'min_cvar' or 'max_return_at_cvar' (see optimize_cvar).
+    bounds optionally limits each weight, e.g. (0, 0.3) for a 30% cap.
+    time_limit (seconds) raises TimeoutError if the solve takes longer.
+    CVaR methods use the returns themselves as scenarios unless scenarios
+    (e.g. simulated returns, same columns) is given; level is the CVaR
+    confidence and max_cvar the loss limit of 'max_return_at_cvar'.
+    Returns optimal weights and performance metrics (plus 'CVaR' for the CVaR methods).
+    """
+    mean, cov = compute_moments(returns)
+    if method in CVAR_METHODS:
+        scenarios = returns if scenarios is None else scenarios
+        result = optimize_cvar(scenarios, method, level, max_cvar, bounds=bounds, time_limit=time_limit)
+    else:
+        result = optimize_from_moments(mean, cov, method, bounds=bounds, time_limit=time_limit)
 
     optimal_weights = result.x
-    ret, vol, sharpe = get_portfolio_performance(optimal_weights, returns)
+    ret, vol, sharpe = performance_from_moments(optimal_weights, mean, cov)
 
-    return {
+    performance = {
         "Optimal Weights": dict(zip(returns.columns, np.round(optimal_weights, 4))),
         "Annual Return": round(ret, 4),
         "Volatility": round(vol, 4),
         "Sharpe Ratio": round(sharpe, 4)
     }
+    if method in CVAR_METHODS:
+        performance["CVaR"] = round(scenario_cvar(optimal_weights, scenarios, level), 4)
+    return performance
+
+def efficient_frontier(returns: pd.DataFrame, n_points: int = 100):
+    """
+    Long-only efficient frontier on an evenly spaced grid of target returns,
+    from the minimum-volatility portfolio up to the best single asset.
+    Moments are computed once and each point is warm-started from the previous one.
+    Points whose solve does not converge are left out.
+
+    Returns a dict of arrays: 'Annual Return', 'Volatility' and 'Sharpe Ratio'
+    of shape (converged points,), 'Weights' of shape (converged points, n_assets), and 'Tickers'.
+    """
+    mean, cov = compute_moments(returns)
+    num_assets = len(mean)
+    bounds = tuple((0, 1) for _ in range(num_assets))
+
+    def variance(weights):
+        return weights @ cov @ weights
+
+    def variance_gradient(weights):
+        return 2 * cov @ weights
+
+    weights = np.empty((n_points, num_assets))
+    converged = np.ones(n_points, dtype=bool)
+    start = optimize_from_moments(mean, cov, "min_vol")
+    weights[0] = start.x
+    converged[0] = start.success
+    targets = np.linspace(weights[0] @ mean, mean.max(), n_points)
+    target_constraint = {'type': 'eq', 'jac': lambda x: mean}
+
+    previous = weights[0]
+    for i in range(1, n_points):
+        target_constraint['fun'] = lambda x, target=targets[i]: x @ mean - target
+        with stage("optimizer.slsqp", method="frontier", assets=num_assets) as record:
+            result = minimize(variance, previous, jac=variance_gradient, method="SLSQP",
+                              bounds=bounds, constraints=[BUDGET_CONSTRAINT, target_constraint])
+            record["iterations"] = result.nit
+        weights[i] = result.x
+        converged[i] = result.success
+        if result.success:
+            previous = result.x
+
+    # points whose solve failed are left out rather than drawn off the frontier
+    weights = weights[converged]
+    n_points = len(weights)
+    annual_return = weights @ mean
+    volatility = np.sqrt(np.maximum(np.einsum("ij,jk,ik->i", weights, cov, weights), 0))
+    sharpe_ratio = np.divide(annual_return, volatility, out=np.zeros(n_points), where=volatility != 0)
+    return {
+        "Tickers": list(returns.columns),
+        "Annual Return": annual_return,
+        "Volatility": volatility,
+        "Sharpe Ratio": sharpe_ratio,
+        "Weights": weights
+    }
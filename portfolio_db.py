@@ -1,17 +1,18 @@
 # %%
-import sqlite3
+import json
 from datetime import datetime
 import os
-
-DB_NAME = "users.db"
-
-def get_connection():
-    return sqlite3.connect(DB_NAME, check_same_thread=False)
+from db import connection
 # %%
 def init_portfolio_tables():
-    conn = get_connection()
-    cur = conn.cursor()
+    with connection() as conn:
+        _create_tables(conn.cursor())
+        migrated = conn.execute("SELECT EXISTS (SELECT 1 FROM stock_prices)").fetchone()[0]
 
+    if not migrated:
+        migrate_price_blobs()
+
+def _create_tables(cur):
     # Portfolios table
     cur.execute('''
         CREATE TABLE IF NOT EXISTS portfolios (
@@ -42,7 +43,84 @@ def init_portfolio_tables():
                 prices NVARCHAR(4000)
                 );
     """)
-
+    # daily closes, one row per (ticker, date); the primary key doubles as the range index
+    cur.execute("""CREATE TABLE IF NOT EXISTS stock_prices (
+                ticker VARCHAR(50) NOT NULL,
+                date TEXT NOT NULL,
+                close REAL,
+                PRIMARY KEY (ticker, date)
+                ) WITHOUT ROWID;
+    """)
+    # bumped by price ingestion so in-memory caches can drop stale tickers
+    cur.execute("""CREATE TABLE IF NOT EXISTS price_versions (
+                ticker VARCHAR(50) PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+    """)
+    # earliest date written by each version bump (NULL when unknown)
+    cur.execute("""CREATE TABLE IF NOT EXISTS price_changes (
+                ticker VARCHAR(50) NOT NULL,
+                version INTEGER NOT NULL,
+                first_date TEXT,
+                PRIMARY KEY (ticker, version)
+                ) WITHOUT ROWID;
+    """)
+    # materialized NAV per portfolio, extended by nav.refresh_portfolio_nav
+    cur.execute("""CREATE TABLE IF NOT EXISTS portfolio_nav (
+                portfolio_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                nav REAL,
+                PRIMARY KEY (portfolio_id, date)
+                ) WITHOUT ROWID;
+    """)
+    # positions / entry prices / weights right after each purchase date
+    cur.execute("""CREATE TABLE IF NOT EXISTS portfolio_nav_snapshots (
+                portfolio_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (portfolio_id, date)
+                ) WITHOUT ROWID;
+    """)
+    # latest NAV / P&L figures per portfolio, written in bulk by batch_nav.py
+    cur.execute("""CREATE TABLE IF NOT EXISTS portfolio_metrics (
+                portfolio_id INTEGER PRIMARY KEY,
+                as_of TEXT,
+                nav REAL,
+                performance REAL,
+                day_change REAL,
+                volatility REAL,
+                max_drawdown REAL,
+                market_value REAL,
+                cost_basis REAL,
+                pnl REAL,
+                holdings INTEGER,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+    """)
+    # holdings rows and price versions the stored NAV was computed from
+    cur.execute("""CREATE TABLE IF NOT EXISTS portfolio_nav_meta (
+                portfolio_id INTEGER PRIMARY KEY,
+                holdings TEXT NOT NULL,
+                versions TEXT NOT NULL,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+    """)
+    # buys, sells, dividends and cash movements; the holdings rows count as buys (see ledger.py)
+    cur.execute("""CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                portfolio_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                type TEXT NOT NULL CHECK (type IN ('buy', 'sell', 'dividend', 'deposit', 'withdrawal')),
+                ticker TEXT,
+                quantity REAL,
+                price REAL,
+                amount REAL,
+                fee REAL NOT NULL DEFAULT 0,
+                FOREIGN KEY (portfolio_id) REFERENCES portfolios(id) ON DELETE CASCADE
+                );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS transactions_portfolio_date ON transactions (portfolio_id, date)")
 
     # # Cash table
     # cur.execute('''
@@ -54,94 +132,344 @@ def init_portfolio_tables():
     #     )
     # ''')
 
-    conn.commit()
-    conn.close()
-
 # CRUD Functions
 
 def create_portfolio(user_id, name, currency):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO portfolios (user_id, name, currency) VALUES (?, ?, ?)", (user_id, name, currency))
-    conn.commit()
-    portfolio_id = cur.lastrowid
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO portfolios (user_id, name, currency) VALUES (?, ?, ?)", (user_id, name, currency))
+        portfolio_id = cur.lastrowid
     return portfolio_id
 
 def add_holding(portfolio_id, ticker, entry_date, entry_price, quantity):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"INSERT INTO holdings (portfolio_id, ticker, entry_date, entry_price, quantity) VALUES (?, ?, ?, ?, ?)", 
-                (portfolio_id, ticker, entry_date, entry_price, quantity))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("INSERT INTO holdings (portfolio_id, ticker, entry_date, entry_price, quantity) VALUES (?, ?, ?, ?, ?)",
+                     (portfolio_id, ticker, entry_date, entry_price, quantity))
+
+def add_holdings(portfolio_id, holdings):
+    """
+    Inserts many (ticker, entry_date, entry_price, quantity) rows in one transaction.
+    """
+    with connection() as conn:
+        conn.executemany("INSERT INTO holdings (portfolio_id, ticker, entry_date, entry_price, quantity) VALUES (?, ?, ?, ?, ?)",
+                         ((portfolio_id, *holding) for holding in holdings))
 
 def get_holdings(portfolio_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT ticker, entry_date, entry_price, quantity FROM holdings WHERE portfolio_id = ?", (portfolio_id,))
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT ticker, entry_date, entry_price, quantity FROM holdings WHERE portfolio_id = ?", (portfolio_id,))
+        rows = cur.fetchall()
     return rows
 
-def delete_portfolio(portfolio_id):
-    conn = sqlite3.connect("portfolio.db")
-    cursor = conn.cursor()
+def add_transaction(portfolio_id, type, date, ticker=None, quantity=None, price=None, amount=None, fee=0.0):
+    """
+    Records one ledger event. buy/sell need ticker, quantity and price;
+    dividend, deposit and withdrawal need amount (dividends also a ticker).
+    """
+    add_transactions(portfolio_id, [(date, type, ticker, quantity, price, amount, fee)])
 
-    # Delete all holdings for that portfolio
-    cursor.execute("DELETE FROM holdings WHERE portfolio_id = ?", (portfolio_id,))
-    # Delete the portfolio itself
-    cursor.execute("DELETE FROM portfolios WHERE id = ?", (portfolio_id,))
+def add_transactions(portfolio_id, transactions):
+    """
+    Inserts many (date, type, ticker, quantity, price, amount, fee) rows in one transaction.
+    """
+    with connection() as conn:
+        conn.executemany(
+            "INSERT INTO transactions (portfolio_id, date, type, ticker, quantity, price, amount, fee) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((portfolio_id, *transaction) for transaction in transactions)
+        )
+
+def get_transactions(portfolio_id, with_ids=False):
+    """
+    (date, type, ticker, quantity, price, amount, fee) rows ordered by date, then as recorded.
+    with_ids=True prepends each row's id (for delete_transaction).
+    """
+    columns = "id, date, type, ticker, quantity, price, amount, fee" if with_ids else "date, type, ticker, quantity, price, amount, fee"
+    with connection() as conn:
+        return conn.execute(
+            f"SELECT {columns} FROM transactions WHERE portfolio_id = ? ORDER BY date, id", (portfolio_id,)
+        ).fetchall()
+
+def delete_transaction(portfolio_id, transaction_id):
+    with connection() as conn:
+        conn.execute("DELETE FROM transactions WHERE portfolio_id = ? AND id = ?", (portfolio_id, transaction_id))
 
-    conn.commit()
-    conn.close()
+def get_all_holdings():
+    """
+    (portfolio_id, ticker, entry_date, entry_price, quantity) for every portfolio,
+    each portfolio's rows in the order they were added.
+    """
+    with connection() as conn:
+        return conn.execute(
+            "SELECT portfolio_id, ticker, entry_date, entry_price, quantity FROM holdings ORDER BY portfolio_id, id"
+        ).fetchall()
+
+def delete_portfolio(portfolio_id):
+    with connection() as conn:
+        # Delete all holdings for that portfolio
+        conn.execute("DELETE FROM holdings WHERE portfolio_id = ?", (portfolio_id,))
+        # Delete its transactions and materialized NAV
+        for table in ("transactions", "portfolio_nav", "portfolio_nav_snapshots", "portfolio_nav_meta", "portfolio_metrics"):
+            conn.execute(f"DELETE FROM {table} WHERE portfolio_id = ?", (portfolio_id,))
+        # Delete the portfolio itself
+        conn.execute("DELETE FROM portfolios WHERE id = ?", (portfolio_id,))
 
 def get_portfolios_by_user(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name FROM portfolios WHERE user_id = ?", (user_id,))
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, name FROM portfolios WHERE user_id = ?", (user_id,))
+        rows = cur.fetchall()
     return rows
 
 def get_portfolio_by_id(portfolio_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT name, currency FROM portfolios WHERE id = ?", (portfolio_id,))
-    rows = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name, currency FROM portfolios WHERE id = ?", (portfolio_id,))
+        rows = cur.fetchone()
     return rows
 # %%
 def get_prices(tickers):
-    conn = get_connection()
-    cur = conn.cursor()
-    placeholders = ','.join(['?'] * len(tickers)) 
-    cur.execute(
-        f"SELECT prices FROM stocks WHERE ticker in ({placeholders})",
-        tickers
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        placeholders = ','.join(['?'] * len(tickers)) 
+        cur.execute(
+            f"SELECT prices FROM stocks WHERE ticker in ({placeholders})",
+            tickers
+        )
+        rows = cur.fetchall()
+    return rows
+# %%
+def get_price_history(tickers, start_date=None, end_date=None):
+    """
+    Returns (ticker, date, close) rows ordered by ticker and date.
+    Dates are 'YYYY-MM-DD' strings. The last close on or before start_date is
+    included so callers can forward-fill into the requested window.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        rows = []
+        for ticker in tickers:
+            lower = start_date
+            if start_date is not None:
+                cur.execute(
+                    "SELECT MAX(date) FROM stock_prices WHERE ticker = ? AND date <= ?",
+                    (ticker, start_date)
+                )
+                lower = cur.fetchone()[0] or start_date
+            query = "SELECT ticker, date, close FROM stock_prices WHERE ticker = ?"
+            params = [ticker]
+            if lower is not None:
+                query += " AND date >= ?"
+                params.append(lower)
+            if end_date is not None:
+                query += " AND date <= ?"
+                params.append(end_date)
+            cur.execute(query + " ORDER BY date", params)
+            rows.extend(cur.fetchall())
     return rows
+
+def get_price_versions(tickers):
+    """
+    Returns {ticker: version} for tickers. Tickers never bumped are at version 0.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        placeholders = ','.join(['?'] * len(tickers))
+        cur.execute(
+            f"SELECT ticker, version FROM price_versions WHERE ticker in ({placeholders})",
+            tuple(tickers)
+        )
+        versions = dict(cur.fetchall())
+    return {ticker: versions.get(ticker, 0) for ticker in tickers}
+
+def bump_price_versions(tickers, first_dates=None):
+    """
+    Marks the price history of tickers as changed. Call after writing to stock_prices.
+    first_dates ({ticker: 'YYYY-MM-DD'}) is the earliest date written per ticker;
+    without it, consumers assume the whole history may have changed.
+    """
+    with connection() as conn:
+        bump_price_versions_in(conn.cursor(), tickers, first_dates)
+
+def bump_price_versions_in(cur, tickers, first_dates=None):
+    """
+    bump_price_versions inside the caller's transaction.
+    """
+    first_dates = first_dates or {}
+    for ticker in tickers:
+        cur.execute(
+            """INSERT INTO price_versions (ticker, version) VALUES (?, 1)
+               ON CONFLICT(ticker) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+               RETURNING version""",
+            (ticker,)
+        )
+        version = cur.fetchone()[0]
+        cur.execute(
+            "INSERT OR REPLACE INTO price_changes (ticker, version, first_date) VALUES (?, ?, ?)",
+            (ticker, version, first_dates.get(ticker))
+        )
+
+def get_price_changes_since(versions):
+    """
+    Earliest date written to the prices of any ticker since the given
+    {ticker: version}. Returns None when nothing changed, and "" when a
+    change of unknown extent happened (treat as the whole history).
+    """
+    earliest = None
+    with connection() as conn:
+        cur = conn.cursor()
+        for ticker, version in versions.items():
+            cur.execute(
+                "SELECT COUNT(*), COUNT(first_date), MIN(first_date) FROM price_changes WHERE ticker = ? AND version > ?",
+                (ticker, version)
+            )
+            changes, dated, first_date = cur.fetchone()
+            if changes > dated:
+                return ""
+            if first_date is not None and (earliest is None or first_date < earliest):
+                earliest = first_date
+    return earliest
+
+METRIC_COLUMNS = (
+    "as_of", "nav", "performance", "day_change", "volatility", "max_drawdown",
+    "market_value", "cost_basis", "pnl", "holdings"
+)
+
+def save_portfolio_metrics(metrics):
+    """
+    Upserts {portfolio_id: {column: value}} (see METRIC_COLUMNS) in one transaction.
+    """
+    columns = ", ".join(METRIC_COLUMNS)
+    updates = ", ".join(f"{c} = excluded.{c}" for c in METRIC_COLUMNS)
+    with connection() as conn:
+        conn.executemany(
+            f"""INSERT INTO portfolio_metrics (portfolio_id, {columns}) VALUES (?{", ?" * len(METRIC_COLUMNS)})
+                ON CONFLICT(portfolio_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP""",
+            [(pid, *(row.get(c) for c in METRIC_COLUMNS)) for pid, row in metrics.items()]
+        )
+
+def get_portfolio_metrics(portfolio_id):
+    """
+    Latest batch metrics of a portfolio as {column: value}, or None if never computed.
+    """
+    with connection() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(METRIC_COLUMNS)}, updated_at FROM portfolio_metrics WHERE portfolio_id = ?",
+            (portfolio_id,)
+        ).fetchone()
+    return dict(zip(METRIC_COLUMNS + ("updated_at",), row)) if row else None
+
+def get_nav_meta(portfolio_id):
+    """
+    (holdings rows, {ticker: price version}) the stored NAV was computed from, or None.
+    """
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT holdings, versions FROM portfolio_nav_meta WHERE portfolio_id = ?", (portfolio_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    return [tuple(holding) for holding in json.loads(row[0])], json.loads(row[1])
+
+def get_portfolio_nav(portfolio_id):
+    """
+    Stored (date, nav) rows of a portfolio, oldest first.
+    """
+    with connection() as conn:
+        return conn.execute(
+            "SELECT date, nav FROM portfolio_nav WHERE portfolio_id = ? ORDER BY date", (portfolio_id,)
+        ).fetchall()
+
+def get_nav_restart_point(portfolio_id, before_date):
+    """
+    Where to resume the stored NAV of a portfolio so that days from before_date on are recomputed:
+    (last stored date before before_date, its nav, latest snapshot state on or before it).
+    Returns None when no stored day precedes before_date.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT date, nav FROM portfolio_nav WHERE portfolio_id = ? AND date < ? ORDER BY date DESC LIMIT 1",
+            (portfolio_id, before_date)
+        )
+        base = cur.fetchone()
+        if base is None:
+            return None
+        cur.execute(
+            "SELECT state FROM portfolio_nav_snapshots WHERE portfolio_id = ? AND date <= ? ORDER BY date DESC LIMIT 1",
+            (portfolio_id, base[0])
+        )
+        snapshot = cur.fetchone()
+    return base[0], base[1], json.loads(snapshot[0]) if snapshot else None
+
+def save_portfolio_nav(portfolio_id, after_date, nav_rows, snapshots, holdings, versions):
+    """
+    Replaces the stored NAV of a portfolio after after_date (None: everything) with
+    nav_rows [(date, nav)] and snapshots {date: state}, and records the holdings
+    rows and price versions used, in one transaction.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        for table in ("portfolio_nav", "portfolio_nav_snapshots"):
+            cur.execute(
+                f"DELETE FROM {table} WHERE portfolio_id = ? AND date > ?",
+                (portfolio_id, after_date or "")
+            )
+        cur.executemany(
+            "INSERT INTO portfolio_nav (portfolio_id, date, nav) VALUES (?, ?, ?)",
+            [(portfolio_id, date, nav) for date, nav in nav_rows]
+        )
+        cur.executemany(
+            "INSERT INTO portfolio_nav_snapshots (portfolio_id, date, state) VALUES (?, ?, ?)",
+            [(portfolio_id, date, json.dumps(state)) for date, state in snapshots.items()]
+        )
+        cur.execute(
+            """INSERT INTO portfolio_nav_meta (portfolio_id, holdings, versions) VALUES (?, ?, ?)
+               ON CONFLICT(portfolio_id) DO UPDATE SET holdings = excluded.holdings,
+               versions = excluded.versions, updated_at = CURRENT_TIMESTAMP""",
+            (portfolio_id, json.dumps([list(holding) for holding in holdings]), json.dumps(versions))
+        )
+
+def migrate_price_blobs():
+    """
+    One-shot copy of the legacy JSON blobs in stocks.prices into stock_prices.
+    Existing (ticker, date) rows are kept. Returns the number of rows written.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT ticker, prices FROM stocks WHERE prices IS NOT NULL")
+        written = 0
+        for ticker, blob in cur.fetchall():
+            table = json.loads(blob)
+            index_name = table["schema"]["primaryKey"][0]
+            rows = []
+            for record in table["data"]:
+                value = next((v for k, v in record.items() if k != index_name), None)
+                if value is not None:
+                    rows.append((ticker, str(record[index_name])[:10], float(value)))
+            cur.executemany(
+                "INSERT OR IGNORE INTO stock_prices (ticker, date, close) VALUES (?, ?, ?)",
+                rows
+            )
+            written += cur.rowcount
+    return written
 # %%
 def get_stocks_data(stocks):
-    conn = get_connection()
-    cur = conn.cursor()
-    placeholders = ','.join(['?'] * len(stocks)) 
-    cur.execute(
-        f"SELECT ticker, company, prices FROM stocks WHERE company in ({placeholders})",
-        stocks
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        placeholders = ','.join(['?'] * len(stocks)) 
+        cur.execute(
+            f"SELECT ticker, company, prices FROM stocks WHERE company in ({placeholders})",
+            stocks
+        )
+        rows = cur.fetchall()
     return rows
 # %%
 def get_all_stocks():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"SELECT ticker, company FROM stocks; ")
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT ticker, company FROM stocks; ")
+        rows = cur.fetchall()
     return rows
 
 # %%
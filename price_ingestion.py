@@ -0,0 +1,108 @@
+# Appends daily CSE closes (cse_prices_YYYY_MM_DD.csv written by cron_job_prices) to stock_prices
+import argparse
+import os
+import re
+import pandas as pd
+from db import connection
+from portfolio_db import bump_price_versions_in
+
+FILE_PATTERN = re.compile(r"cse_prices_(\d{4})_(\d{2})_(\d{2})\.csv$")
+
+
+def price_file_date(path):
+    """
+    Trading date of a daily price file as 'YYYY-MM-DD', or None if the name doesn't match.
+    """
+    match = FILE_PATTERN.search(os.path.basename(path))
+    return "-".join(match.groups()) if match else None
+
+
+def read_price_files(paths, company_tickers):
+    """
+    Reads daily price files into one (ticker, date, close) frame.
+    Companies are mapped to tickers with company_tickers ({company: ticker}).
+    Returns the frame and the set of company names that could not be mapped.
+    """
+    frames = []
+    for path in paths:
+        day = price_file_date(path)
+        if day is None:
+            raise ValueError(f"Not a daily price file: {path}")
+        df = pd.read_csv(path)
+        frames.append(pd.DataFrame({"company": df["stock"], "date": day, "close": pd.to_numeric(df["price"], errors="coerce")}))
+
+    prices = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["company", "date", "close"])
+    prices["ticker"] = prices["company"].map(company_tickers)
+    unknown = set(prices.loc[prices["ticker"].isna(), "company"])
+    prices = prices.dropna(subset=["ticker", "close"])
+    prices = prices.drop_duplicates(subset=["ticker", "date"], keep="last")
+    return prices[["ticker", "date", "close"]], unknown
+
+
+def ingest_price_files(paths):
+    """
+    Appends the rows of daily price files that are not stored yet, in one transaction.
+    Re-running on the same files is a no-op. Bumps the price version of every
+    ticker that received rows.
+    Returns {"rows": inserted rows, "tickers": touched tickers, "unknown": unmapped companies}.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        company_tickers = dict(cur.execute("SELECT company, ticker FROM stocks").fetchall())
+        prices, unknown = read_price_files(paths, company_tickers)
+
+        new_rows = []
+        for ticker, rows in prices.groupby("ticker"):
+            cur.execute(
+                "SELECT date FROM stock_prices WHERE ticker = ? AND date BETWEEN ? AND ?",
+                (ticker, rows["date"].min(), rows["date"].max())
+            )
+            stored = {date for (date,) in cur.fetchall()}
+            rows = rows[~rows["date"].isin(stored)]
+            new_rows.extend(rows.itertuples(index=False, name=None))
+
+        cur.executemany("INSERT INTO stock_prices (ticker, date, close) VALUES (?, ?, ?)", new_rows)
+        first_dates = {}
+        for ticker, date, _ in new_rows:
+            first_dates[ticker] = min(date, first_dates.get(ticker, date))
+        touched = sorted(first_dates)
+        bump_price_versions_in(cur, touched, first_dates)
+
+    return {"rows": len(new_rows), "tickers": touched, "unknown": unknown}
+
+
+def ingest_price_file(path):
+    """
+    Appends one day's price file. See ingest_price_files.
+    """
+    return ingest_price_files([path])
+
+
+def backfill_prices(directory):
+    """
+    Loads every cse_prices_*.csv in directory in a single bulk pass.
+    Days already stored are skipped, so a whole archive can be replayed safely.
+    """
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if price_file_date(name)
+    )
+    return ingest_price_files(paths)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append daily CSE price files to the stock_prices table.")
+    parser.add_argument("paths", nargs="*", help="cse_prices_YYYY_MM_DD.csv files to ingest, one transaction each")
+    parser.add_argument("--backfill", metavar="DIR", help="ingest every daily price file in DIR in one pass")
+    parser.add_argument("--export-matrix", action="store_true",
+                        help="rewrite the shared memory-mapped price matrix afterwards")
+    args = parser.parse_args()
+
+    results = [backfill_prices(args.backfill)] if args.backfill else [ingest_price_file(path) for path in args.paths]
+    for result in results:
+        print(f"{result['rows']} rows added for {len(result['tickers'])} tickers")
+        if result["unknown"]:
+            print("Unknown companies:", ", ".join(sorted(result["unknown"])))
+    if args.export_matrix:
+        from shared_prices import export_price_matrix
+        print("Price matrix written to", export_price_matrix())
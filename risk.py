@@ -0,0 +1,233 @@
+# Risk analytics on NAV series or weighted asset returns
+from collections import deque
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+
+def returns_from_nav(nav):
+    """
+    Daily simple returns of a NAV / price series (or frame), first day dropped.
+    """
+    return nav.pct_change().iloc[1:]
+
+
+def portfolio_returns(asset_returns: pd.DataFrame, weights):
+    """
+    Returns of a constant-weight portfolio. weights is a vector in column
+    order or a {ticker: weight} mapping (missing tickers weigh 0).
+    """
+    if isinstance(weights, dict):
+        weights = [weights.get(t, 0.0) for t in asset_returns.columns]
+    return pd.Series(asset_returns.to_numpy() @ np.asarray(weights, dtype=float),
+                     index=asset_returns.index, name="Portfolio")
+
+
+def _rolling_sum(values, window):
+    """
+    Sum of the last `window` rows for every row (NaN until the window is full),
+    from one cumulative sum: each new observation costs O(1).
+    Like pandas rolling, a row is NaN while a NaN is inside its window; the
+    sums recover once it has left, since NaNs are summed as 0 and counted apart.
+    """
+    out = np.full(values.shape, np.nan)
+    if len(values) < window:
+        return out
+    missing = np.isnan(values)
+    total = np.cumsum(np.where(missing, 0.0, values), axis=0)
+    gaps = np.cumsum(missing, axis=0)
+    out[window - 1] = total[window - 1]
+    out[window:] = total[window:] - total[:-window]
+    gaps[window:] = gaps[window:] - gaps[:-window]
+    out[window - 1:][gaps[window - 1:] > 0] = np.nan
+    return out
+
+
+def _wrap(values, like, name=None):
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    return pd.Series(values, index=like.index, name=name or like.name)
+
+
+def rolling_volatility(returns, window=63, freq=252, ddof=1):
+    """
+    Annualized rolling volatility of a returns Series / DataFrame (matches
+    returns.rolling(window).std() * sqrt(freq) for ddof=1).
+    """
+    x = returns.to_numpy(dtype=float)
+    # centring on the full-sample mean keeps the sum-of-squares difference accurate
+    x = x - np.nanmean(x, axis=0)
+    mean = _rolling_sum(x, window) / window
+    variance = (_rolling_sum(x * x, window) - window * mean ** 2) / (window - ddof)
+    return _wrap(np.sqrt(np.maximum(variance, 0)) * np.sqrt(freq), returns)
+
+
+def _rolling_comoments(returns, benchmark, window):
+    """
+    Rolling covariance with the benchmark and both variances (ddof=1), on the
+    dates both have a return. Returns (x, cov, var_x, var_y) with x the aligned returns.
+    A return missing on either side is missing for both, as in pandas' pairwise rolling cov.
+    """
+    x, y = returns.align(benchmark, join="inner", axis=0)
+    x_values = x.to_numpy(dtype=float)
+    y_values = y.to_numpy(dtype=float)
+    if x_values.ndim == 2:
+        y_values = y_values[:, None]
+    missing = np.isnan(x_values) | np.isnan(y_values)
+    x_values = np.where(missing, np.nan, x_values)
+    y_values = np.where(missing, np.nan, y_values)
+    x_values = x_values - np.nanmean(x_values, axis=0)
+    y_values = y_values - np.nanmean(y_values, axis=0)
+    sx, sy = _rolling_sum(x_values, window), _rolling_sum(y_values, window)
+    cov = (_rolling_sum(x_values * y_values, window) - sx * sy / window) / (window - 1)
+    var_x = (_rolling_sum(x_values * x_values, window) - sx * sx / window) / (window - 1)
+    var_y = (_rolling_sum(y_values * y_values, window) - sy * sy / window) / (window - 1)
+    return x, cov, var_x, var_y
+
+
+def rolling_beta(returns, benchmark, window=63):
+    """
+    Rolling beta of returns (Series or DataFrame) against a benchmark returns Series.
+    """
+    x, cov, _, var_y = _rolling_comoments(returns, benchmark, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _wrap(cov / var_y, x)
+
+
+def rolling_correlation(returns, benchmark, window=63):
+    """
+    Rolling Pearson correlation of returns (Series or DataFrame) with a benchmark returns Series.
+    """
+    x, cov, var_x, var_y = _rolling_comoments(returns, benchmark, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _wrap(cov / np.sqrt(var_x * var_y), x)
+
+
+def drawdowns(nav):
+    """
+    Drawdown from the running peak and the worst drawdown so far, for a NAV Series.
+    Returns a DataFrame with 'Drawdown' and 'Max Drawdown' columns (0 = at peak, -0.2 = 20% down).
+    """
+    values = nav.to_numpy(dtype=float)
+    drawdown = values / np.maximum.accumulate(values) - 1
+    return pd.DataFrame(
+        {"Drawdown": drawdown, "Max Drawdown": np.minimum.accumulate(drawdown)},
+        index=nav.index
+    )
+
+
+def value_at_risk(returns, level=0.95, method="historical"):
+    """
+    One-period Value at Risk as a positive loss fraction: the loss not exceeded
+    with probability `level`. method is 'historical' (empirical quantile) or
+    'parametric' (normal distribution with the sample mean and std).
+    """
+    x = np.asarray(returns, dtype=float)
+    x = x[~np.isnan(x)]
+    if method == "historical":
+        return float(-np.quantile(x, 1 - level))
+    if method == "parametric":
+        return float(-(x.mean() + norm.ppf(1 - level) * x.std(ddof=1)))
+    raise ValueError("Invalid method. Choose 'historical' or 'parametric'.")
+
+
+def conditional_value_at_risk(returns, level=0.95, method="historical"):
+    """
+    Expected shortfall: the average loss in the worst (1 - level) of periods,
+    as a positive fraction. Same methods as value_at_risk.
+    """
+    x = np.asarray(returns, dtype=float)
+    x = x[~np.isnan(x)]
+    if method == "historical":
+        tail = x[x <= np.quantile(x, 1 - level)]
+        return float(-tail.mean())
+    if method == "parametric":
+        alpha = 1 - level
+        return float(-(x.mean() - x.std(ddof=1) * norm.pdf(norm.ppf(alpha)) / alpha))
+    raise ValueError("Invalid method. Choose 'historical' or 'parametric'.")
+
+
+def rolling_value_at_risk(returns, window=63, level=0.95):
+    """
+    Rolling parametric (normal) VaR from the rolling mean and std, O(1) per observation.
+    """
+    x = returns.to_numpy(dtype=float)
+    mean = _rolling_sum(x, window) / window
+    std = rolling_volatility(returns, window, freq=1).to_numpy()
+    return _wrap(-(mean + norm.ppf(1 - level) * std), returns)
+
+
+class RollingStats:
+    """
+    Streaming window over (return, benchmark return) pairs.
+    update() adds one observation and drops the oldest in O(1), keeping
+    running sums for the latest volatility, beta and correlation.
+    A pair with a NaN adds nothing to the sums and is counted as missing.
+    """
+
+    def __init__(self, window=63, freq=252):
+        self.window = window
+        self.freq = freq
+        self._pairs = deque()
+        self._sums = np.zeros(5)   # x, y, xx, yy, xy
+        self._missing = 0
+
+    def update(self, x, y=0.0):
+        missing = bool(np.isnan(x) or np.isnan(y))
+        term = np.zeros(5) if missing else np.array([x, y, x * x, y * y, x * y])
+        self._pairs.append((term, missing))
+        self._sums += term
+        self._missing += missing
+        if len(self._pairs) > self.window:
+            term, missing = self._pairs.popleft()
+            self._sums -= term
+            self._missing -= missing
+        return self.stats()
+
+    def stats(self):
+        """
+        {"Volatility", "Beta", "Correlation"} over the current window (NaN until
+        it is full, and while it holds a missing pair).
+        """
+        n = len(self._pairs)
+        if n < self.window or self._missing:
+            return {"Volatility": np.nan, "Beta": np.nan, "Correlation": np.nan}
+        sx, sy, sxx, syy, sxy = self._sums
+        var_x = (sxx - sx * sx / n) / (n - 1)
+        var_y = (syy - sy * sy / n) / (n - 1)
+        cov = (sxy - sx * sy / n) / (n - 1)
+        return {
+            "Volatility": float(np.sqrt(max(var_x, 0)) * np.sqrt(self.freq)),
+            "Beta": float(cov / var_y) if var_y > 0 else np.nan,
+            "Correlation": float(cov / np.sqrt(var_x * var_y)) if var_x > 0 and var_y > 0 else np.nan,
+        }
+
+
+def risk_report(nav, benchmark_nav=None, window=63, level=0.95, freq=252):
+    """
+    Risk figures for a NAV series (e.g. from compute_weighted_nav), optionally
+    against benchmark NAVs / prices (one column per benchmark, e.g. MASI).
+    Returns {"Metrics": {name: value}, "Series": DataFrame of rolling series}.
+    """
+    returns = returns_from_nav(nav)
+    series = drawdowns(nav)
+    series["Rolling Volatility"] = rolling_volatility(returns, window, freq)
+    metrics = {
+        "Volatility": float(returns.std() * np.sqrt(freq)),
+        "Max Drawdown": float(series["Max Drawdown"].iat[-1]),
+        f"VaR {level:.0%} (historical)": value_at_risk(returns, level, "historical"),
+        f"CVaR {level:.0%} (historical)": conditional_value_at_risk(returns, level, "historical"),
+        f"VaR {level:.0%} (parametric)": value_at_risk(returns, level, "parametric"),
+        f"CVaR {level:.0%} (parametric)": conditional_value_at_risk(returns, level, "parametric"),
+    }
+    if benchmark_nav is not None:
+        for name, prices in benchmark_nav.items():
+            benchmark = returns_from_nav(prices)
+            x, y = returns.align(benchmark, join="inner")
+            if len(x) > 1:
+                metrics[f"Beta vs {name}"] = float(np.cov(x, y)[0, 1] / y.var())
+                metrics[f"Correlation vs {name}"] = float(x.corr(y))
+            if len(x) >= window:
+                series[f"Rolling Beta vs {name}"] = rolling_beta(returns, benchmark, window)
+                series[f"Rolling Correlation vs {name}"] = rolling_correlation(returns, benchmark, window)
+    return {"Metrics": metrics, "Series": series}
@@ -0,0 +1,120 @@
+# Memory-mapped price matrix that any number of processes can map and share
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import db
+from db import connection
+
+MATRIX_DIR = os.getenv("PRICE_MATRIX_DIR", "price_matrix")
+INDEX_FILE = "index.json"
+
+_mapped = {}   # directory -> (index, dates, ticker positions, prices memmap, observed memmap)
+_lock = threading.Lock()
+
+
+def export_price_matrix(directory=MATRIX_DIR):
+    """
+    Writes the aligned universe from stock_prices (every ticker, every trading day)
+    as a float64 file, a bool file of the days each ticker has a close, and a
+    small JSON index (tickers, dates, database and price versions).
+
+    Values are forward-filled and 0 before a ticker's first close, like
+    nav.fetch_historical_prices. The matrices are stored ticker-major so each
+    ticker's history is contiguous and can be sliced by date without copying.
+    The index is swapped in last, so readers never see a half-written export.
+    Returns the path of the index file.
+    """
+    with connection() as conn:
+        # one read transaction, so the versions describe exactly the rows exported
+        conn.execute("BEGIN")
+        history = pd.DataFrame(
+            conn.execute("SELECT ticker, date, close FROM stock_prices").fetchall(),
+            columns=["ticker", "date", "close"]
+        )
+        versions = dict(conn.execute("SELECT ticker, version FROM price_versions").fetchall())
+    raw = history.pivot(index="date", columns="ticker", values="close").sort_index()
+    prices = raw.ffill().fillna(0)
+
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.time_ns()
+    data_file, observed_file = f"prices_{stamp}.f64", f"observed_{stamp}.bool"
+    for name, dtype, values in ((data_file, np.float64, prices.to_numpy(dtype=np.float64)),
+                                (observed_file, np.bool_, raw.notna().to_numpy())):
+        matrix = np.memmap(os.path.join(directory, name), dtype=dtype, mode="w+",
+                           shape=(prices.shape[1], prices.shape[0]))
+        matrix[:] = values.T
+        matrix.flush()
+        del matrix
+
+    index = {
+        "data_file": data_file,
+        "observed_file": observed_file,
+        "database": os.path.abspath(db.DB_PATH),
+        "versions": {t: versions.get(t, 0) for t in prices.columns},
+        "tickers": list(prices.columns),
+        "dates": list(prices.index),
+    }
+    index_path = os.path.join(directory, INDEX_FILE)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+
+    # Readers that read the previous index retry once its files are gone (see
+    # open_price_matrix); on Windows files still mapped can't be removed yet
+    for old in glob.glob(os.path.join(directory, "prices_*.f64")) + glob.glob(os.path.join(directory, "observed_*.bool")):
+        if os.path.basename(old) not in (data_file, observed_file):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return index_path
+
+
+def _read_index(directory):
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def open_price_matrix(directory=MATRIX_DIR, attempts=3):
+    """
+    Maps the latest export read-only. The mapping is reused until a newer export appears.
+    Returns (index, dates, {ticker: row}, prices, observed) with both matrices
+    shaped (tickers, dates); index is the export's JSON index.
+    Raises FileNotFoundError when there is no export.
+    """
+    for attempt in range(attempts):
+        index = _read_index(directory)
+        with _lock:
+            current = _mapped.get(directory)
+            if current is not None and current[0]["data_file"] == index["data_file"]:
+                return current
+            shape = (len(index["tickers"]), len(index["dates"]))
+            try:
+                prices = np.memmap(os.path.join(directory, index["data_file"]), dtype=np.float64, mode="r", shape=shape)
+                observed = np.memmap(os.path.join(directory, index["observed_file"]), dtype=np.bool_, mode="r", shape=shape)
+            except FileNotFoundError:
+                # a newer export replaced the index we read and removed its files
+                if attempt == attempts - 1:
+                    raise
+                continue
+            dates = pd.DatetimeIndex(pd.to_datetime(index["dates"]), name="date")
+            current = (index, dates, {t: i for i, t in enumerate(index["tickers"])}, prices, observed)
+            _mapped[directory] = current
+            return current
+
+
+def price_views(tickers, start_date=None, end_date=None, directory=MATRIX_DIR):
+    """
+    Zero-copy views on the shared matrix.
+    Returns (dates, {ticker: 1-D read-only array}) for dates between start_date
+    and end_date (inclusive). Tickers missing from the export are left out.
+    """
+    _, dates, positions, matrix, _ = open_price_matrix(directory)
+    first = 0 if start_date is None else dates.searchsorted(pd.Timestamp(start_date), side="left")
+    last = len(dates) if end_date is None else dates.searchsorted(pd.Timestamp(end_date), side="right")
+    views = {t: matrix[positions[t], first:last] for t in tickers if t in positions}
+    return dates[first:last], views
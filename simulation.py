@@ -0,0 +1,144 @@
+# Monte Carlo projections of constant-weight portfolios
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Draws (paths x days) generated at once; bounds the memory of a chunk to ~8 bytes per cell
+MAX_CELLS = 2_000_000
+# Histogram resolution of the percentile bands
+BINS = 2000
+
+
+def portfolio_moments(daily_returns: pd.DataFrame, weights):
+    """
+    Daily mean and standard deviation of a constant-weight (daily rebalanced)
+    portfolio, from calculate_daily_returns output and a weight vector / {ticker: weight}.
+    """
+    weights = _weight_vector(daily_returns, weights)
+    mean = daily_returns.mean().to_numpy() @ weights
+    variance = weights @ daily_returns.cov().to_numpy() @ weights
+    return float(mean), float(np.sqrt(max(variance, 0)))
+
+
+def _weight_vector(daily_returns, weights):
+    if isinstance(weights, dict):
+        weights = [weights.get(t, 0.0) for t in daily_returns.columns]
+    return np.asarray(weights, dtype=float)
+
+
+def _band_edges(mean, std, days):
+    """
+    Log-value histogram edges per band day, wide enough (+-10 std) that clipping is negligible.
+    """
+    center = np.log1p(mean) * days
+    half_width = 10 * max(std, 1e-12) * np.sqrt(days) + 1e-9
+    return center - half_width, 2 * half_width / BINS
+
+
+def _simulate_chunk(args):
+    """
+    Simulates one chunk of paths. Returns (band histogram counts, terminal values).
+    """
+    n_paths, horizon, method, params, band_days, low, width, seed = args
+    rng = np.random.default_rng(seed)
+    if method == "parametric":
+        mean, std = params
+        draws = rng.normal(mean, std, (n_paths, horizon))
+    else:
+        history = params
+        draws = history[rng.integers(0, len(history), (n_paths, horizon))]
+
+    # log growth so a path value is exp(cumulative sum); returns below -100% wipe the path out
+    np.log1p(np.maximum(draws, -1 + 1e-12), out=draws)
+    np.cumsum(draws, axis=1, out=draws)
+
+    at_days = draws[:, band_days - 1]
+    bins = np.clip(((at_days - low) / width).astype(np.int64), 0, BINS - 1)
+    flat = bins + (np.arange(len(band_days)) * BINS)[None, :]
+    counts = np.bincount(flat.ravel(), minlength=len(band_days) * BINS).reshape(len(band_days), BINS)
+    return counts, np.exp(draws[:, -1])
+
+
+def _histogram_percentiles(counts, low, width, percentiles):
+    """
+    Percentiles per row of a histogram, interpolating linearly inside the bin.
+    """
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1:]
+    out = np.empty((counts.shape[0], len(percentiles)))
+    for j, q in enumerate(percentiles):
+        target = q / 100 * total
+        k = (cumulative < target).sum(axis=1)
+        k = np.minimum(k, BINS - 1)
+        rows = np.arange(counts.shape[0])
+        before = np.where(k > 0, cumulative[rows, k - 1], 0)
+        inside = np.divide(target[:, 0] - before, counts[rows, k],
+                           out=np.zeros(len(rows)), where=counts[rows, k] > 0)
+        out[:, j] = low + width * (k + inside)
+    return out
+
+
+def simulate_portfolio(daily_returns: pd.DataFrame, weights, years=5, n_paths=10_000,
+                       method="parametric", initial_value=1.0, percentiles=(5, 25, 50, 75, 95),
+                       band_points=120, seed=None, workers=1):
+    """
+    Projects a constant-weight portfolio over `years` (252 trading days each).
+
+    daily_returns: calculate_daily_returns output (dates x tickers)
+    weights: vector in column order or {ticker: weight}
+    method: 'parametric' draws normal daily portfolio returns with the estimated
+            mean and std; 'bootstrap' resamples historical days (keeping the
+            cross-asset structure and fat tails of the sample)
+    Paths are generated in chunks of at most MAX_CELLS draws, so memory does not
+    grow with n_paths; percentile bands come from per-day histograms. Each chunk
+    has its own seed from SeedSequence(seed), so results do not depend on
+    `workers` (processes used; 1 runs in-process).
+
+    Returns {
+        "Bands": DataFrame (trading day -> percentile columns 'P5', ...) of portfolio value,
+        "Terminal Values": array of the n_paths final values,
+        "Terminal Percentiles": {'P5': value, ...},
+        "Expected Value": mean final value,
+        "Probability of Loss": share of paths ending below initial_value,
+    }
+    """
+    if method not in ("parametric", "bootstrap"):
+        raise ValueError("Invalid method. Choose 'parametric' or 'bootstrap'.")
+    horizon = int(round(years * 252))
+    weights = _weight_vector(daily_returns, weights)
+    history = daily_returns.to_numpy(dtype=float) @ weights
+    mean, std = portfolio_moments(daily_returns, weights)
+    params = (mean, std) if method == "parametric" else history
+
+    band_days = np.unique(np.linspace(1, horizon, min(band_points, horizon)).round().astype(int))
+    low, width = _band_edges(mean, std if method == "parametric" else history.std(), band_days)
+
+    chunk_paths = max(1, MAX_CELLS // horizon)
+    sizes = [min(chunk_paths, n_paths - start) for start in range(0, n_paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(size, horizon, method, params, band_days, low, width, child) for size, child in zip(sizes, seeds)]
+
+    # histograms are summed as chunks arrive, so only the terminal values grow with n_paths
+    counts = np.zeros((len(band_days), BINS), dtype=np.int64)
+    terminal = np.empty(n_paths)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    try:
+        results = pool.map(_simulate_chunk, tasks) if pool else map(_simulate_chunk, tasks)
+        start = 0
+        for chunk_counts, chunk_terminal in results:
+            counts += chunk_counts
+            terminal[start:start + len(chunk_terminal)] = chunk_terminal
+            start += len(chunk_terminal)
+    finally:
+        if pool:
+            pool.shutdown()
+    terminal *= initial_value
+    labels = [f"P{q:g}" for q in percentiles]
+    bands = np.exp(_histogram_percentiles(counts, low, width, percentiles))
+    return {
+        "Bands": pd.DataFrame(initial_value * bands, index=pd.Index(band_days, name="day"), columns=labels),
+        "Terminal Values": terminal,
+        "Terminal Percentiles": dict(zip(labels, np.percentile(terminal, percentiles))),
+        "Expected Value": float(terminal.mean()),
+        "Probability of Loss": float((terminal < initial_value).mean()),
+    }
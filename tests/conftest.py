@@ -0,0 +1,22 @@
+# Modules live at the repository root; make them importable from the tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database(tmp_path):
+    import db
+    import nav
+    import portfolio_db
+    previous = db.DB_PATH
+    db.configure(str(tmp_path / "portfolio.db"))
+    # price versions restart with every database, so cached series would look current
+    nav.PRICE_CACHE.clear()
+    portfolio_db.init_portfolio_tables()
+    yield portfolio_db
+    nav.PRICE_CACHE.clear()
+    db.configure(previous)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+
+
+def _returns(days=400, assets=5, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("2020-01-01", periods=days)
+    return pd.DataFrame(rng.normal(0.0005, 0.01, (days, assets)), index=index,
+                        columns=[f"T{i}" for i in range(assets)])
+
+
+def test_failed_solve_keeps_the_drifted_holdings(monkeypatch):
+    returns = _returns()
+    solve = backtest.optimize_from_moments
+    calls = []
+
+    def flaky(*args, **kwargs):
+        result = solve(*args, **kwargs)
+        calls.append(result)
+        if len(calls) == 2:
+            result.success = False
+        return result
+
+    monkeypatch.setattr(backtest, "optimize_from_moments", flaky)
+    result = backtest.walk_forward(returns, "min_vol", lookback=120)
+    skipped = result["Skipped"]
+    assert len(skipped) == 1 and skipped[0] == result["Weights"].index[1]
+    assert result["Turnover"].iat[1] == pytest.approx(0.0, abs=1e-12)
+    assert result["Weights"].iloc[1].sum() == pytest.approx(1.0)
+
+
+def test_failed_first_solve_raises(monkeypatch):
+    def failing(*args, **kwargs):
+        result = solve(*args, **kwargs)
+        result.success = False
+        return result
+
+    solve = backtest.optimize_from_moments
+    monkeypatch.setattr(backtest, "optimize_from_moments", failing)
+    with pytest.raises(ValueError, match="Optimization failed"):
+        backtest.walk_forward(_returns(), "sharpe", lookback=120)
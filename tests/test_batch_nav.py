@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import batch_nav
+import nav
+import shared_prices
+from benchmarks.synthetic import load_universe, make_holdings, make_universe
+from db import connection
+
+
+def _reference(portfolio_id):
+    holdings = nav.get_portfolio_holdings(portfolio_id)
+    tickers = tuple(dict.fromkeys(h["ticker"] for h in holdings))
+    prices = nav.fetch_historical_prices(tickers, min(h["entry_date"] for h in holdings))
+    return nav.compute_weighted_nav(prices, holdings)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_batch_navs_match_compute_weighted_nav(database, tmp_path, monkeypatch, shared):
+    prices = make_universe(12, 2, seed=3)
+    load_universe(prices)
+    tickers = list(prices.columns)
+    # two tickers skip the 15th of every month, so their portfolios have a calendar of their own
+    with connection() as conn:
+        conn.execute("DELETE FROM stock_prices WHERE ticker IN (?, ?) AND date LIKE '%-15'", tickers[:2])
+    listed = prices.index[(prices.iloc[:, :2] > 0).all(axis=1)]
+    day = lambda i: listed[i].strftime("%Y-%m-%d")
+
+    pids = []
+    rng = np.random.default_rng(0)
+    for i in range(12):
+        pid = database.create_portfolio(1, f"p{i}", "MAD")
+        chosen = prices.iloc[:, rng.choice(12, rng.integers(1, 5), replace=False)]
+        holdings = make_holdings(chosen, int(rng.integers(1, 8)), seed=i)
+        database.add_holdings(pid, [(h["ticker"], h["entry_date"].strftime("%Y-%m-%d"), h["entry_price"], h["quantity"])
+                                    for h in holdings])
+        pids.append(pid)
+    # purchases on a weekday only other portfolios' tickers trade, and on a Saturday
+    pid = database.create_portfolio(1, "own calendar", "MAD")
+    gap = next(d for d in prices.index if d.day == 15 and d > listed[0])
+    saturday = gap + pd.offsets.Week(weekday=5)
+    database.add_holdings(pid, [
+        (tickers[0], day(0), float(prices.loc[listed[0], tickers[0]]), 10.0),
+        (tickers[1], day(1), float(prices.loc[listed[1], tickers[1]]), 10.0),
+        (tickers[0], gap.strftime("%Y-%m-%d"), 90.0, 20.0),
+        (tickers[1], saturday.strftime("%Y-%m-%d"), 50.0, 5.0),
+        (tickers[1], day(60), 50.0, 5.0),
+    ])
+    pids.append(pid)
+
+    if shared:
+        monkeypatch.setattr(shared_prices, "MATRIX_DIR", str(tmp_path))
+        shared_prices.export_price_matrix(str(tmp_path))
+        assert nav.load_shared_prices(tickers, "2000-01-01") is not None
+    navs = dict(batch_nav.batch_navs(max_cells=50_000))
+    assert sorted(navs) == sorted(pids)
+    for pid in pids:
+        pd.testing.assert_series_equal(navs[pid], _reference(pid), check_names=False, check_freq=False,
+                                       check_index_type=False, rtol=1e-10)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("yfinance")
+import data_handler
+
+
+def _provider(calls, failing):
+    dates = pd.bdate_range("2024-01-01", pd.Timestamp.today().normalize())
+
+    def provider(tickers, start, end):
+        calls.append((tuple(tickers), start, end))
+        frame = pd.DataFrame({t: np.linspace(10, 20, len(dates)) for t in tickers}, index=dates)
+        # like yfinance on a rate limit: the ticker comes back as an all-NaN column
+        frame.loc[:, [t for t in tickers if t in failing]] = np.nan
+        return frame[(frame.index >= start) & (frame.index < end)]
+    return provider
+
+
+def test_empty_download_is_fetched_again(tmp_path):
+    calls, failing = [], {"BBB"}
+    provider = _provider(calls, failing)
+    first = data_handler.load_prices(["AAA", "BBB"], "2024-03-01", provider=provider, cache_dir=str(tmp_path))
+    assert list(first.columns) == ["AAA"]
+    assert first.attrs["download_errors"] == {"BBB": data_handler.NO_DATA}
+
+    failing.clear()
+    calls.clear()
+    second = data_handler.load_prices(["AAA", "BBB"], "2024-03-01", provider=provider, cache_dir=str(tmp_path))
+    assert calls == [(("BBB",), "2024-03-01", calls[0][2])]
+    assert list(second.columns) == ["AAA", "BBB"]
+    assert second.index[0] == pd.Timestamp("2024-03-01")
+
+    calls.clear()
+    data_handler.load_prices(["AAA", "BBB"], "2024-03-01", provider=provider, cache_dir=str(tmp_path))
+    assert calls == []
+
+
+def test_empty_delta_window_counts_as_covered(tmp_path):
+    calls = []
+    provider = _provider(calls, set())
+    data_handler.load_prices(["AAA"], "2024-03-01", provider=provider, cache_dir=str(tmp_path))
+    series, covered = data_handler._read_cached(str(tmp_path), "AAA")
+    # a cache that stopped before a stretch of days without closes
+    data_handler._write_cached(str(tmp_path), "AAA", series, (covered[0], series.index[-1] - pd.Timedelta(days=3)))
+
+    def holiday(tickers, start, end):
+        calls.append((tuple(tickers), start, end))
+        return pd.DataFrame()
+
+    data_handler.load_prices(["AAA"], "2024-03-01", provider=holiday, cache_dir=str(tmp_path))
+    calls.clear()
+    data_handler.load_prices(["AAA"], "2024-03-01", provider=holiday, cache_dir=str(tmp_path))
+    assert calls == []
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ledger import build_ledger, transactions_frame
+
+
+def _ledger(rows, closes=100.0):
+    tx = transactions_frame(rows)
+    dates = pd.bdate_range(tx["date"].iloc[0], tx["date"].iloc[-1])
+    tickers = list(dict.fromkeys(tx["ticker"].dropna()))
+    prices = pd.DataFrame(closes, index=dates, columns=tickers)
+    return build_ledger(tx, prices)
+
+
+@pytest.mark.parametrize("lots", [(10.1, 20.2), (0.1, 0.2), (1 / 3, 1 / 3, 1 / 3), (0.7, 0.1, 0.2)])
+def test_fractional_close_then_reopen_starts_a_fresh_cycle(lots):
+    rows = [("2024-01-02", "buy", "AAA", q, 100.0, None, 0.0) for q in lots]
+    rows.append(("2024-01-03", "sell", "AAA", sum(lots), 100.0, None, 0.0))
+    rows += [("2024-01-04", "buy", "AAA", 1.0, 50.0, None, 0.0),
+             ("2024-01-05", "sell", "AAA", 1.0, 50.0, None, 0.0)]
+    result = _ledger(rows)
+
+    realized = result["Realized"]
+    assert realized["Average Cost"].tolist() == pytest.approx([100.0, 50.0])
+    assert realized["Realized P&L"].tolist() == pytest.approx([0.0, 0.0], abs=1e-9)
+    assert result["Daily"]["Cost Basis"].iat[-1] == 0.0
+    assert (result["Positions"]["AAA"].iloc[[1, 3]] == 0.0).all()
+    assert result["Positions"]["AAA"].iat[2] == 1.0
+
+
+def test_partial_sells_keep_the_average_cost():
+    rows = [("2024-01-02", "buy", "AAA", 0.3, 10.0, None, 0.0),
+            ("2024-01-02", "buy", "AAA", 0.6, 40.0, None, 0.0),
+            ("2024-01-03", "sell", "AAA", 0.45, 50.0, None, 0.0),
+            ("2024-01-04", "sell", "AAA", 0.45, 20.0, None, 0.0)]
+    realized = _ledger(rows)["Realized"]
+    assert realized["Average Cost"].tolist() == pytest.approx([30.0, 30.0])
+    assert realized["Realized P&L"].tolist() == pytest.approx([9.0, -4.5])
+
+
+def test_sell_beyond_position_raises():
+    rows = [("2024-01-02", "buy", "AAA", 1.0, 10.0, None, 0.0),
+            ("2024-01-03", "sell", "AAA", 1.5, 10.0, None, 0.0)]
+    with pytest.raises(ValueError, match="exceeds the position held"):
+        _ledger(rows)
+
+
+def test_check_transactions_rejects_invalid_adds_and_deletes(database):
+    from ledger import check_transactions
+    pid = database.create_portfolio(1, "p", "MAD")
+    database.add_holding(pid, "AAA", "2024-01-02", 10.0, 5.0)
+    database.add_transaction(pid, "buy", "2024-01-03", "AAA", 5.0, 12.0)
+    check_transactions(pid, new_rows=[("2024-01-04", "sell", "AAA", 10.0, 15.0, None, 0.0)])
+    with pytest.raises(ValueError, match="exceeds the position held"):
+        check_transactions(pid, new_rows=[("2024-01-04", "sell", "AAA", 11.0, 15.0, None, 0.0)])
+    with pytest.raises(ValueError):
+        check_transactions(pid, new_rows=[("2024-01-04", "sell", "AAA", None, 15.0, None, 0.0)])
+
+    database.add_transaction(pid, "sell", "2024-01-04", "AAA", 8.0, 15.0)
+    (buy_id, *_), (sell_id, *_) = database.get_transactions(pid, with_ids=True)
+    with pytest.raises(ValueError, match="exceeds the position held"):
+        check_transactions(pid, removed_ids={buy_id})
+    check_transactions(pid, removed_ids={sell_id})
+    database.delete_transaction(pid, sell_id)
+    assert [row[0] for row in database.get_transactions(pid, with_ids=True)] == [buy_id]
+
+
+def test_withdrawals_beyond_cash_raise():
+    rows = [("2024-01-02", "buy", "AAA", 10.0, 100.0, None, 0.0),
+            ("2024-01-03", "withdrawal", None, None, None, 5000.0, 0.0)]
+    with pytest.raises(ValueError, match="exceeds the cash available"):
+        _ledger(rows)
+
+    rows = [("2024-01-02", "buy", "AAA", 10.0, 100.0, None, 0.0),
+            ("2024-01-03", "sell", "AAA", 4.0, 100.0, None, 0.0),
+            ("2024-01-04", "withdrawal", None, None, None, 400.0, 0.0),
+            ("2024-01-05", "buy", "AAA", 1.0, 100.0, None, 0.0)]
+    daily = _ledger(rows)["Daily"]
+    assert daily["Flows"].tolist() == pytest.approx([1000.0, 0.0, -400.0, 100.0])
+    assert daily["Cash"].tolist() == pytest.approx([0.0, 400.0, 0.0, 0.0])
+    with pytest.raises(ValueError, match="exceeds the cash available"):
+        _ledger(rows[:2] + [("2024-01-04", "withdrawal", None, None, None, 400.01, 0.0)])
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import nav
+from benchmarks.synthetic import load_universe, make_holdings, make_universe
+from db import connection
+
+
+def test_dashboard_cache_keeps_other_benchmark_selections(database):
+    prices = make_universe(4, 1, seed=2)
+    load_universe(prices)
+    tickers = list(prices.columns)
+    pid = database.create_portfolio(1, "p", "MAD")
+    database.add_holdings(pid, [(h["ticker"], h["entry_date"].strftime("%Y-%m-%d"), h["entry_price"], h["quantity"])
+                                for h in make_holdings(prices[tickers[:2]], 3)])
+    nav.invalidate_dashboard()
+
+    with_benchmark = nav.build_dashboard(pid, [tickers[3]])
+    without = nav.build_dashboard(pid, [])
+    assert nav.build_dashboard(pid, [tickers[3]]) is with_benchmark
+    assert nav.build_dashboard(pid, []) is without
+
+    # new holdings make both selections stale
+    database.add_holding(pid, tickers[2], prices.index[-5].strftime("%Y-%m-%d"), 10.0, 1.0)
+    assert nav.build_dashboard(pid, []) is not without
+    assert len(nav.DASHBOARD_CACHE) == 1
+
+
+def _loop_nav(stock_prices, holdings):
+    # compute_weighted_nav before it was vectorized, kept as the reference
+    stock_returns = stock_prices.pct_change().fillna(0)
+    nav_series = pd.Series(index=stock_prices.index, dtype=float)
+    portfolio_weights, active_stocks, entry_prices = {}, {}, {}
+    nav_series.iloc[0] = prev_nav = 100
+    purchase_lookup = {}
+    for h in holdings:
+        purchase_lookup.setdefault(h["entry_date"], []).append(h)
+    for i, today in enumerate(stock_prices.index):
+        if today in purchase_lookup:
+            for new_purchase in purchase_lookup[today]:
+                ticker = new_purchase["ticker"]
+                active_stocks[ticker] = active_stocks.get(ticker, 0) + new_purchase["quantity"]
+                entry_prices[ticker] = new_purchase["entry_price"]
+            navs = {}
+            for ticker, qty in active_stocks.items():
+                if today == holdings[0]["entry_date"]:
+                    current_price = entry_prices[ticker]
+                elif ticker in entry_prices and today == next((h["entry_date"] for h in holdings if h["ticker"] == ticker), None):
+                    current_price = entry_prices[ticker]
+                else:
+                    current_price = stock_prices.at[today, ticker]
+                navs[ticker] = qty * current_price
+            total_value = sum(navs.values())
+            portfolio_weights = {ticker: navs[ticker] / total_value for ticker in active_stocks}
+        weighted_return = sum(weight * stock_returns.at[today, ticker] for ticker, weight in portfolio_weights.items())
+        if i > 0:
+            prev_nav = prev_nav * (1 + weighted_return)
+            nav_series.iloc[i] = prev_nav
+    return nav_series
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_compute_weighted_nav_matches_the_loop(seed):
+    prices = make_universe(6, 1, seed=seed)
+    holdings = make_holdings(prices, 12, seed=seed)
+    rng = np.random.default_rng(seed)
+    # repeat purchases on the same day, and one dated on a weekend (no prices, ignored)
+    holdings += [dict(holdings[i], quantity=float(rng.integers(1, 50))) for i in rng.choice(12, 3)]
+    holdings.append(dict(holdings[0], entry_date=holdings[0]["entry_date"] + pd.offsets.Week(weekday=5)))
+    rng.shuffle(holdings)
+    pd.testing.assert_series_equal(nav.compute_weighted_nav(prices, holdings), _loop_nav(prices, holdings),
+                                   check_names=False, check_freq=False, rtol=1e-10)
+
+
+def test_refresh_portfolio_nav_matches_a_full_recompute(database, monkeypatch):
+    prices = make_universe(5, 2, seed=7)
+    tickers = list(prices.columns)
+    cut = len(prices) // 2
+    load_universe(prices.iloc[:cut])
+    pid = database.create_portfolio(1, "p", "MAD")
+    database.add_holdings(pid, [(h["ticker"], h["entry_date"].strftime("%Y-%m-%d"), h["entry_price"], h["quantity"])
+                                for h in make_holdings(prices.iloc[:cut - 60], 6, seed=7)])
+
+    # refreshes that resume from a stored state (full computations pass none)
+    resumed = []
+    weighted_nav_path = nav.weighted_nav_path
+
+    def spy(stock_prices, holdings, state=None):
+        if state is not None:
+            resumed.append(stock_prices.index[0])
+        return weighted_nav_path(stock_prices, holdings, state)
+    monkeypatch.setattr(nav, "weighted_nav_path", spy)
+
+    def check():
+        holdings = nav.get_portfolio_holdings(pid)
+        held = tuple(dict.fromkeys(h["ticker"] for h in holdings))
+        full = nav.compute_weighted_nav(nav.fetch_historical_prices(held, min(h["entry_date"] for h in holdings)), holdings)
+        pd.testing.assert_series_equal(nav.refresh_portfolio_nav(pid), full, check_names=False, check_freq=False,
+                                       check_index_type=False, rtol=1e-10)
+
+    check()
+    # (a) new closes appended
+    load_universe(prices.iloc[cut:cut + 40])
+    database.bump_price_versions(tickers, {t: prices.index[cut].strftime("%Y-%m-%d") for t in tickers})
+    check()
+    # (b) a holding dated in the past
+    late = make_holdings(prices.iloc[cut - 40:cut - 20], 1, seed=8)[0]
+    database.add_holding(pid, late["ticker"], late["entry_date"].strftime("%Y-%m-%d"), late["entry_price"], late["quantity"])
+    check()
+    # (c) restated closes of a held ticker
+    held = nav.get_portfolio_holdings(pid)[0]["ticker"]
+    restated = prices.index[cut - 10].strftime("%Y-%m-%d")
+    with connection() as conn:
+        conn.execute("UPDATE stock_prices SET close = close * 1.1 WHERE ticker = ? AND date >= ?", (held, restated))
+    database.bump_price_versions([held], {held: restated})
+    check()
+    assert len(resumed) == 3
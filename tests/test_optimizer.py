@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from scipy.optimize import minimize
+
+import optimizer
+
+
+@pytest.mark.parametrize("bounds", [None, (0, 0.3), (-0.5, 1)])
+def test_max_sharpe_qp_matches_the_ratio_solve(bounds):
+    rng = np.random.default_rng(7)
+    returns = rng.normal(rng.normal(0.0004, 0.0005, 20), 0.01, (300, 20))
+    mean, cov = optimizer.compute_moments(returns)
+    weight_bounds = optimizer._weight_bounds(20, bounds)
+    objective, gradient = optimizer._objective("sharpe", mean, cov)
+    ratio = minimize(objective, np.full(20, 0.05), jac=gradient, method="SLSQP",
+                     bounds=weight_bounds, constraints=optimizer.BUDGET_CONSTRAINT)
+
+    result = optimizer.optimize_from_moments(mean, cov, "sharpe", bounds=bounds)
+    assert result.success
+    assert result.x.sum() == pytest.approx(1.0)
+    low, high = np.array(weight_bounds).T
+    assert (result.x >= low - 1e-8).all() and (result.x <= high + 1e-8).all()
+    assert -result.fun >= -ratio.fun - 1e-9
+    assert -result.fun == pytest.approx(optimizer.performance_from_moments(result.x, mean, cov)[2])
+
+
+def test_max_sharpe_without_positive_returns_falls_back_to_the_ratio():
+    rng = np.random.default_rng(1)
+    returns = rng.normal(-0.001, 0.01, (300, 4))
+    mean, cov = optimizer.compute_moments(returns)
+    result = optimizer.optimize_from_moments(mean, cov, "sharpe")
+    assert result.success and result.x.sum() == pytest.approx(1.0)
+
+
+def test_efficient_frontier_leaves_out_failed_points(monkeypatch):
+    import pandas as pd
+    rng = np.random.default_rng(3)
+    returns = pd.DataFrame(rng.normal(0.0005, 0.01, (300, 6)))
+    complete = optimizer.efficient_frontier(returns, n_points=20)
+    solve = optimizer.minimize
+    calls = []
+
+    def flaky(*args, **kwargs):
+        result = solve(*args, **kwargs)
+        calls.append(result)
+        if len(calls) == 5:  # the first call is the minimum-volatility point
+            result.success = False
+        return result
+
+    monkeypatch.setattr(optimizer, "minimize", flaky)
+    frontier = optimizer.efficient_frontier(returns, n_points=20)
+    assert len(frontier["Annual Return"]) == len(frontier["Weights"]) == 19
+    assert np.allclose(np.delete(complete["Volatility"], 4), frontier["Volatility"], atol=1e-5)
+
+
+def test_time_limit_covers_the_qp_and_the_fallback(monkeypatch):
+    rng = np.random.default_rng(2)
+    mean, cov = optimizer.compute_moments(rng.normal(0.0005, 0.01, (300, 5)))
+    clock = [0.0]
+    monkeypatch.setattr(optimizer.time, "monotonic", lambda: clock[0])
+
+    def slow_qp(mean, cov, bounds, initial_weights, callback=None):
+        clock[0] += 1.5
+        return None
+    monkeypatch.setattr(optimizer, "_max_sharpe_qp", slow_qp)
+    assert optimizer.optimize_from_moments(mean, cov, "sharpe", time_limit=2).success
+    with pytest.raises(TimeoutError):
+        optimizer.optimize_from_moments(mean, cov, "sharpe", time_limit=1)
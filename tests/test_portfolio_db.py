@@ -0,0 +1,27 @@
+import pandas as pd
+
+from db import connection
+
+
+def test_migrate_price_blobs_round_trips_table_json(database):
+    # blobs as written by historical_prices/make_prices.py (string dates) and correct_prices.py (datetimes)
+    masi = pd.DataFrame({"MASI": [12000.5, 12010.25, 11990.0]},
+                        index=pd.Index(["2024-01-02", "2024-01-03", "2024-01-04"], name="date"))
+    aaa = pd.DataFrame({"AAA": [10.0, None, 10.5, 11.125]},
+                       index=pd.DatetimeIndex(["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"], name="date"))
+    with connection() as conn:
+        conn.executemany("INSERT INTO stocks (ticker, company, prices) VALUES (?, ?, ?)", [
+            ("MASI", "MASI", masi.to_json(orient="table")),
+            ("AAA", "Company AAA", aaa.to_json(orient="table")),
+            ("BBB", "Company BBB", None),
+        ])
+        conn.execute("INSERT INTO stock_prices (ticker, date, close) VALUES ('AAA', '2024-01-05', 11.0)")
+
+    assert database.migrate_price_blobs() == 5
+    with connection() as conn:
+        rows = conn.execute("SELECT ticker, date, close FROM stock_prices ORDER BY ticker, date").fetchall()
+    assert rows == [
+        ("AAA", "2024-01-02", 10.0), ("AAA", "2024-01-04", 10.5), ("AAA", "2024-01-05", 11.0),
+        ("MASI", "2024-01-02", 12000.5), ("MASI", "2024-01-03", 12010.25), ("MASI", "2024-01-04", 11990.0),
+    ]
+    assert database.migrate_price_blobs() == 0
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+import risk
+
+
+def _returns():
+    rng = np.random.default_rng(5)
+    index = pd.bdate_range("2023-01-02", periods=200)
+    frame = pd.DataFrame(rng.normal(0.0005, 0.01, (200, 3)), index=index, columns=["A", "B", "C"])
+    benchmark = pd.Series(rng.normal(0.0004, 0.008, 200), index=index, name="MASI")
+    frame.iloc[[30, 31], 0] = np.nan
+    frame.iloc[120, 1] = np.nan
+    benchmark.iloc[80] = np.nan
+    return frame, benchmark
+
+
+def test_rolling_series_recover_after_nans_like_pandas():
+    frame, benchmark = _returns()
+    window = 20
+    pd.testing.assert_frame_equal(risk.rolling_volatility(frame, window),
+                                  frame.rolling(window).std() * np.sqrt(252), rtol=1e-8)
+    var = -(frame.rolling(window).mean() + norm.ppf(0.05) * frame.rolling(window).std())
+    pd.testing.assert_frame_equal(risk.rolling_value_at_risk(frame, window), var, rtol=1e-8)
+
+    beta, correlation = risk.rolling_beta(frame, benchmark, window), risk.rolling_correlation(frame, benchmark, window)
+    for column in frame.columns:
+        x = frame[column]
+        pair = x.notna() & benchmark.notna()
+        y = benchmark.where(pair)
+        expected = x.where(pair).rolling(window).cov(y) / y.rolling(window).var()
+        pd.testing.assert_series_equal(beta[column], expected, check_names=False, rtol=1e-8)
+        pd.testing.assert_series_equal(correlation[column], x.rolling(window).corr(benchmark),
+                                       check_names=False, rtol=1e-8)
+
+    # the values come back once the NaNs have left the window
+    volatility = risk.rolling_volatility(frame["A"], window)
+    assert volatility.iloc[30:32 + window - 1].isna().all()
+    assert volatility.iloc[32 + window - 1:].notna().all()
+
+
+def test_rolling_stats_stream_matches_the_batch_series():
+    frame, benchmark = _returns()
+    window = 20
+    stats = risk.RollingStats(window)
+    streamed = pd.DataFrame([stats.update(x, y) for x, y in zip(frame["A"], benchmark)], index=frame.index)
+    # the stream works on pairs, so a missing benchmark return also leaves out the portfolio's
+    paired = frame["A"].where(benchmark.notna())
+    pd.testing.assert_series_equal(streamed["Volatility"], risk.rolling_volatility(paired, window),
+                                   check_names=False, rtol=1e-6)
+    pd.testing.assert_series_equal(streamed["Beta"], risk.rolling_beta(frame["A"], benchmark, window),
+                                   check_names=False, rtol=1e-6)
@@ -0,0 +1,58 @@
+import numpy as np
+
+import db
+import nav
+import shared_prices
+from benchmarks.synthetic import load_universe, make_universe
+
+
+def test_price_views_are_zero_copy_slices_of_the_export(database, tmp_path):
+    prices = make_universe(5, 1, seed=4)
+    load_universe(prices)
+    shared_prices.export_price_matrix(str(tmp_path))
+    start, end = prices.index[20], prices.index[80]
+
+    dates, views = shared_prices.price_views(["T0001", "T0003", "MISSING"], start, end, directory=str(tmp_path))
+    _, _, _, matrix, _ = shared_prices.open_price_matrix(str(tmp_path))
+    assert sorted(views) == ["T0001", "T0003"]
+    assert dates[0] == start and dates[-1] == end
+    for ticker, view in views.items():
+        assert np.shares_memory(view, matrix) and not view.flags.writeable
+        expected = prices[ticker].where(prices[ticker] > 0).ffill().fillna(0).loc[start:end]
+        assert np.array_equal(view, expected.to_numpy())
+
+
+def test_load_shared_prices_only_serves_a_current_export(database, tmp_path):
+    prices = make_universe(4, 1, seed=5)
+    load_universe(prices)
+    directory = str(tmp_path)
+    assert nav.load_shared_prices(["T0000"], "2020-01-01", directory) is None
+
+    shared_prices.export_price_matrix(directory)
+    start = prices.index[30].strftime("%Y-%m-%d")
+    shared, observed = nav.load_shared_prices(["T0000", "T0002", "MISSING"], start, directory)
+    _, _, _, matrix, _ = shared_prices.open_price_matrix(directory)
+    assert list(shared.columns) == ["T0000", "T0002"]
+    assert shared.index[0] == prices.index[29]
+    assert all(np.shares_memory(shared[t].to_numpy(), matrix) for t in shared.columns)
+    assert observed.equals(prices.loc[prices.index[29]:, ["T0000", "T0002"]].gt(0).rename_axis("date"))
+
+    database.bump_price_versions(["T0002"])
+    assert nav.load_shared_prices(["T0000", "T0002"], start, directory) is None
+    assert nav.load_shared_prices(["T0000"], start, directory) is not None
+    db.configure(str(tmp_path / "other.db"))
+    assert nav.load_shared_prices(["T0000"], start, directory) is None
+
+
+def test_reader_retries_when_the_export_it_read_is_replaced(database, tmp_path, monkeypatch):
+    load_universe(make_universe(3, 1, seed=6))
+    directory = str(tmp_path)
+    shared_prices.export_price_matrix(directory)
+    stale = shared_prices._read_index(directory)
+    shared_prices.export_price_matrix(directory)
+
+    indexes = iter([stale])
+    read_index = shared_prices._read_index
+    monkeypatch.setattr(shared_prices, "_read_index", lambda d: next(indexes, None) or read_index(d))
+    index, _, _, _, _ = shared_prices.open_price_matrix(directory)
+    assert index["data_file"] != stale["data_file"]
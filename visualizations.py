@@ -29,3 +29,31 @@ def plot_cumulative_returns(cumulative_returns: pd.DataFrame, title: str = "Cumu
         ))
     fig.update_layout(title=title, xaxis_title="Date", yaxis_title="Cumulative Return", hovermode="x unified")
     return fig
+
+
+def plot_efficient_frontier(frontier: dict, portfolios: dict = None, title: str = "Efficient Frontier"):
+    """
+    Plots the frontier returned by optimizer.efficient_frontier as a curve,
+    with optional named portfolios ({label: (volatility, annual return)}) as markers.
+    Returns the Plotly figure for Streamlit rendering.
+    """
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=frontier["Volatility"],
+        y=frontier["Annual Return"],
+        mode='lines',
+        name="Efficient Frontier",
+        customdata=frontier["Sharpe Ratio"],
+        hovertemplate="Volatility: %{x:.2%}<br>Return: %{y:.2%}<br>Sharpe: %{customdata:.2f}"
+    ))
+    for label, (volatility, annual_return) in (portfolios or {}).items():
+        fig.add_trace(go.Scatter(
+            x=[volatility],
+            y=[annual_return],
+            mode='markers',
+            marker=dict(size=12),
+            name=label
+        ))
+    fig.update_layout(title=title, xaxis_title="Volatility", yaxis_title="Annual Return",
+                      xaxis_tickformat=".0%", yaxis_tickformat=".0%")
+    return fig